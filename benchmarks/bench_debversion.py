@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Compare the in-process version comparison with forking
+"dpkg --compare-versions".
+
+    python benchmarks/bench_debversion.py [rounds]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+from fwutil.debversion import check_relation  # noqa
+
+
+PAIRS = [
+    ("1.0.0", "1.1.0"),
+    ("1:2.3.4-1ubuntu1", "1:2.3.4-1ubuntu1.1"),
+    ("1.0~rc1", "1.0"),
+    ("2.6.32-5-686", "2.6.32-5-amd64")
+]
+
+
+def in_process():
+    for a, b in PAIRS:
+        check_relation(a, "le", b)
+
+
+def subprocess_dpkg():
+    import sh
+    for a, b in PAIRS:
+        try:
+            sh.dpkg("--compare-versions", a, "le", b)
+        except sh.ErrorReturnCode:
+            pass
+
+
+def main(rounds):
+    result = {}
+    for name, func in [("in-process", in_process),
+                       ("dpkg", subprocess_dpkg)]:
+        number = rounds if name == "dpkg" else rounds * 100
+        elapsed = min(timeit.repeat(func, number=number, repeat=3))
+        result[name] = elapsed / (number * len(PAIRS))
+        print "%-12s %12.3f us/compare" % (name, result[name] * 1000000)
+    print "speedup      %12.1fx" % (result["dpkg"] / result["in-process"])
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
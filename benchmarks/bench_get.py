@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Micro-benchmark of GET /system/firmware with the Mockup connection: the
+old route (pversion | awk on every request) against the cached version.
+
+    python benchmarks/bench_get.py [rounds]
+"""
+
+import os
+import sys
+import timeit
+
+import sh
+from sanji.connection.mockup import Mockup
+from sanji.message import Message
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dirpath + "/../")
+os.environ["PATH"] = dirpath + "/../tests:" + os.environ["PATH"]
+from firmware import Firmware  # noqa
+
+
+def response(code=200, data=None):
+    return data
+
+
+def main(rounds):
+    bundle = Firmware(connection=Mockup())
+    message = Message({"data": {}, "query": {}, "param": {}})
+
+    def before():
+        output = sh.awk(sh.pversion(), "{print $3}")
+        bundle.model.db["version"] = str(output.split()[0])
+        response(data=bundle.model.db)
+
+    def after():
+        bundle.get(message=message, response=response, test=True)
+
+    try:
+        result = {}
+        for name, func, number in [("before", before, rounds),
+                                   ("after", after, rounds * 1000)]:
+            elapsed = min(timeit.repeat(func, number=number, repeat=3))
+            result[name] = elapsed / number
+            print "%-8s %12.3f us/request" % (name, result[name] * 1000000)
+        print "speedup  %12.1fx" % (result["before"] / result["after"])
+    finally:
+        bundle.stop()
+        for ext in ["", ".backup"]:
+            try:
+                os.remove("%s/../tests/data/firmware.json%s" % (dirpath, ext))
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Latency percentiles and throughput of the routes and operations of the
+bundle, run with the Mockup connection and the fake tools of tests/. The
+results are written as JSON to compare them across versions.
+
+    python benchmarks/bench_suite.py [-n rounds] [-o results.json]
+                                     [-b baseline.json]
+
+get_check is answered from a warm cache, the check itself is not
+measured. The remote bridge acknowledges at once.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+
+from mock import MagicMock
+from sanji.connection.mockup import Mockup
+from sanji.message import Message
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(dirpath + "/../")
+os.environ["PATH"] = dirpath + "/../tests:" + os.environ["PATH"]
+from firmware import Firmware  # noqa
+from fwutil import jobs  # noqa
+from fwutil import product  # noqa
+
+# seconds to wait for a background upgrade
+JOB_TIMEOUT = 60
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of the sorted values.
+    """
+    index = max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(seconds):
+    values = sorted(seconds)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "mean": total / len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+        "throughput": len(values) / total if total else None
+    }
+
+
+def measure(func, rounds, reset=None):
+    """
+    Seconds of each call of func, reset() runs between the calls and is
+    not measured.
+    """
+    seconds = []
+    for _ in range(rounds):
+        if reset is not None:
+            reset()
+        start = time.time()
+        func()
+        seconds.append(time.time() - start)
+    return seconds
+
+
+class Bench(object):
+
+    def __init__(self):
+        self.bundle = Firmware(connection=Mockup())
+        self.bundle.publish = MagicMock()
+        self.bundle.publish.put.return_value = MagicMock(code=200)
+        # upgraded by the fake upgrade script and package
+        self.bundle.strategy = product.lookup("uc8100")
+        self.bundle.check = lambda: {"current": "1.0.0",
+                                     "candidate": "1.1.0", "isLatest": 0}
+        self.bundle.check_cache.get()
+
+    def request(self, route, data=None, query=None):
+        message = Message({"id": 1, "method": "put",
+                           "resource": "/system/firmware",
+                           "data": data or {}, "query": query or {},
+                           "param": {}})
+        result = {}
+
+        def response(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        route(message=message, response=response, test=True)
+        if 200 != result.get("code", 200):
+            raise RuntimeError("%s: %s" % (route.__name__, result))
+        return result.get("data", None)
+
+    def get(self):
+        self.request(self.bundle.get)
+
+    def get_check(self):
+        self.request(self.bundle.get_check)
+
+    def put_server(self):
+        self.request(self.bundle.put, {"server": "www.moxa.com"})
+
+    def put_upgrade(self, rounds):
+        """
+        Seconds of the route replying the job, and of the job until it
+        would reboot.
+        """
+        replied, finished = [], []
+        for _ in range(rounds):
+            self.release()
+            done = threading.Event()
+
+            def listener(job):
+                if job.state in [jobs.REBOOTING, jobs.FAILED, jobs.DONE]:
+                    done.set()
+
+            start = time.time()
+            job = self.bundle.jobs.get(
+                self.request(self.bundle.put, {"upgrade": 1})["id"])
+            replied.append(time.time() - start)
+            job.add_listener(listener)
+            listener(job)
+            if not done.wait(JOB_TIMEOUT):
+                raise RuntimeError("The upgrade did not finish.")
+            finished.append(time.time() - start)
+        return replied, finished
+
+    def put_reset(self):
+        self.request(self.bundle.put, {"reset": 1})
+
+    def release(self):
+        # the device never reboots here
+        self.bundle.operation.release()
+        self.bundle.model.db.pop("upgrading", None)
+
+    def save(self):
+        self.bundle.save(flush=True)
+
+    def run(self, rounds):
+        seconds = {}
+        seconds["get"] = measure(self.get, rounds * 50)
+        seconds["get_check"] = measure(self.get_check, rounds * 50)
+        seconds["put_server"] = measure(self.put_server, rounds * 10)
+        seconds["put_upgrade"], seconds["upgrade_job"] = \
+            self.put_upgrade(rounds)
+        seconds["put_reset"] = measure(self.put_reset, rounds, self.release)
+        store = self.bundle.store
+        writes, written = store.writes, store.bytes
+        seconds["save"] = measure(self.save, rounds * 10)
+
+        results = {}
+        for name in ["get", "get_check", "put_server", "put_upgrade",
+                     "upgrade_job", "put_reset", "save"]:
+            results[name] = summarize(seconds[name])
+            print "%-12s p50 %10.3f ms  p99 %10.3f ms  %10.1f ops/s" % (
+                name, results[name]["p50"] * 1000,
+                results[name]["p99"] * 1000, results[name]["throughput"])
+        # the bytes written by each save
+        results["save"]["bytes"] = \
+            (store.bytes - written) / max(1, store.writes - writes)
+        return results
+
+    def stop(self):
+        self.bundle.stop()
+        for name in ["firmware.json", "firmware.json.backup", "history.bin",
+                     "INSTALLED_FIRMWARE", "factory.manifest"]:
+            try:
+                os.remove("%s/../tests/data/%s" % (dirpath, name))
+            except OSError:
+                pass
+        for name in ["stage", "lists", "peer"]:
+            shutil.rmtree("%s/../tests/data/%s" % (dirpath, name),
+                          ignore_errors=True)
+
+
+def compare(baseline, results):
+    """
+    Ratio of the p50 to the baseline, over 1 is slower.
+    """
+    for name, result in sorted(results.items()):
+        if name not in baseline.get("results", {}):
+            continue
+        base = baseline["results"][name]["p50"]
+        print "%-12s %6.2fx p50 of %s" % (
+            name, result["p50"] / base if base else 0,
+            baseline.get("version", "baseline"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-n", "--rounds", type=int, default=20)
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("-b", "--baseline", help="results to compare with")
+    args = parser.parse_args()
+
+    with open("%s/../bundle.json" % dirpath) as f:
+        version = json.load(f)["version"]
+
+    bench = Bench()
+    try:
+        results = bench.run(args.rounds)
+    finally:
+        bench.stop()
+
+    report = {"version": version, "timestamp": int(time.time()),
+              "python": platform.python_version(),
+              "machine": platform.machine(), "rounds": args.rounds,
+              "unit": "seconds", "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,58 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import copy
+import hashlib
 import logging
+import shutil
 import time
 import sh
+from collections import deque
+from threading import Event
+from threading import Lock
+from threading import Timer
 from sanji.core import Sanji
 from sanji.core import Route
 from sanji.connection.mqtt import Mqtt
 from sanji.model_initiator import ModelInitiator
+from fwutil.cache import CheckCache
+from fwutil.singleflight import SingleFlight
+from fwutil.debversion import compare_versions
+from fwutil.apt import PackageIndex
+from fwutil.aptrepo import RepoIndex
+from fwutil import jobs
+from fwutil import product
+from fwutil.jobs import JobManager
+from fwutil import history
+from fwutil.history import History
+from fwutil.history import Phases
+from fwutil import progress
+from fwutil.progress import ProgressParser
+from fwutil.progress import ProgressReporter
+from fwutil.download import download_decompressed
+from fwutil.metrics import Metrics
+from fwutil.oplock import Busy
+from fwutil.oplock import OperationLock
+from fwutil.oplock import boot_id
+from fwutil.peercache import ArtifactCache
+from fwutil.peercache import PeerServer
+from fwutil.metrics import timed
+from fwutil.compress import open_decompressed
+from fwutil.download import fetch_text
+from fwutil.executor import CommandTimeout
+from fwutil.executor import Executor
+from fwutil.download import open_url
+from fwutil.delta import apply_delta
+from fwutil import factory
+from fwutil.factory import Manifest
+from fwutil.store import ModelStore
+from fwutil.stream import iter_chunks
+from fwutil.verify import hash_file
+from fwutil.verify import load_public_key
+from fwutil.verify import verify_digest
+from fwutil.window import plan_window
+from fwutil.window import validate_window
+from fwutil.window import window_expired
 
 # TODO: logger should be defined in sanji package?
 _logger = logging.getLogger("sanji.firmware")
@@ -19,7 +64,131 @@ path_root = os.path.abspath(os.path.dirname(__file__))
 # TODO: add command to stop required services
 profile = {
     "upgrade_firmware": path_root + "/tools/upgrade.sh",
-    "turn_off_readyled": "/etc/init.d/showreadyled stop"
+    "turn_off_readyled": "/etc/init.d/showreadyled stop",
+    # the firmware package, resolved by the product detected at init
+    "package": "mxcloud-cg",
+    "dpkg_status": "/var/lib/dpkg/status",
+    "apt_lists": "/var/lib/apt/lists",
+    # the firmware repository, its index is refreshed to index_dir alone
+    "source_list": "/etc/apt/sources.list.d/mxcloud.list",
+    "index_dir": path_root + "/data/lists",
+    # the version reported by pversion changes with the installed packages
+    "version_file": "/var/lib/dpkg/status",
+    # disk-backed directory for the staged firmware image
+    "stage_dir": path_root + "/data/stage",
+    # the image may be compressed by gzip, xz or zstd, it is decompressed
+    # while streamed and verified as decompressed
+    "image_url": "http://%(server)s/LATEST_FIRMWARE",
+    "uploaded_image": "/run/shm/LATEST_FIRMWARE",
+    # the image installed last time, the base to rebuild the new image
+    # from a delta ("from-<version>" of the running firmware)
+    "installed_image": path_root + "/data/INSTALLED_FIRMWARE",
+    "delta_url": "http://%(server)s/LATEST_FIRMWARE.from-%(version)s.delta",
+    # verified images shared with the other gateways (see "peerCache")
+    "peer_cache_dir": path_root + "/data/peer",
+    # images are verified by "<image>.sha256" and "<image>.sig" (signed by
+    # the key if exists), mismatched images are refused, and unverified
+    # ones too if "requireVerified" of the model is true
+    "public_key": "/etc/mxcloud/firmware.pem",
+    # the directory of the bundles ("<bundle>/data/<name>.json.factory"
+    # beside each model) for the selective reset, and the manifest of
+    # their factory defaults
+    "config_root": os.path.dirname(path_root),
+    "factory_manifest": path_root + "/data/factory.manifest",
+    # history of the upgrade/reset attempts, kept apart from the model
+    "history_file": path_root + "/data/history.bin",
+    # how the image is brought to the installer per family, overrides the
+    # default of its strategy (see fwutil.product):
+    #   disk: streamed to stage_dir first
+    #   pipe: streamed to the installer directly, only if there is no
+    #         checksum or signature to verify it first (else as disk)
+    "image_install": {}
+}
+
+# Refresh the firmware repository only, not every configured list
+APT_UPDATE_OPTIONS = [
+    "-o", "Dir::Etc::sourcelist=sources.list.d/mxcloud.list",
+    "-o", "Dir::Etc::sourceparts=-",
+    "-o", "APT::Get::List-Cleanup=0"]
+
+# Default policy of the cached check result (seconds)
+CHECK_TTL = 300
+CHECK_INTERVAL = 3600
+# Scheduled checks: random delay added to each check, and the retry delay
+# after failures (doubled on each failure up to the max)
+CHECK_JITTER = 600
+CHECK_BACKOFF_MIN = 60
+CHECK_BACKOFF_MAX = 3600
+
+# Model keys of the check policy, and the CheckCache arguments
+CHECK_POLICY = {
+    "checkTtl": ("ttl", CHECK_TTL),
+    "checkInterval": ("interval", CHECK_INTERVAL),
+    "checkJitter": ("jitter", CHECK_JITTER),
+    "checkBackoffMin": ("backoff_min", CHECK_BACKOFF_MIN),
+    "checkBackoffMax": ("backoff_max", CHECK_BACKOFF_MAX)
+}
+
+# Minimum seconds between two upgrading progress events
+PROGRESS_INTERVAL = 2
+
+# Seconds to wait for more changes before writing the model
+SAVE_DELAY = 2
+
+# Seconds to wait for the remote bridge to acknowledge, and the number of
+# handshakes kept in the model
+REMOTE_TIMEOUT = 10
+REMOTE_HANDSHAKES = 10
+
+# external commands run in background, at most COMMAND_WORKERS at a time,
+# each is killed if it waits and runs longer than its timeout (seconds).
+# The short ones (e.g. pversion for GET) have COMMAND_SHORT_WORKERS of
+# their own, they are never queued behind an upgrade
+COMMAND_WORKERS = 2
+COMMAND_SHORT_WORKERS = 1
+COMMAND_SHORT_TIMEOUT = 60
+COMMAND_TIMEOUTS = {
+    "pversion": 30,
+    "dpkg": 300,
+    "apt-get": 900,
+    "product": 30,
+    "stage": 7200,
+    "upgrade": 7200,
+    "setdef": 600,
+    "reboot": 60
+}
+
+# seconds to wait for the running job when stopping, its commands and
+# downloads are cancelled first
+JOB_STOP_TIMEOUT = 10
+
+# seconds an operation (upgrade, stage or reset) may hold the operation
+# lock at most, a busy pending upgrade is tried again OPERATION_RETRY later
+OPERATION_TTL = {
+    "upgrade": COMMAND_TIMEOUTS["upgrade"] + 600,
+    "stage": COMMAND_TIMEOUTS["stage"] + 600,
+    "reset": COMMAND_TIMEOUTS["setdef"] + 600
+}
+OPERATION_RETRY = 60
+
+# "resetMode" of a reset: the setdef tool, or restoring the changed files
+RESET_MODES = ["full", "selective"]
+
+# Default "peerCache" of the model: the port serving the cached images to
+# the other gateways, and how much and how long (seconds) they are kept
+PEER_PORT = 8899
+PEER_MAX_BYTES = 512 * 1024 * 1024
+PEER_MAX_AGE = 7 * 24 * 3600
+PEER_CACHE_FIELDS = ["enabled", "port", "maxBytes", "maxAge"]
+
+# Attempts kept in the history, and the page size of querying it
+HISTORY_SIZE = 256
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+# Job states measured as the phases of an attempt
+HISTORY_PHASES = {
+    jobs.DOWNLOADING: "download",
+    jobs.INSTALLING: "install"
 }
 
 
@@ -37,9 +206,44 @@ class Firmware(Sanji):
             self.bundle_env = os.getenv("BUNDLE_ENV", "debug")
 
         path_root = os.path.abspath(os.path.dirname(__file__))
+        # the profile of this instance: the defaults, the paths of the
+        # environment and the package of the detected product
+        self.profile = copy.deepcopy(profile)
         if self.bundle_env == "debug":  # pragma: no cover
             path_root = "%s/tests" % path_root
-            profile["upgrade_firmware"] = path_root + "/upgradehfm.sh"
+            self.profile.update({
+                "upgrade_firmware": path_root + "/upgradehfm.sh",
+                "dpkg_status": path_root + "/mockdata/dpkg/status",
+                "apt_lists": path_root + "/mockdata/apt/lists",
+                "index_dir": path_root + "/data/lists",
+                "version_file": path_root + "/pversion",
+                "stage_dir": path_root + "/data/stage",
+                "uploaded_image": path_root + "/data/LATEST_FIRMWARE",
+                "installed_image": path_root + "/data/INSTALLED_FIRMWARE",
+                "public_key": path_root + "/mockdata/keys/firmware.pem",
+                "history_file": path_root + "/data/history.bin",
+                "peer_cache_dir": path_root + "/data/peer",
+                "config_root": path_root + "/data/config",
+                "factory_manifest": path_root + "/data/factory.manifest"
+            })
+
+        # set when stopping, the downloads in progress stop with it
+        self.stopping = Event()
+        # counters and latencies, see /system/firmware/metrics
+        self.metrics = Metrics()
+        self.executor = Executor(max_workers=COMMAND_WORKERS,
+                                 short_workers=COMMAND_SHORT_WORKERS,
+                                 short_timeout=COMMAND_SHORT_TIMEOUT)
+
+        self.repo_index = RepoIndex(self.profile["source_list"],
+                                    self.profile["index_dir"])
+        # concurrent checks share one apt-get/dpkg run
+        self.check_flight = SingleFlight()
+        self.check_cache = CheckCache(
+            lambda: self.check(),
+            ttl=CHECK_TTL, interval=CHECK_INTERVAL, jitter=CHECK_JITTER,
+            backoff_min=CHECK_BACKOFF_MIN, backoff_max=CHECK_BACKOFF_MAX,
+            listener=self.notify_available, flight=self.check_flight)
 
         try:
             self.load(path_root)
@@ -47,6 +251,70 @@ class Firmware(Sanji):
             self.stop()
             raise IOError("Cannot load any configuration.")
 
+        self.check_cache.set_policy(**dict(
+            (arg, self.model.db.get(key, default))
+            for key, (arg, default) in CHECK_POLICY.items()))
+        self.metrics.enabled = self.model.db.get("metricsEnabled", True)
+
+        # detected once and kept in the model, the upgrades follow the
+        # strategy of its family
+        self.strategy = self.detect_product()
+        if self.strategy is not None and self.strategy.package is not None:
+            self.profile["package"] = self.strategy.package
+        self.package_index = PackageIndex(
+            self.profile["dpkg_status"],
+            [self.profile["index_dir"], self.profile["apt_lists"]],
+            packages=[self.profile["package"]])
+
+        # upgrade, stage and reset run one at a time, the lock is kept in
+        # the model to survive a restart of the bundle
+        self.operation = OperationLock(
+            self.model.db.get("operation", None), boot=boot_id(),
+            listener=self.save_operation)
+
+        self.version_sig = None
+        try:
+            self.update_version()
+        except Exception as e:
+            _logger.warning("Cannot read the firmware version: %s" % e)
+
+        # the images shared with the other gateways, served by run()
+        self.peer_cache = ArtifactCache(self.profile["peer_cache_dir"])
+        self.peer_server = None
+
+        # upgrades run in background, one by one
+        self.jobs = JobManager()
+        self.history = History(self.profile["history_file"],
+                               capacity=HISTORY_SIZE)
+        # the pending upgrade waiting for its rollout window
+        self.upgrade_timer = None
+        self.pending_lock = Lock()
+
+        self.public_key = None
+        if os.path.exists(self.profile["public_key"]):
+            self.public_key = load_public_key(self.profile["public_key"])
+
+    def before_stop(self):
+        # cancel the commands and downloads first, nothing waited below
+        # hangs on them
+        if hasattr(self, "stopping"):
+            self.stopping.set()
+        if hasattr(self, "executor"):
+            self.executor.shutdown()
+        self.check_cache.stop()
+        if getattr(self, "store", None) is not None:
+            try:
+                self.store.flush()
+            except Exception as e:
+                _logger.error("Cannot save the configuration: %s" % e)
+        if getattr(self, "upgrade_timer", None) is not None:
+            self.upgrade_timer.cancel()
+        if getattr(self, "peer_server", None) is not None:
+            self.peer_server.stop()
+            self.peer_server = None
+        if hasattr(self, "jobs"):
+            self.jobs.stop(timeout=JOB_STOP_TIMEOUT)
+
     def run(self):
         if "upgrading" in self.model.db:
             if self.model.db["upgrading"] == -1:
@@ -60,6 +328,22 @@ class Firmware(Sanji):
             self.model.db.pop("upgrading")
             self.save()
 
+        # the upgrade is done by rebooting, record it with the new version
+        attempt = self.model.db.pop("upgradeAttempt", None)
+        if attempt is not None:
+            durations = attempt.get("durations", {})
+            if "rebootAt" in attempt:
+                durations["reboot"] = max(0, time.time() - attempt["rebootAt"])
+                self.metrics.observe("upgrade.reboot", durations["reboot"])
+            self.record("upgrade", attempt.get("outcome", "interrupted"),
+                        attempt["timestamp"], attempt.get("from", None),
+                        self.model.db.get("version", None), durations)
+            self.save()
+
+        self.check_cache.start()
+        self.schedule_upgrade()
+        self.serve_peers()
+
     def load(self, path):
         """
         Load the configuration. If configuration is not installed yet,
@@ -69,171 +353,1163 @@ class Firmware(Sanji):
             path: Path for the bundle, the configuration should be located
                 under "data" directory.
         """
+        # pending changes should be read back
+        if getattr(self, "store", None) is not None:
+            self.store.flush()
         self.model = ModelInitiator("firmware", path, backup_interval=-1)
         if None == self.model.db:
             raise IOError("Cannot load any configuration.")
+        # upgrading/defaulting must be on disk before going on
+        self.store = ModelStore(self.model, delay=SAVE_DELAY,
+                                critical=["upgrading", "defaulting",
+                                          "operation"])
         self.save()
 
-    def save(self):
+    def save(self, flush=False):
         """
-        Save and backup the configuration.
+        Save and backup the configuration, changes close together are
+        written once unless flush is set.
         """
-        self.model.save_db()
-        self.model.backup_db()
+        self.store.save(flush=flush)
+
+    def _version_file_sig(self):
+        try:
+            st = os.stat(self.profile["version_file"])
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def read_version(self):
+        """
+        Read the running firmware version by pversion.
+        """
+        output = self.executor.run(
+            sh.pversion, timeout=COMMAND_TIMEOUTS["pversion"])
+        return str(output).splitlines()[0].split()[2]
+
+    def update_version(self):
+        """
+        Resolve the firmware version and keep it in the model, it is only
+        read again after upgrading or if the version file is changed.
+        """
+        self.version_sig = self._version_file_sig()
+        self.model.db["version"] = self.read_version()
+
+    def update_index(self):
+        """
+        Refresh the index of the firmware repository, only its Release and
+        Packages files are fetched if they are changed. apt-get update is
+        used if the source list is not found.
+
+        Returns:
+            statistics of the refresh, None if refreshed by apt-get.
+        """
+        if os.path.exists(self.profile["source_list"]):
+            if self.repo_index.arch is None:
+                self.repo_index.arch = str(self.executor.run(
+                    sh.dpkg, "--print-architecture",
+                    timeout=COMMAND_TIMEOUTS["dpkg"])).strip()
+            stats = self.repo_index.refresh()
+            _logger.info("Package list refreshed: %d bytes in %.3f seconds"
+                         % (stats["bytes"], stats["seconds"]))
+            return stats
+
+        try:
+            self.executor.run(sh.apt_get, "update", *APT_UPDATE_OPTIONS,
+                              timeout=COMMAND_TIMEOUTS["apt-get"])
+        except CommandTimeout:
+            raise
+        except:
+            self.executor.run(sh.dpkg, "--configure", "-a",
+                              timeout=COMMAND_TIMEOUTS["dpkg"])
+            self.executor.run(sh.apt_get, "update", *APT_UPDATE_OPTIONS,
+                              timeout=COMMAND_TIMEOUTS["apt-get"])
+        return None
 
     def check(self):
         """
-        dpkg --configure -a
-        apt-get update -o Dir::Etc::sourcelist="sources.list.d/mxcloud.list"
+        refresh the index of the firmware repository (update_index)
           - finish
-          - timeout
-        apt-cache policy mxcloud-cg
+          - failed
+        read installed/candidate of mxcloud-cg from dpkg status/apt lists
           - installed
-          - not installed: empty output
-        dpkg --compare-versions [current] le [candidate]
-          - true: there's newer for upgrade if [current] != [candidate]
-          - false: need not to be upgraded
+          - not installed: (none)
+          - unknown package: error
+        compare [current] with [candidate] (same rules as dpkg)
+          - lower: there's newer for upgrade
+          - equal or greater: need not to be upgraded
         """
 
         # get the update list
         try:
-            sh.apt_get("update", "-o",
-                       "Dir::Etc::sourcelist=\"sources.list.d/mxcloud.list\"")
-        except:
-            try:
-                sh.dpkg("--configure", "-a")
-                sh.apt_get(
-                    "update", "-o",
-                    "Dir::Etc::sourcelist=\"sources.list.d/mxcloud.list\"")
-            except:
-                raise Exception("Cannot update the package list.")
+            with self.metrics.timer("check.index_update"):
+                index_stats = self.update_index()
+        except Exception as e:
+            _logger.error("Cannot update the package list: %s" % e)
+            self.metrics.inc("check.failed")
+            if isinstance(e, CommandTimeout):
+                raise Exception("Updating the package list timed out.")
+            raise Exception("Cannot update the package list.")
 
         # retrieve version
-        output = sh.apt_cache("policy", "mxcloud-cg").splitlines()
-        if len(output) < 3:
+        with self.metrics.timer("check.policy"):
+            current, candidate = self.package_index.policy(
+                self.profile["package"])
+        if "(none)" == current and "(none)" == candidate:
+            self.metrics.inc("check.failed")
             raise Exception("Unknown error.")
 
         check = {}
         check["isLatest"] = 0
-        check["current"] = output[1].split()[1]
-        check["candidate"] = output[2].split()[1]
+        check["current"] = current
+        check["candidate"] = candidate
+        if index_stats is not None:
+            check["indexStats"] = index_stats
         try:
-            output = sh.dpkg("--compare-versions", check["current"], "le",
-                             check["candidate"])
-            if check["current"] == check["candidate"]:
-                check["isLatest"] = 1
-        except:
+            with self.metrics.timer("check.compare"):
+                if compare_versions(check["current"],
+                                    check["candidate"]) >= 0:
+                    check["isLatest"] = 1
+        except ValueError:
             if check["current"] != "(none)":
                 check["isLatest"] = 1
+        self.metrics.inc("check.success")
         return check
 
-    def upgrade(self):
+    def notify_available(self, check):
+        """
+        Publish FW_AVAILABLE when a new candidate is found, each candidate
+        is notified once (kept as "candidate" in the model).
+        """
+        candidate = check.get("candidate", "(none)")
+        if "(none)" == candidate or \
+                candidate == self.model.db.get("candidate", None):
+            return
+        self.model.db["candidate"] = candidate
+        self.save()
+        if check.get("isLatest", 1):
+            return
+        _logger.info("Firmware %s is available." % candidate)
+        self.publish.event.put(
+            "/system/firmware",
+            data={"code": "FW_AVAILABLE", "type": "event",
+                  "current": check["current"], "candidate": candidate})
+
+    def save_operation(self, holder):
+        if holder is None:
+            self.model.db.pop("operation", None)
+        else:
+            self.model.db["operation"] = dict(holder)
+        self.save()
+
+    def operate(self, func):
+        """
+        Wrap func(job) of the operation holding the lock, the lock is
+        released when it ends unless the reboot is issued.
+        """
+        def run(job):
+            rebooting = False
+            try:
+                func(job)
+                rebooting = jobs.REBOOTING == job.state
+            finally:
+                if not rebooting:
+                    self.operation.release()
+        return run
+
+    def submit_operation(self, type, func):
+        """
+        Submit the operation holding the lock as a job.
+        """
+        job = self.jobs.submit(type, self.operate(func))
+        self.operation.update(jobId=job.id)
+        return job
+
+    def operation_status(self, holder):
+        """
+        The job of the operation in progress, or the holder if the job is
+        started before the bundle restarted.
+        """
+        job = self.jobs.get(holder.get("jobId", None))
+        if job is None:
+            return dict(holder)
+        return job.to_dict()
+
+    def record(self, type, outcome, timestamp, version_from=None,
+               version_to=None, durations=None):
+        """
+        Append an attempt to the history, failing to record does not fail
+        the operation.
+        """
+        try:
+            self.history.append(type, outcome, timestamp, version_from,
+                                version_to, durations)
+        except Exception as e:
+            _logger.error("Cannot record the %s: %s" % (type, e))
+
+    def upgrade_progress(self, job=None, phases=None):
+        """
+        Create the reporter which parses the output of upgrade script and
+        publishes the progress as events (and to the job).
+        """
+        job_states = {
+            progress.DOWNLOADING: jobs.DOWNLOADING,
+            progress.INSTALLING: jobs.INSTALLING,
+            progress.CONFIGURING: jobs.INSTALLING
+        }
+
+        def report(phase, percent):
+            if phases is not None and phase in job_states:
+                phases.enter(HISTORY_PHASES.get(job_states[phase], None))
+            if job is not None:
+                job.percent = percent
+                if phase in job_states and job.state != job_states[phase]:
+                    job.set_state(job_states[phase])
+            self.publish.event.put(
+                "/system/firmware",
+                data={"code": "FW_UPGRADE_PROGRESS", "type": "event",
+                      "phase": phase, "percent": percent})
+
+        return ProgressReporter(report, interval=PROGRESS_INTERVAL)
+
+    def detect_product(self):
+        """
+        Detect the product by kversion unless it is in the model already.
+
+        Returns:
+            the strategy of its family, None if unknown.
+        """
+        model = self.model.db.get("product", None)
+        if model is None:
+            try:
+                model = product.parse_model(str(self.executor.run(
+                    sh.kversion, timeout=COMMAND_TIMEOUTS["product"])))
+            except Exception as e:
+                _logger.warning("Cannot detect the product: %s" % e)
+                return None
+            self.model.db["product"] = model
+            self.save()
+
+        strategy = product.resolve(model)
+        if strategy is None:
+            _logger.warning("Unknown product %s." % model)
+        else:
+            _logger.info("Product %s of family %s." %
+                         (model, strategy.family))
+        return strategy
+
+    def product_family(self):
+        """
+        Product family detected at init: uc8100, da820 or mar2000, None if
+        unknown.
+        """
+        if self.strategy is None:
+            return None
+        return self.strategy.family
+
+    def script_env(self):
+        """
+        Environment of the upgrade script with the detected product, the
+        script never detects it itself. FAMILY is empty if unknown.
+        """
+        env = dict(os.environ)
+        env.update({"FAMILY": "", "PACKAGE": ""})
+        strategy = product.lookup(self.product_family())
+        if strategy is not None:
+            env.update(strategy.env())
+        return env
+
+    def image_mode(self):
+        """
+        How the image of the product is brought to the installer (see
+        profile), None if upgraded by a package.
+        """
+        family = self.product_family()
+        strategy = product.lookup(family)
+        return self.profile["image_install"].get(
+            family, strategy.image if strategy is not None else None)
+
+    def image_url(self, server=None):
+        return self.profile["image_url"] % {
+            "server": server or self.model.db["server"]}
+
+    def image_servers(self):
+        """
+        Servers to fetch the image from in order, the server (may be a
+        peer gateway) first and then the upstream server if given.
+        """
+        servers = [self.model.db["server"]]
+        upstream = self.model.db.get("upstreamServer", None)
+        if upstream and upstream not in servers:
+            servers.append(upstream)
+        return servers
+
+    def serve_peers(self):
+        """
+        Start, restart or stop serving the cached images to the other
+        gateways by "peerCache" of the model.
+        """
+        config = self.model.db.get("peerCache", {})
+        if self.peer_server is not None:
+            self.peer_server.stop()
+            self.peer_server = None
+        self.peer_cache.max_bytes = config.get("maxBytes", PEER_MAX_BYTES)
+        self.peer_cache.max_age = config.get("maxAge", PEER_MAX_AGE)
+        if not config.get("enabled", False):
+            return
+        self.peer_cache.evict()
+        try:
+            self.peer_server = PeerServer(
+                self.peer_cache, port=config.get("port", PEER_PORT)).start()
+        except (IOError, OSError) as e:
+            _logger.error("Cannot serve the cached images: %s" % e)
+
+    def cache_image(self, path, checksum, signature):
+        """
+        Keep the verified image for the other gateways if serving them.
+        """
+        if not self.model.db.get("peerCache", {}).get("enabled", False):
+            return
+        try:
+            self.peer_cache.add(os.path.basename(self.profile["image_url"]),
+                                path, checksum, signature)
+        except (IOError, OSError) as e:
+            _logger.warning("Cannot cache the image: %s" % e)
+
+    def published_signatures(self, url):
+        """
+        (checksum, signature) published along with the artifact, None if
+        not published.
+        """
+        signature = None
+        if self.public_key is not None:
+            signature = fetch_text(url + ".sig")
+        return (fetch_text(url + ".sha256"), signature)
+
+    def local_signatures(self, path):
+        """
+        (checksum, signature) stored next to a local artifact.
+        """
+        result = []
+        for ext in [".sha256", ".sig"]:
+            try:
+                with open(path + ext) as f:
+                    result.append(f.read())
+            except IOError:
+                result.append(None)
+        return tuple(result)
+
+    def verify(self, digest, checksum=None, signature=None):
+        """
+        Verify the digest computed while streaming the artifact.
+
+        Raises:
+            IOError: mismatched, or not verified while it is required.
+        """
+        public_key = self.public_key
+        if signature is None and not self.verification_required():
+            # nothing to check the signature by
+            public_key = None
+        result = verify_digest(digest, checksum, signature, public_key)
+        if not result["verified"] and self.verification_required():
+            raise IOError("Firmware is not verified.")
+        return result
+
+    def verification_required(self):
+        """
+        Unverified artifacts are refused if "requireVerified" of the model
+        is true, else only the mismatched ones are.
+        """
+        return self.model.db.get("requireVerified", False)
+
+    def stage_delta(self, path):
+        """
+        Rebuild the image to path from the installed image and the delta
+        published for the running version, it is fetched, applied, hashed
+        and written chunk by chunk.
+
+        Returns:
+            the staged image, None if no delta can be used.
+        """
+        if not os.path.exists(self.profile["installed_image"]):
+            return None
+        try:
+            version = self.model.db.get("version", None) or \
+                self.read_version()
+            url = self.profile["delta_url"] % {
+                "server": self.model.db["server"], "version": version}
+            resp = open_url(url)
+        except Exception as e:
+            _logger.info("No delta for the installed image: %s" % e)
+            return None
+
+        _logger.info("Staging %s" % url)
+        digest = hashlib.sha256()
+        part = path + ".part"
+        try:
+            try:
+                with open(self.profile["installed_image"], "rb") as source, \
+                        open(part, "wb") as dst:
+                    size, delta_size = apply_delta(source, resp, dst,
+                                                   digests=[digest])
+            finally:
+                resp.close()
+            staged = {"type": "image", "path": path, "size": size,
+                      "delta": {"from": version, "size": delta_size,
+                                "bytesSaved": size - delta_size}}
+            signatures = self.published_signatures(self.image_url())
+            staged.update(self.verify(digest, *signatures))
+        except Exception as e:
+            _logger.warning("Cannot rebuild the image from delta, download"
+                            " the full image: %s" % e)
+            if os.path.exists(part):
+                os.remove(part)
+            return None
+        os.rename(part, path)
+        _logger.info("%d bytes saved by delta." % (size - delta_size))
+        self.cache_image(path, *signatures)
+        return staged
+
+    def stage_image(self):
+        """
+        Stream the image from the server to the disk-backed staging
+        directory, it is fetched, hashed and written chunk by chunk. The
+        image is rebuilt from a delta if possible, and fetched from the
+        upstream server if the server (e.g. a peer gateway) fails.
+        """
+        if not os.path.isdir(self.profile["stage_dir"]):
+            os.makedirs(self.profile["stage_dir"])
+        path = os.path.join(self.profile["stage_dir"], "LATEST_FIRMWARE")
+        staged = self.stage_delta(path)
+        if staged is not None:
+            return staged
+
+        servers = self.image_servers()
+        for server in servers:
+            url = self.image_url(server)
+            _logger.info("Staging %s" % url)
+            # hashed while downloading, verifying needs no extra read
+            digest = hashlib.sha256()
+            try:
+                size, compression = download_decompressed(
+                    url, path, digests=[digest], cancelled=self.stopping)
+                staged = {"type": "image", "path": path, "source": server,
+                          "size": size}
+                if compression is not None:
+                    staged["compression"] = compression
+                signatures = self.published_signatures(url)
+                staged.update(self.verify(digest, *signatures))
+            except IOError as e:
+                if os.path.exists(path):
+                    os.remove(path)
+                if server == servers[-1] or self.stopping.is_set():
+                    raise
+                _logger.warning("Cannot stage from %s, try the next"
+                                " server: %s" % (server, e))
+                continue
+            self.cache_image(path, *signatures)
+            return staged
+
+    def image_install_mode(self):
+        """
+        How to bring the image to the installer (see profile), None if the
+        image is staged or uploaded already, or the product has no image.
+        """
+        if "staged" in self.model.db or \
+                os.path.exists(self.profile["uploaded_image"]):
+            return None
+        return self.image_mode()
+
+    def stream_image(self, digest, compression=None):
+        """
+        Yield the image from the server chunk by chunk for the installer,
+        a compressed image is decompressed on the way.
+
+        Args:
+            compression: dict updated with the decompression stats if the
+                image is compressed.
+        """
+        resp = open_url(self.image_url())
+        stream = None
+        try:
+            stream, method = open_decompressed(resp)
+            for chunk in iter_chunks(stream, digests=[digest]):
+                yield chunk
+            if method is not None and compression is not None:
+                compression.update(stream.stats())
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            resp.close()
+
+    def stage(self, job=None):
+        """
+        Download the firmware ahead of upgrading, then upgrade only needs
+        to install the staged artifacts. An interrupted staging is resumed
+        the next time.
+
+        Args:
+            job: the Job running this staging.
+        """
+        if job is not None:
+            job.set_state(jobs.DOWNLOADING)
+
+        if self.image_mode() is not None:
+            staged = self.stage_image()
+        else:
+            _logger.info("Staging %s" % self.profile["package"])
+            parser = ProgressParser()
+            try:
+                self.executor.run(
+                    sh.sh, self.profile["upgrade_firmware"], "stage",
+                    _out=parser.feed, _err_to_out=True, _no_out=True,
+                    _env=self.script_env(),
+                    timeout=COMMAND_TIMEOUTS["stage"])
+            except Exception:
+                for line in parser.tail:
+                    _logger.error(line)
+                raise IOError("Cannot download the packages.")
+            # apt verifies the packages by the signed repository
+            staged = {"type": "package", "package": self.profile["package"],
+                      "verified": True}
+
+        staged["stagedAt"] = int(time.time())
+        self.model.db["staged"] = staged
+        self.save()
+        if job is not None:
+            job.set_state(jobs.DONE)
+
+    def drop_staged(self, reason):
+        """
+        Forget the staged artifact, the next upgrade downloads again.
+        """
+        staged = self.model.db.pop("staged", None)
+        if staged is None:
+            return
+        _logger.warning("Drop the staged firmware: %s" % reason)
+        if "image" == staged["type"] and os.path.exists(staged["path"]):
+            os.remove(staged["path"])
+
+    def check_staged(self):
+        """
+        Drop the staged image if it is missing or not the one staged.
+        """
+        staged = self.model.db.get("staged", None)
+        if staged is None or "image" != staged["type"]:
+            return
+        if not os.path.exists(staged["path"]):
+            self.drop_staged("%s is missing." % staged["path"])
+        elif "size" in staged and \
+                os.path.getsize(staged["path"]) != staged["size"]:
+            self.drop_staged("%s is changed." % staged["path"])
+
+    def verify_artifact(self):
+        """
+        Make sure the artifact to be installed is verified before
+        anything is touched, the result is kept as "verification" in the
+        model. A streamed image has nothing to verify, see can_stream().
+
+        Raises:
+            IOError: the artifact is not verified.
+        """
+        staged = self.model.db.get("staged", None)
+        if staged is not None:
+            self.model.db["verification"] = dict(
+                (key, staged.get(key, None))
+                for key in ["sha256", "checksum", "signature", "verified"])
+            if not staged.get("verified", False) and \
+                    self.verification_required():
+                raise IOError("Firmware is not verified.")
+        elif os.path.exists(self.profile["uploaded_image"]):
+            path = self.profile["uploaded_image"]
+            self.model.db["verification"] = self.verify(
+                hash_file(path), *self.local_signatures(path))
+
+    def can_stream(self):
+        """
+        A streamed image is installed before its digest is known, so it is
+        streamed only if there is nothing to verify it by. Otherwise it is
+        staged to disk and verified first.
+        """
+        if self.verification_required():
+            return False
+        return (None, None) == self.published_signatures(self.image_url())
+
+    def upgrade(self, job=None):
+        """
+        Upgrade the firmware and reboot.
+
+        Args:
+            job: the Job running this upgrade, its state is updated along
+                the upgrading steps.
+        """
+        phases = Phases()
+        attempt = {"timestamp": int(time.time()),
+                   "from": self.model.db.get("version", None)}
+
+        def set_state(state, message=""):
+            phases.enter(HISTORY_PHASES.get(state, None))
+            if job is not None and job.state != state:
+                job.set_state(state, message)
+
+        # bring the image to disk and verify it first, nothing is touched
+        # if failed
+        self.check_staged()
+        mode = self.image_install_mode()
+        try:
+            if "pipe" == mode and not self.can_stream():
+                _logger.info("Stage the image to verify it before"
+                             " installing.")
+                mode = "disk"
+            if "disk" == mode:
+                set_state(jobs.DOWNLOADING)
+                self.model.db["staged"] = self.stage_image()
+            self.verify_artifact()
+        except Exception as e:
+            _logger.error("Cannot prepare the firmware: %s" % e)
+            set_state(jobs.FAILED, str(e))
+            self.metrics.inc("upgrade.refused")
+            self.record("upgrade", "failed", attempt["timestamp"],
+                        attempt["from"], None, phases.durations)
+            return
+
         # set flags to show the upgrading status
         """
         self.publish.event.put(
             "/system/firmware",
             data={"code": "FW_UPGRADING", "type": "event"})
         """
+        # recorded after rebooting, "interrupted" if it is never finished
+        self.model.db["upgradeAttempt"] = attempt
         self.model.db["upgrading"] = 1
-        self.save()
+        with self.metrics.timer("upgrade.save"):
+            self.save()
 
         # stop remote bridge
-        self.publish.put("/system/remote", data={"enable": 0})
-        time.sleep(1)
+        with self.metrics.timer("upgrade.remote_disable"):
+            self.set_remote(0)
+        reporter = self.upgrade_progress(job, phases)
         try:
             _logger.info("Upgrading...")
-            sh.sh(profile["upgrade_firmware"])
+            set_state(jobs.DOWNLOADING)
+            env = self.script_env()
+            kwargs = {}
+            digest = hashlib.sha256()
+            compression = {}
+            if "pipe" == mode:
+                # the image never sits in memory or /run/shm as a whole
+                env["FIRMWARE_IMAGE"] = "/dev/stdin"
+                kwargs["_in"] = self.stream_image(digest, compression)
+
+            # install the staged artifacts only
+            staged = self.model.db.get("staged", None)
+            if staged is not None:
+                env["STAGED"] = "1"
+                if "image" == staged["type"]:
+                    env["FIRMWARE_IMAGE"] = staged["path"]
+                set_state(jobs.INSTALLING)
+                compression = staged.get("compression", {})
+
+            # stream the output, only the last lines are kept in memory
+            with self.metrics.timer("upgrade.script"):
+                self.executor.run(
+                    sh.sh, self.profile["upgrade_firmware"],
+                    _out=reporter.feed, _err_to_out=True, _no_out=True,
+                    _env=env, timeout=COMMAND_TIMEOUTS["upgrade"], **kwargs)
+            if "_in" in kwargs:
+                # the digest of the streamed image, nothing to verify by
+                self.model.db["verification"] = self.verify(digest)
+            # ratio and throughput of the compressed image installed
+            if compression:
+                self.model.db["compression"] = compression
+                self.metrics.observe("upgrade.decompress",
+                                     compression["seconds"])
+            else:
+                self.model.db.pop("compression", None)
+            reporter.finish()
             _logger.info("Upgrading success, reboot now.")
             self.model.db["upgrading"] = 0
+            staged = self.model.db.pop("staged", None)
+            # keep the installed image as the base of the next delta
+            if staged is not None and "image" == staged["type"]:
+                try:
+                    shutil.move(staged["path"],
+                                self.profile["installed_image"])
+                except (IOError, OSError) as e:
+                    _logger.warning("Cannot keep the installed image: %s"
+                                    % e)
+            # resolve the version again on next request
+            self.model.db.pop("version", None)
+            set_state(jobs.REBOOTING)
+            attempt["outcome"] = "success"
+            self.metrics.inc("upgrade.success")
         except:
             _logger.error("Upgrading failed, please check if the file is"
                           " correct.")
+            for line in reporter.parser.tail:
+                _logger.error(line)
             _logger.error("Reboot now to recover the system.")
+            # e.g. apt cleaned its cache, or the candidate moved on
+            self.drop_staged("Installing it failed.")
             self.model.db["upgrading"] = -1
-        self.save()
+            set_state(jobs.FAILED, "Reboot to recover the system.")
+            attempt["outcome"] = "failed"
+            self.metrics.inc("upgrade.failed")
+        attempt["durations"] = phases.durations
+        with self.metrics.timer("upgrade.save"):
+            self.save()
 
         # start remote bridge
-        self.publish.put("/system/remote", data={"enable": 1})
-        time.sleep(1)
-        sh.reboot()
+        with self.metrics.timer("upgrade.remote_enable"):
+            self.set_remote(1)
+        attempt["rebootAt"] = time.time()
+        with self.metrics.timer("upgrade.save"):
+            self.save(flush=True)
+        try:
+            self.executor.run(sh.reboot, timeout=COMMAND_TIMEOUTS["reboot"])
+        except Exception as e:
+            _logger.error("Cannot reboot: %s" % e)
+            if job is not None:
+                job.set_state(jobs.FAILED, "Cannot reboot: %s" % e)
+
+    def schedule_upgrade(self):
+        """
+        Arm the timer of the pending upgrade ("pendingUpgrade" in the
+        model) to start it at the planned time, it is dropped if its
+        window is closed already (e.g. the device was off).
+        """
+        with self.pending_lock:
+            if self.upgrade_timer is not None:
+                self.upgrade_timer.cancel()
+                self.upgrade_timer = None
+            pending = self.model.db.get("pendingUpgrade", None)
+            if pending is None:
+                return
+            if window_expired(pending["window"]):
+                _logger.warning("The upgrade window is closed, drop the"
+                                " pending upgrade.")
+                self.model.db.pop("pendingUpgrade")
+                self.save()
+                return
+
+            delay = max(0, pending["plannedAt"] - time.time())
+            _logger.info("Upgrade is planned in %d seconds." % delay)
+            self.upgrade_timer = Timer(delay, self.start_pending_upgrade)
+            self.upgrade_timer.daemon = True
+            self.upgrade_timer.start()
 
-    def setdef(self):
+    def start_pending_upgrade(self):
+        """
+        Submit the pending upgrade as a job, it is dropped if its window
+        is closed (e.g. retried too long while busy).
+        """
+        with self.pending_lock:
+            self.upgrade_timer = None
+            pending = self.model.db.get("pendingUpgrade", None)
+            if pending is None:
+                return
+            if window_expired(pending["window"]):
+                _logger.warning("The upgrade window is closed, drop the"
+                                " pending upgrade.")
+                self.model.db.pop("pendingUpgrade")
+                self.save()
+                return
+            try:
+                holder, acquired = self.operation.acquire(
+                    "upgrade", {"server": self.model.db.get("server", None)},
+                    ttl=OPERATION_TTL["upgrade"])
+            except Busy as e:
+                _logger.info("%s Try the pending upgrade later." % e)
+                pending["plannedAt"] = int(time.time()) + OPERATION_RETRY
+                self.save()
+                busy = True
+            else:
+                busy = False
+                self.model.db.pop("pendingUpgrade")
+                self.save()
+                if acquired:
+                    self.submit_operation("upgrade", self.upgrade)
+        if busy:
+            self.schedule_upgrade()
+
+    def set_remote(self, enable):
+        """
+        Enable or disable the remote bridge, and wait until it responds
+        (up to REMOTE_TIMEOUT seconds). The handshake is recorded in
+        "remoteHandshakes" of the model, the latest last.
+
+        Returns:
+            True if the remote bridge acknowledged.
+        """
+        start = time.time()
+        acked = False
+        try:
+            resp = self.publish.put("/system/remote",
+                                    data={"enable": enable},
+                                    timeout=REMOTE_TIMEOUT)
+            acked = 200 == getattr(resp, "code", None)
+            if not acked:
+                _logger.warning("Remote bridge refused: %s" %
+                                getattr(resp, "data", None))
+        except Exception as e:
+            _logger.warning("Remote bridge did not respond: %s" % e)
+
+        handshake = {"enable": enable, "acked": acked,
+                     "seconds": round(time.time() - start, 3),
+                     "at": int(start)}
+        _logger.info("Remote bridge handshake: %s" % handshake)
+        handshakes = deque(self.model.db.get("remoteHandshakes", []),
+                           maxlen=REMOTE_HANDSHAKES)
+        handshakes.append(handshake)
+        self.model.db["remoteHandshakes"] = list(handshakes)
+        return acked
+
+    def factory_changes(self, save=True):
+        """
+        The files of the configuration tree differing from their factory
+        defaults, see fwutil.factory.diff(). The manifest is written only
+        if save.
+        """
+        manifest = Manifest(self.profile["config_root"],
+                            self.profile["factory_manifest"])
+        manifest.build(save=save)
+        return factory.diff(manifest)
+
+    def restore_factory(self):
+        """
+        Restore only the files changed from their factory defaults, the
+        model is read back if it is one of them.
+        """
+        changes = self.factory_changes()["changes"]
+        # pending changes must not be written over the restored model
+        self.store.flush()
+        paths = factory.restore(self.profile["config_root"], changes)
+        self.metrics.inc("setdef.restored", len(paths))
+        if os.path.realpath(self.model.json_db_path) in \
+                [os.path.realpath(path) for path in paths]:
+            self.model.load_db()
+
+    def setdef(self, selective=False):
+        """
+        Reset to factory default by the setdef tool, or restore only the
+        changed configuration files if selective, then reboot.
+
+        Returns:
+            True if the reboot is issued.
+        """
         # TODO: stop the services that may have side effect when setdef
         self.model.db["defaulting"] = 1
         self.save()
 
-        time.sleep(1)
+        # the remote bridge should not act on the configuration being reset
+        self.set_remote(0)
+        start = time.time()
+        version = self.model.db.get("version", None)
         try:
-            sh.setdef()
+            with self.metrics.timer("setdef.reset"):
+                if selective:
+                    self.restore_factory()
+                else:
+                    self.executor.run(sh.setdef,
+                                      timeout=COMMAND_TIMEOUTS["setdef"])
             _logger.info("Resetting to factory default success, reboot now.")
+            self.metrics.inc("setdef.success")
+            self.record("reset", "success", start, version, version,
+                        {"install": time.time() - start})
             self.model.db["defaulting"] = 0
-            self.save()
-            sh.reboot()
+            # enabled again before rebooting, as upgrade() does
+            self.set_remote(1)
+            self.save(flush=True)
         except:
             _logger.error("Resetting failed.")
+            self.metrics.inc("setdef.failed")
+            self.record("reset", "failed", start, version, version,
+                        {"install": time.time() - start})
             self.model.db["defaulting"] = -1
+            self.set_remote(1)
             self.save()
+            return False
+
+        # the reset is done and recorded, failing to reboot does not undo it
+        try:
+            self.executor.run(sh.reboot, timeout=COMMAND_TIMEOUTS["reboot"])
+        except Exception as e:
+            _logger.error("Cannot reboot: %s" % e)
+            return False
+        return True
 
     @Route(methods="get", resource="/system/firmware")
+    @timed("route.get")
     def get(self, message, response):
         """
         {
             "version": "1.0",
-            "server": "www.moxa.com"
+            "server": "www.moxa.com",
+            "product": "UC-8112",  (detected once by kversion)
+            "pendingUpgrade": {  (if an upgrade waits for its window)
+                "window": {"start": 1500000000, "end": 1500003600},
+                "plannedAt": 1500001234,
+                "requestedAt": 1499999000
+            },
+            "compression": {  (if the image installed last is compressed)
+                "method": "xz", "compressedBytes": 4194304,
+                "bytes": 16777216, "ratio": 4.0, "seconds": 2.5,
+                "throughput": 6710886
+            },
+            "storeStats": {  (saves requested and written, not stored)
+                "requests": 12, "writes": 3, "immediate": 2,
+                "coalesced": 9, "bytes": 1536
+            },
+            "commandStats": {  (external commands, not stored)
+                "submitted": 5, "running": 1, "queued": 0, "done": 3,
+                "failed": 0, "timeouts": 1, "cancelled": 0
+            },
+            "peerCacheStats": {  (if serving the other gateways)
+                "port": 8899, "hits": 20, "misses": 1,
+                "bytesServed": 335544320, "artifacts": 1,
+                "bytes": 16777216
+            }
         }
         """
-        output = sh.awk(sh.pversion(), "{print $3}")
-        self.model.db["version"] = str(output.split()[0])
-        return response(data=self.model.db)
+        if "version" not in self.model.db or \
+                self.version_sig != self._version_file_sig():
+            try:
+                self.update_version()
+            except CommandTimeout:
+                return response(
+                    code=400,
+                    data={"message": "Reading the version timed out."})
+        data = dict(self.model.db)
+        data["storeStats"] = self.store.stats()
+        data["commandStats"] = self.executor.stats()
+        if self.peer_server is not None:
+            data["peerCacheStats"] = self.peer_server.stats()
+        return response(data=data)
 
     @Route(methods="get", resource="/system/firmware/check")
+    @timed("route.get_check")
     def get_check(self, message, response):
         """
+        Answered from the cached result, "age" is the seconds since the
+        result was checked. An expired result is answered as well and
+        checked again in background, the check only runs before answering
+        if nothing is cached yet or "?force=1" is added.
+        "checkStats" counts the checks requested, executed and coalesced
+        into a running one. "indexStats" is the cost of refreshing the
+        package list for the result.
         {
             "isLatest": 1,
             "current": "1.0.0",
-            "candidate": "1.0.0"
+            "candidate": "1.0.0",
+            "age": 10,
+            "indexStats": {"requests": 1, "notModified": 1, "bytes": 0,
+                           "updated": 0, "seconds": 0.012},
+            "checkStats": {"calls": 3, "executions": 1, "coalesced": 2}
         }
         """
+        query = getattr(message, "query", None) or {}
+        force = query.get("force", False) in [True, 1, "1", "true"]
         try:
-            check = self.check()
+            check = self.check_cache.get(force=force)
         except Exception as e:
             if Exception("Cannot update the package list.").args == e.args:
                 return response(
                     code=400,
                     data={"message": "Cannot update the package list."})
+            elif Exception("Updating the package list timed out.").args \
+                    == e.args:
+                return response(
+                    code=400,
+                    data={"message": "Updating the package list timed out."})
             elif Exception("Firmware not installed.").args == e.args:
                 return response(code=400,
                                 data={"message": "Firmware not installed."})
             return response(code=400, data={"message": "Unknown error."})
+        check["checkStats"] = self.check_flight.stats()
         return response(data=check)
 
     @Route(methods="put", resource="/system/firmware")
     def put(self, message, response):
         """
         reset:
+        The setdef tool resets everything by default. With "selective",
+        only the configuration files changed from their factory defaults
+        are restored (see /system/firmware/reset for a dry run).
         {
-            "reset": 1
+            "reset": 1,
+            "resetMode": "selective"  (optional, "full" by default)
         }
 
         upgrade:
-        Only save the configuration if server updated.
+        Only save the configuration if server updated. The upgrade runs
+        in background, the job is replied (see /system/firmware/jobs).
         {
             "upgrade": 1,
             "server": "www.moxa.com"  (optional)
         }
+
+        With a rollout window, the upgrade is started at a time planned
+        inside the window instead (slot: "random" or "hash" of the
+        device). The pending upgrade is replied and shown as
+        "pendingUpgrade" in the model, "upgrade": 0 cancels it.
+        {
+            "upgrade": 1,
+            "window": {
+                "start": 1500000000,  (optional, epoch seconds)
+                "end": 1500003600,  (optional)
+                "maxDelay": 1800,  (optional, seconds)
+                "slot": "random"  (optional)
+            }
+        }
+
+        stage:
+        Download the firmware in background, a later upgrade only installs
+        it (the staged artifact is shown as "staged" in the model).
+        {
+            "stage": 1
+        }
+
+        check policy (seconds, optional):
+        The check is scheduled every checkInterval plus a random delay up
+        to checkJitter, failed checks are retried from checkBackoffMin and
+        doubled up to checkBackoffMax.
+        {
+            "checkTtl": 300,
+            "checkInterval": 3600,
+            "checkJitter": 600,
+            "checkBackoffMin": 60,
+            "checkBackoffMax": 3600
+        }
+
+        metrics:
+        Enable or disable the instrumentation (see
+        /system/firmware/metrics), enabled by default.
+        {
+            "metricsEnabled": false
+        }
+
+        verification:
+        Refuse the images (downloaded, staged or uploaded) which are not
+        verified by their checksum or signature, the mismatched ones are
+        always refused. Not required by default.
+        {
+            "requireVerified": true
+        }
+
+        peer cache:
+        Serve the verified images staged here to the other gateways of
+        the site at "<address>:<port>", they set it as their "server" and
+        the repository as "upstreamServer", which is used if the peer
+        fails. Images are evicted after maxAge seconds, and the oldest
+        ones if over maxBytes.
+        {
+            "peerCache": {
+                "enabled": true,
+                "port": 8899,  (optional)
+                "maxBytes": 536870912,  (optional)
+                "maxAge": 604800  (optional)
+            },
+            "upstreamServer": "www.moxa.com"  (optional)
+        }
+
+        Only one of reset, upgrade and stage runs at a time. Repeating the
+        request replies the operation in progress, another operation is
+        refused with 409:
+        {
+            "message": "Another operation is in progress.",
+            "operation": {"type": "upgrade", "jobId": 1, ...}
+        }
         """
         # TODO: status code should be added into error message
         if not hasattr(message, "data") or \
                 ("reset" not in message.data
                  and "upgrade" not in message.data
-                 and "server" not in message.data):
+                 and "stage" not in message.data
+                 and "server" not in message.data
+                 and "metricsEnabled" not in message.data
+                 and "requireVerified" not in message.data
+                 and "peerCache" not in message.data
+                 and "upstreamServer" not in message.data
+                 and not set(CHECK_POLICY) & set(message.data)):
             return response(code=400, data={"message": "Invalid Input."})
 
+        for key in CHECK_POLICY:
+            if key not in message.data:
+                continue
+            value = message.data[key]
+            if not isinstance(value, int) or isinstance(value, bool) \
+                    or value < 0:
+                return response(code=400, data={"message": "Invalid Input."})
+        for key in ["metricsEnabled", "requireVerified"]:
+            if key in message.data and \
+                    not isinstance(message.data[key], bool):
+                return response(code=400, data={"message": "Invalid Input."})
+        if message.data.get("resetMode", "full") not in RESET_MODES:
+            return response(code=400, data={"message": "Invalid Input."})
+        if "peerCache" in message.data:
+            config = message.data["peerCache"]
+            if not isinstance(config, dict) or \
+                    set(config) - set(PEER_CACHE_FIELDS) or \
+                    not isinstance(config.get("enabled", False), bool) or \
+                    not all(isinstance(config[key], int) and
+                            not isinstance(config[key], bool) and
+                            config[key] >= 0
+                            for key in ["port", "maxBytes", "maxAge"]
+                            if key in config) or \
+                    config.get("port", 0) > 65535:
+                return response(code=400, data={"message": "Invalid Input."})
+        if "window" in message.data:
+            try:
+                validate_window(message.data["window"])
+            except ValueError as e:
+                return response(code=400, data={"message": str(e)})
+            if window_expired(message.data["window"]):
+                return response(
+                    code=400,
+                    data={"message": "The upgrade window is closed."})
+
+        backoff = [message.data.get(key, self.model.db.get(key, default))
+                   for key, default in [
+                       ("checkBackoffMin", CHECK_BACKOFF_MIN),
+                       ("checkBackoffMax", CHECK_BACKOFF_MAX)]]
+        if backoff[0] > backoff[1]:
+            return response(code=400, data={"message": "Invalid Input."})
+
+        # Only one of upgrade, stage and reset runs at a time, the same
+        # request replies the one in progress
+        operation = None
+        server = message.data.get("server", self.model.db.get("server", None))
+        if 1 == message.data.get("reset", None):
+            operation = ("reset", None)
+        elif 1 == message.data.get("stage", None):
+            operation = ("stage", {"server": server})
+        elif 1 == message.data.get("upgrade", None) and \
+                "window" not in message.data:
+            operation = ("upgrade", {"server": server})
+        if operation is not None:
+            try:
+                holder, acquired = self.operation.acquire(
+                    operation[0], operation[1],
+                    ttl=OPERATION_TTL[operation[0]])
+            except Busy as e:
+                return response(
+                    code=409,
+                    data={"message": "Another operation is in progress.",
+                          "operation": dict(e.holder)})
+            if not acquired:
+                return response(data=self.operation_status(holder))
+
         # Resetting to factory default
         if "reset" in message.data and 1 == message.data["reset"]:
             response()
-            self.setdef()
+            rebooting = False
+            try:
+                rebooting = self.setdef(selective="selective" ==
+                                        message.data.get("resetMode", "full"))
+            finally:
+                # the lock is kept while the device is rebooting
+                if not rebooting:
+                    self.operation.release()
             return
 
         # Update the firmware upgrading server
@@ -241,14 +1517,188 @@ class Firmware(Sanji):
             self.model.db["server"] = message.data["server"]
             self.save()
 
-        # Upgrading the firmware
+        # Serve the cached images to the other gateways
+        if "upstreamServer" in message.data:
+            self.model.db["upstreamServer"] = message.data["upstreamServer"]
+            self.save()
+        if "peerCache" in message.data:
+            config = dict(self.model.db.get("peerCache", {}))
+            config.update(message.data["peerCache"])
+            self.model.db["peerCache"] = config
+            self.save()
+            self.serve_peers()
+
+        # Enable or disable the instrumentation
+        if "metricsEnabled" in message.data:
+            self.model.db["metricsEnabled"] = message.data["metricsEnabled"]
+            self.metrics.enabled = message.data["metricsEnabled"]
+            self.save()
+
+        # Allow or refuse the unverified images
+        if "requireVerified" in message.data:
+            self.model.db["requireVerified"] = message.data["requireVerified"]
+            self.save()
+
+        # Update the policy of the cached check result
+        policy = dict((key, message.data[key]) for key in CHECK_POLICY
+                      if key in message.data)
+        if policy:
+            self.model.db.update(policy)
+            self.check_cache.set_policy(**dict(
+                (CHECK_POLICY[key][0], value)
+                for key, value in policy.items()))
+            self.save()
+
+        # Downloading the firmware for upgrading later
+        if "stage" in message.data and 1 == message.data["stage"]:
+            job = self.submit_operation("stage", self.stage)
+            return response(data=job.to_dict())
+
+        # Cancel the pending upgrade
+        if "upgrade" in message.data and 0 == message.data["upgrade"]:
+            self.model.db.pop("pendingUpgrade", None)
+            self.save()
+            self.schedule_upgrade()
+            return response()
+
+        # Upgrading the firmware inside the rollout window
+        if "upgrade" in message.data and 1 == message.data["upgrade"] and \
+                "window" in message.data:
+            window = message.data["window"]
+            pending = {"window": window, "plannedAt": plan_window(window),
+                       "requestedAt": int(time.time())}
+            self.model.db["pendingUpgrade"] = pending
+            self.save()
+            self.schedule_upgrade()
+            return response(data=pending)
+
+        # Upgrading the firmware in background
         if "upgrade" in message.data and 1 == message.data["upgrade"]:
-            response()
-            self.upgrade()
-            return
+            job = self.submit_operation("upgrade", self.upgrade)
+            return response(data=job.to_dict())
 
         return response()
 
+    @Route(methods="get", resource="/system/firmware/jobs")
+    @timed("route.get_jobs")
+    def get_jobs(self, message, response):
+        """
+        [
+            {
+                "id": 1,
+                "type": "upgrade",
+                "state": "downloading",
+                "message": "",
+                "createdAt": 1445412000,
+                "updatedAt": 1445412001
+            }
+        ]
+        """
+        return response(data=[job.to_dict() for job in self.jobs.list()])
+
+    @Route(methods="get", resource="/system/firmware/jobs/:id")
+    @timed("route.get_job")
+    def get_job(self, message, response):
+        try:
+            job = self.jobs.get(int(message.param["id"]))
+        except (KeyError, ValueError):
+            job = None
+        if job is None:
+            return response(code=404, data={"message": "Job not found."})
+        return response(data=job.to_dict())
+
+    @Route(methods="get", resource="/system/firmware/history")
+    @timed("route.get_history")
+    def get_history(self, message, response):
+        """
+        The upgrade and reset attempts, the latest first. Query (all
+        optional): page (from 1), perPage (up to 100), type ("upgrade" or
+        "reset"), outcome ("success", "failed" or "interrupted"), since
+        and until (epoch seconds).
+        {
+            "page": 1,
+            "perPage": 20,
+            "total": 1,
+            "items": [
+                {
+                    "id": 3,
+                    "timestamp": 1445412000,
+                    "type": "upgrade",
+                    "outcome": "success",
+                    "from": "1.0.0",
+                    "to": "1.1.0",
+                    "durations": {"download": 35.2, "install": 120.5,
+                                  "reboot": 61.0}
+                }
+            ]
+        }
+        """
+        query = getattr(message, "query", None) or {}
+        try:
+            page = int(query.get("page", 1))
+            per_page = int(query.get("perPage", HISTORY_PAGE_SIZE))
+            since = int(query["since"]) if "since" in query else None
+            until = int(query["until"]) if "until" in query else None
+            if page < 1 or not 0 < per_page <= HISTORY_MAX_PAGE_SIZE:
+                raise ValueError
+            if query.get("type", history.TYPES[0]) not in history.TYPES or \
+                    query.get("outcome", history.OUTCOMES[0]) not in \
+                    history.OUTCOMES:
+                raise ValueError
+        except ValueError:
+            return response(code=400, data={"message": "Invalid Input."})
+
+        total, items = self.history.query(
+            type=query.get("type", None), outcome=query.get("outcome", None),
+            since=since, until=until, offset=(page - 1) * per_page,
+            limit=per_page)
+        return response(data={"page": page, "perPage": per_page,
+                              "total": total, "items": items})
+
+    @Route(methods="get", resource="/system/firmware/reset")
+    @timed("route.get_reset")
+    def get_reset(self, message, response):
+        """
+        Dry run of the selective reset: the configuration files which
+        would be restored to factory default, nothing is changed.
+        "create" is for the missing files, "bytes" are to be written.
+        {
+            "changes": [
+                {"path": "ethernet/data/ethernet.json",
+                 "action": "restore", "bytes": 512}
+            ],
+            "unchanged": 12,
+            "bytes": 512
+        }
+        """
+        report = self.factory_changes(save=False)
+        report["bytes"] = sum(change["bytes"]
+                              for change in report["changes"])
+        return response(data=report)
+
+    @Route(methods="get", resource="/system/firmware/metrics")
+    def get_metrics(self, message, response):
+        """
+        Counters and latency histograms (seconds) since the bundle started,
+        "buckets" are cumulative [upper bound, count]. Add
+        "?format=prometheus" for the Prometheus text format.
+        {
+            "enabled": true,
+            "counters": {"check.success": 2, "upgrade.failed": 1},
+            "histograms": {
+                "check.index_update": {
+                    "count": 2, "sum": 0.35,
+                    "buckets": [[0.005, 0], ..., ["+Inf", 2]]
+                }
+            }
+        }
+        """
+        query = getattr(message, "query", None) or {}
+        if "prometheus" == query.get("format", None):
+            return response(data={"format": "prometheus",
+                                  "text": self.metrics.to_prometheus()})
+        return response(data=self.metrics.to_dict())
+
 
 if __name__ == "__main__":  # pragma: no cover
     FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import glob
+import logging
+import os
+from threading import Lock
+
+from fwutil.debversion import compare_versions
+
+_logger = logging.getLogger("sanji.firmware.apt")
+
+
+def iter_stanzas(fp, fields):
+    """
+    Stream the stanzas of a deb822 file (dpkg status, apt Packages), only
+    the given fields are kept and continuation lines are skipped.
+
+    Args:
+        fp: file object to read lines from.
+        fields: field names to keep, e.g. ["Package", "Version"].
+    """
+    prefixes = [(field + ":", field) for field in fields]
+    stanza = {}
+    for line in fp:
+        if not line.strip():
+            if stanza:
+                yield stanza
+                stanza = {}
+            continue
+        if line[0] in " \t":
+            continue
+        for prefix, field in prefixes:
+            if line.startswith(prefix):
+                stanza[field] = line[len(prefix):].strip()
+                break
+    if stanza:
+        yield stanza
+
+
+def _newer(a, b):
+    if a is None:
+        return b
+    try:
+        return b if compare_versions(b, a) > 0 else a
+    except ValueError:
+        return a
+
+
+class PackageIndex(object):
+    """
+    Installed versions from the dpkg status file and available versions
+    from the apt lists, parsed only again when the files change.
+
+    Attributes:
+        status_path: path of the dpkg status file.
+        lists_dir: directory of the apt lists (*_Packages), or a list of
+            directories.
+        packages: package names to index, None for all.
+    """
+    def __init__(self, status_path="/var/lib/dpkg/status",
+                 lists_dir="/var/lib/apt/lists", packages=None):
+        self.status_path = status_path
+        self.lists_dir = lists_dir
+        self._lists_dirs = list(lists_dir) \
+            if isinstance(lists_dir, (list, tuple)) else [lists_dir]
+        self.packages = set(packages) if packages else None
+        self.loads = 0
+        self._lock = Lock()
+        self._installed = {}
+        self._available = {}
+        self._status_sig = None
+        self._lists_sig = None
+
+    def _signature(self, paths):
+        sig = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sig.append((path, st.st_mtime, st.st_size))
+        return tuple(sig)
+
+    def _list_files(self):
+        files = []
+        for lists_dir in self._lists_dirs:
+            files.extend(
+                sorted(glob.glob(os.path.join(lists_dir, "*_Packages"))))
+        return files
+
+    def _wanted(self, name):
+        return self.packages is None or name in self.packages
+
+    def _load_status(self, sig):
+        installed = {}
+        for path, mtime, size in sig:
+            with open(path) as fp:
+                for stanza in iter_stanzas(
+                        fp, ["Package", "Status", "Version"]):
+                    name = stanza.get("Package")
+                    if not self._wanted(name) or "Version" not in stanza:
+                        continue
+                    if stanza.get("Status", "").split()[-1:] != \
+                            ["installed"]:
+                        continue
+                    installed[name] = stanza["Version"]
+        self._installed = installed
+        self._status_sig = sig
+        self.loads += 1
+
+    def _load_lists(self, sig):
+        available = {}
+        for path, mtime, size in sig:
+            with open(path) as fp:
+                for stanza in iter_stanzas(fp, ["Package", "Version"]):
+                    name = stanza.get("Package")
+                    if not self._wanted(name) or "Version" not in stanza:
+                        continue
+                    available[name] = _newer(available.get(name),
+                                             stanza["Version"])
+        self._available = available
+        self._lists_sig = sig
+        self.loads += 1
+
+    def refresh(self):
+        """
+        Parse the files again if any of them is changed (mtime/size).
+        """
+        with self._lock:
+            sig = self._signature([self.status_path])
+            if sig != self._status_sig:
+                _logger.debug("Loading %s" % self.status_path)
+                self._load_status(sig)
+
+            sig = self._signature(self._list_files())
+            if sig != self._lists_sig:
+                _logger.debug("Loading apt lists in %s" %
+                              ", ".join(self._lists_dirs))
+                self._load_lists(sig)
+
+    def installed_version(self, name):
+        self.refresh()
+        return self._installed.get(name)
+
+    def candidate_version(self, name):
+        """
+        The highest version of the apt lists and the installed one, same
+        as apt's candidate without pinning.
+        """
+        self.refresh()
+        candidate = self._available.get(name)
+        installed = self._installed.get(name)
+        if installed is not None:
+            candidate = _newer(candidate, installed)
+        return candidate
+
+    def policy(self, name):
+        """
+        Like "apt-cache policy": (installed, candidate), "(none)" if unknown.
+        """
+        installed = self.installed_version(name)
+        candidate = self.candidate_version(name)
+        return (installed or "(none)", candidate or "(none)")
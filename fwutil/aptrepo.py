@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Refresh the apt index of the repositories in one sources.list file. Only
+the Release and Packages files are fetched, by conditional requests
+(If-None-Match/If-Modified-Since), so an unchanged repository costs one
+small request per suite.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import time
+
+from fwutil.download import open_url
+
+try:
+    from urllib2 import HTTPError
+except ImportError:
+    from urllib.error import HTTPError
+
+_logger = logging.getLogger("sanji.firmware.aptrepo")
+
+
+def parse_sources(fp):
+    """
+    Yield (uri, suite, components) of the "deb" lines of a sources.list.
+    """
+    for line in fp:
+        line = re.sub(r"\[[^\]]*\]", "", line.split("#", 1)[0]).split()
+        if len(line) < 3 or "deb" != line[0]:
+            continue
+        yield (line[1], line[2], line[3:])
+
+
+def list_name(url):
+    """
+    File name of the url in the apt lists, e.g.
+    "192.168.31.81_debian_dists_testing_main_binary-armhf_Packages".
+    """
+    name = re.sub(r"^[a-z]+://([^@/]*@)?", "", url)
+    return name.replace("/", "_")
+
+
+def parse_release(data):
+    """
+    {path: sha256} of the files listed in a Release file.
+    """
+    hashes = {}
+    section = None
+    for line in data.splitlines():
+        if line[:1] not in " \t":
+            section = line.split(":", 1)[0]
+            continue
+        fields = line.split()
+        if "SHA256" == section and 3 == len(fields):
+            hashes[fields[2]] = fields[0]
+    return hashes
+
+
+class RepoIndex(object):
+    """
+    Attributes:
+        sources_path: the sources.list file of the repositories.
+        lists_dir: directory to keep the fetched files, the Packages files
+            are named as the apt lists.
+        arch: architecture of the packages, e.g. "armhf".
+        stats: statistics of the last refresh.
+    """
+    def __init__(self, sources_path, lists_dir, arch=None, timeout=30):
+        self.sources_path = sources_path
+        self.lists_dir = lists_dir
+        self.arch = arch
+        self.timeout = timeout
+        self.stats = None
+        self._validators_path = os.path.join(lists_dir, "validators.json")
+
+    def _targets(self):
+        """
+        Yield (Release url, [(path in Release, Packages url)]) of each
+        suite.
+        """
+        with open(self.sources_path) as fp:
+            for uri, suite, components in parse_sources(fp):
+                if suite.endswith("/"):
+                    # flat repository
+                    base = "%s/%s" % (uri.rstrip("/"), suite.strip("/"))
+                    paths = ["Packages"]
+                else:
+                    base = "%s/dists/%s" % (uri.rstrip("/"), suite)
+                    paths = ["%s/binary-%s/Packages" % (component, self.arch)
+                             for component in components]
+                yield ("%s/Release" % base,
+                       [(path, "%s/%s" % (base, path)) for path in paths])
+
+    def _load_validators(self):
+        try:
+            with open(self._validators_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_validators(self, validators):
+        tmp = self._validators_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(validators, f)
+        os.rename(tmp, self._validators_path)
+
+    def _write(self, name, data):
+        path = os.path.join(self.lists_dir, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.rename(path + ".tmp", path)
+
+    def _fetch(self, url, name, validators, stats):
+        """
+        Fetch url if it is changed since the last time. The validators are
+        not changed, the caller keeps the new one once the content is
+        verified and written.
+
+        Returns:
+            (content, validator), content is None if not modified.
+        """
+        headers = {}
+        validator = validators.get(url, {})
+        if os.path.exists(os.path.join(self.lists_dir, name)):
+            if "etag" in validator:
+                headers["If-None-Match"] = validator["etag"]
+            if "lastModified" in validator:
+                headers["If-Modified-Since"] = validator["lastModified"]
+
+        stats["requests"] += 1
+        try:
+            resp = open_url(url, timeout=self.timeout, headers=headers)
+        except HTTPError as e:
+            if 304 == e.code:
+                stats["notModified"] += 1
+                return (None, None)
+            raise
+        try:
+            data = resp.read()
+            info = resp.info()
+        finally:
+            resp.close()
+        stats["bytes"] += len(data)
+
+        validator = {}
+        if info.get("ETag"):
+            validator["etag"] = info.get("ETag")
+        if info.get("Last-Modified"):
+            validator["lastModified"] = info.get("Last-Modified")
+        return (data, validator)
+
+    def _fetch_packages(self, path, url, hashes, validators, stats):
+        """
+        Fetch Packages, or Packages.gz if the plain one is not published,
+        verified by the hashes of the Release file.
+        """
+        name = list_name(url)
+        for suffix in ["", ".gz"]:
+            try:
+                data, validator = self._fetch(url + suffix, name,
+                                              validators, stats)
+            except HTTPError as e:
+                if 404 != e.code or suffix:
+                    raise
+                continue
+            if data is None:
+                return False
+            if path + suffix in hashes and \
+                    hashes[path + suffix] != hashlib.sha256(data).hexdigest():
+                raise IOError("Hash sum mismatch: %s" % (url + suffix))
+            if suffix:
+                data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+            self._write(name, data)
+            validators[url + suffix] = validator
+            return True
+
+    def refresh(self):
+        """
+        Fetch the changed Release and Packages files. The validator of a
+        file is kept only once it is verified and written, and Release
+        only once all its Packages files are, so a failed refresh is
+        fetched again next time instead of being answered "not modified".
+
+        Returns:
+            statistics: {"requests", "notModified", "bytes", "updated",
+            "seconds"}, "updated" counts the Packages files written.
+
+        Raises:
+            IOError, HTTPError: failed to fetch or verify the files.
+        """
+        start = time.time()
+        stats = {"requests": 0, "notModified": 0, "bytes": 0, "updated": 0}
+        if not os.path.isdir(self.lists_dir):
+            os.makedirs(self.lists_dir)
+        validators = self._load_validators()
+
+        try:
+            for release_url, packages in self._targets():
+                release_name = list_name(release_url)
+                release, validator = self._fetch(
+                    release_url, release_name, validators, stats)
+                changed = release is not None
+                if not changed:
+                    # the Packages files are not changed if Release is not
+                    packages = [
+                        (path, url) for path, url in packages
+                        if not os.path.exists(os.path.join(
+                            self.lists_dir, list_name(url)))]
+                    with open(os.path.join(self.lists_dir,
+                                           release_name)) as f:
+                        release = f.read()
+                hashes = parse_release(release)
+                for path, url in packages:
+                    if self._fetch_packages(path, url, hashes, validators,
+                                            stats):
+                        stats["updated"] += 1
+                if changed:
+                    self._write(release_name, release)
+                    validators[release_url] = validator
+        finally:
+            self._save_validators(validators)
+            stats["seconds"] = round(time.time() - start, 3)
+            self.stats = stats
+        _logger.debug("Refreshed %s: %s" % (self.sources_path, stats))
+        return stats
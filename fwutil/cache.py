@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import copy
+import logging
+import random
+import time
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+_logger = logging.getLogger("sanji.firmware.cache")
+
+
+class CheckCache(object):
+    """
+    Keep the latest result of a slow check in memory and refresh it in the
+    background.
+
+    Attributes:
+        loader: callable which returns a fresh result (dict).
+        ttl: seconds a cached result is considered fresh.
+        interval: seconds between background refreshes, 0 to disable.
+        jitter: up to this many seconds are added to each wait randomly,
+            so devices started together do not refresh together.
+        backoff_min, backoff_max: seconds to wait after a failed refresh,
+            doubled on each failure in a row up to backoff_max.
+        listener: callable receiving each new result.
+        flight: SingleFlight coalescing concurrent refreshes, the loader,
+            the failure counting and the listener run once per refresh
+            shared by its callers.
+        failures: failed refreshes in a row.
+    """
+    def __init__(self, loader, ttl=300, interval=0, jitter=0,
+                 backoff_min=60, backoff_max=3600, listener=None,
+                 flight=None):
+        self.loader = loader
+        self.flight = flight
+        self.ttl = ttl
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.listener = listener
+        self.failures = 0
+        self._lock = Lock()
+        self._result = None
+        self._timestamp = None
+        self._stop_event = Event()
+        self._wakeup_event = Event()
+        self._thread = None
+        self._background = None
+
+    def age(self):
+        """
+        Seconds since the cached result was loaded, None if nothing cached.
+        """
+        if self._timestamp is None:
+            return None
+        return max(0, time.time() - self._timestamp)
+
+    def is_fresh(self):
+        age = self.age()
+        return age is not None and age < self.ttl
+
+    def refresh(self):
+        """
+        Load a new result and replace the cached one. Exceptions raised by
+        the loader are passed to the caller and the old result is kept.
+        """
+        if self.flight is None:
+            self._load()
+        else:
+            self.flight.do(self._load)
+        return self._snapshot()
+
+    def _load(self):
+        try:
+            result = self.loader()
+        except Exception:
+            self.failures += 1
+            raise
+        self.failures = 0
+        with self._lock:
+            self._result = result
+            self._timestamp = time.time()
+        if self.listener is not None:
+            try:
+                self.listener(self._snapshot())
+            except Exception as e:
+                _logger.warning("Check listener failed: %s" % e)
+
+    def get(self, force=False):
+        """
+        Return a copy of the cached result with its "age" in seconds. It
+        is loaded first only if nothing is cached or forced, an expired
+        result is returned as it is and refreshed in background.
+        """
+        if force or self._timestamp is None:
+            return self.refresh()
+        if not self.is_fresh():
+            self.refresh_in_background()
+        return self._snapshot()
+
+    def refresh_in_background(self):
+        """
+        Start a refresh in background unless one is running already.
+
+        Returns:
+            the thread of the refresh.
+        """
+        with self._lock:
+            if self._background is None or \
+                    not self._background.is_alive():
+                self._background = Thread(target=self._refresh_quietly,
+                                          name="thread-check-expired")
+                self._background.daemon = True
+                self._background.start()
+            return self._background
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            _logger.warning("Background check failed: %s" % e)
+
+    def _snapshot(self):
+        with self._lock:
+            result = copy.deepcopy(self._result)
+            timestamp = self._timestamp
+        result["age"] = int(max(0, time.time() - timestamp))
+        return result
+
+    def set_policy(self, ttl=None, interval=None, jitter=None,
+                   backoff_min=None, backoff_max=None):
+        """
+        Update the policy, the background thread picks up the new one
+        immediately.
+        """
+        if ttl is not None:
+            self.ttl = ttl
+        policy = {"interval": interval, "jitter": jitter,
+                  "backoff_min": backoff_min, "backoff_max": backoff_max}
+        policy = dict((k, v) for k, v in policy.items() if v is not None)
+        if policy:
+            for key, value in policy.items():
+                setattr(self, key, value)
+            self._wakeup_event.set()
+
+    def next_delay(self):
+        """
+        Seconds to wait before the next background refresh: the interval,
+        or the backoff after failures, plus the random jitter. None if
+        the background refresh is disabled.
+        """
+        if self.interval <= 0:
+            return None
+        delay = self.interval
+        if self.failures:
+            delay = min(self.backoff_min * 2 ** (self.failures - 1),
+                        self.backoff_max)
+        if self.jitter > 0:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._refresh_loop,
+                              name="thread-check-refresh")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            self._wakeup_event.wait(self.next_delay())
+
+            if self._stop_event.is_set():
+                break
+            if self._wakeup_event.is_set():
+                # policy changed, restart the countdown
+                self._wakeup_event.clear()
+                continue
+
+            self._refresh_quietly()
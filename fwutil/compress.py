@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Decompress a compressed artifact while it is streamed, detected by its
+magic bytes: gzip, xz and zstd. The output is produced in chunks, so the
+memory used is bounded whatever the compression ratio is.
+
+gzip is decompressed by zlib. xz and zstd use the lzma/zstandard module if
+installed, otherwise the xz/zstd command.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+import zlib
+
+from fwutil.stream import CHUNK_SIZE
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_logger = logging.getLogger("sanji.firmware.compress")
+
+METHODS = ["gzip", "xz", "zstd"]
+_MAGICS = [
+    ("gzip", b"\x1f\x8b"),
+    ("xz", b"\xfd7zXZ\x00"),
+    ("zstd", b"\x28\xb5\x2f\xfd")
+]
+MAGIC_SIZE = max(len(magic) for _, magic in _MAGICS)
+_COMMANDS = {"xz": ["xz", "-dc"], "zstd": ["zstd", "-dc"]}
+
+
+def detect(head):
+    """
+    Compression method of the data starting with head, None if not
+    compressed.
+    """
+    for method, magic in _MAGICS:
+        if head[:len(magic)] == magic:
+            return method
+    return None
+
+
+class _Counting(object):
+    """
+    Count the bytes read from src.
+    """
+    def __init__(self, src, head=b""):
+        self.src = src
+        self.head = head
+        self.bytes = 0
+
+    def read(self, size=CHUNK_SIZE):
+        if self.head:
+            data, self.head = self.head[:size], self.head[size:]
+        else:
+            data = self.src.read(size)
+        self.bytes += len(data)
+        return data
+
+
+class _ZlibDecoder(object):
+
+    def __init__(self):
+        self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decode(self, data):
+        """
+        Yield the output of data, CHUNK_SIZE bytes at most each.
+        """
+        while True:
+            out = self._obj.decompress(data, CHUNK_SIZE)
+            if out:
+                yield out
+            data = self._obj.unconsumed_tail
+            if self._obj.unused_data:
+                # concatenated gzip members
+                data = self._obj.unused_data
+                self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif not data:
+                return
+
+    def finish(self):
+        out = self._obj.flush()
+        if out:
+            yield out
+
+
+class _LzmaDecoder(object):
+
+    def __init__(self):
+        self._obj = lzma.LZMADecompressor()
+
+    def decode(self, data):
+        while not self._obj.eof:
+            out = self._obj.decompress(data, CHUNK_SIZE)
+            if out:
+                yield out
+            data = b""
+            if self._obj.needs_input:
+                return
+
+    def finish(self):
+        return iter([])
+
+
+class DecompressStream(object):
+    """
+    File-like object reading the decompressed data of src.
+
+    Attributes:
+        method: gzip, xz or zstd.
+        compressed_bytes: bytes read from src.
+        bytes: decompressed bytes read.
+        seconds: seconds spent in decompressing, reading src is excluded
+            except for the zstandard module and the external commands.
+    """
+    def __init__(self, src, method, head=b""):
+        self.method = method
+        self.bytes = 0
+        self.seconds = 0.0
+        self._src = _Counting(src, head)
+        # output left of the last chunk decoded, and the rest of the
+        # chunks decoded lazily from the last input
+        self._pending = b""
+        self._outputs = None
+        self._eof = False
+        self._decoder = None
+        self._reader = None
+        self._process = None
+
+        if "gzip" == method:
+            self._decoder = _ZlibDecoder()
+        elif "xz" == method and lzma is not None and \
+                hasattr(lzma.LZMADecompressor(), "needs_input"):
+            self._decoder = _LzmaDecoder()
+        elif "zstd" == method and zstandard is not None:
+            self._reader = zstandard.ZstdDecompressor().stream_reader(
+                self._src)
+        elif method in _COMMANDS:
+            self._start_process()
+        else:
+            raise IOError("Unsupported compression: %s" % method)
+
+    @property
+    def compressed_bytes(self):
+        return self._src.bytes
+
+    def _start_process(self):
+        try:
+            self._process = subprocess.Popen(
+                _COMMANDS[self.method], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                bufsize=CHUNK_SIZE)
+        except OSError as e:
+            raise IOError("Cannot decompress %s: %s" % (self.method, e))
+        self._feeder = threading.Thread(target=self._feed,
+                                        name="thread-firmware-decompress")
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _feed(self):
+        try:
+            while True:
+                data = self._src.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self._process.stdin.write(data)
+        except (IOError, OSError) as e:
+            _logger.warning("Decompressor input closed: %s" % e)
+        finally:
+            try:
+                self._process.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    def _read_decoder(self, size):
+        while not self._pending:
+            if self._outputs is not None:
+                start = time.time()
+                self._pending = next(self._outputs, b"")
+                self.seconds += time.time() - start
+                if self._pending:
+                    break
+                self._outputs = None
+            if self._eof:
+                return b""
+            data = self._src.read(CHUNK_SIZE)
+            if data:
+                self._outputs = self._decoder.decode(data)
+            else:
+                self._outputs = self._decoder.finish()
+                self._eof = True
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def _read_external(self, size):
+        start = time.time()
+        try:
+            if self._reader is not None:
+                return self._reader.read(size)
+            data = self._process.stdout.read(size)
+            if not data:
+                self._feeder.join()
+                if self._process.wait():
+                    raise IOError("Cannot decompress %s: %s" % (
+                        self.method,
+                        self._process.stderr.read().decode(
+                            "utf-8", "ignore").strip()))
+            return data
+        finally:
+            self.seconds += time.time() - start
+
+    def read(self, size=CHUNK_SIZE):
+        try:
+            if self._decoder is not None:
+                data = self._read_decoder(size)
+            else:
+                data = self._read_external(size)
+        except (zlib.error, EOFError) as e:
+            raise IOError("Cannot decompress %s: %s" % (self.method, e))
+        except Exception as e:
+            if lzma is not None and isinstance(e, lzma.LZMAError) or \
+                    zstandard is not None and \
+                    isinstance(e, zstandard.ZstdError):
+                raise IOError("Cannot decompress %s: %s" % (self.method, e))
+            raise
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+    def stats(self):
+        """
+        Compression ratio (decompressed / compressed bytes) and the
+        decompression throughput (decompressed bytes per second).
+        """
+        return {
+            "method": self.method,
+            "compressedBytes": self.compressed_bytes,
+            "bytes": self.bytes,
+            "ratio": round(float(self.bytes) / self.compressed_bytes, 3)
+            if self.compressed_bytes else None,
+            "seconds": round(self.seconds, 3),
+            "throughput": int(self.bytes / self.seconds)
+            if self.seconds else None
+        }
+
+
+def open_decompressed(src):
+    """
+    Detect the compression of src by its first bytes.
+
+    Returns:
+        (stream, method), stream reads src from its start as it is and
+        method is None if src is not compressed.
+    """
+    head = src.read(MAGIC_SIZE)
+    method = detect(head)
+    if method is None:
+        return (_Counting(src, head), None)
+    return (DecompressStream(src, method, head), method)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Debian version comparison, following the rules of dpkg (lib/dpkg/version.c)
+so we don't have to fork "dpkg --compare-versions" for every check.
+"""
+
+import re
+
+_DIGITS = "0123456789"
+_LETTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_VERSION_RE = re.compile(r"^[A-Za-z0-9.+~:-]+$")
+
+_RELATIONS = {
+    "lt": lambda r: r < 0, "<<": lambda r: r < 0,
+    "le": lambda r: r <= 0, "<=": lambda r: r <= 0,
+    "eq": lambda r: r == 0, "=": lambda r: r == 0,
+    "ne": lambda r: r != 0,
+    "ge": lambda r: r >= 0, ">=": lambda r: r >= 0,
+    "gt": lambda r: r > 0, ">>": lambda r: r > 0
+}
+
+
+def parse_version(version):
+    """
+    Split a version string into (epoch, upstream, revision).
+
+    Raises:
+        ValueError: the version string is invalid.
+    """
+    version = version.strip() if version else ""
+    if not version:
+        raise ValueError("Version string is empty.")
+
+    epoch = 0
+    if ":" in version:
+        epoch_str, version = version.split(":", 1)
+        if not epoch_str.isdigit():
+            raise ValueError("Epoch in version is not a number.")
+        epoch = int(epoch_str)
+
+    revision = "0"
+    if "-" in version:
+        version, revision = version.rsplit("-", 1)
+        if not revision:
+            raise ValueError("Revision number is empty.")
+
+    if not _VERSION_RE.match(version):
+        raise ValueError("Invalid character in version number.")
+    return (epoch, version, revision)
+
+
+def _order(char):
+    if char in _DIGITS:
+        return 0
+    if char in _LETTERS:
+        return ord(char)
+    if char == "~":
+        return -1
+    if char:
+        return ord(char) + 256
+    return 0
+
+
+def _verrevcmp(a, b):
+    i = j = 0
+    len_a = len(a)
+    len_b = len(b)
+    while i < len_a or j < len_b:
+        first_diff = 0
+        while (i < len_a and a[i] not in _DIGITS) or \
+                (j < len_b and b[j] not in _DIGITS):
+            ac = _order(a[i]) if i < len_a else 0
+            bc = _order(b[j]) if j < len_b else 0
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+
+        while i < len_a and a[i] == "0":
+            i += 1
+        while j < len_b and b[j] == "0":
+            j += 1
+        while i < len_a and a[i] in _DIGITS and j < len_b and b[j] in _DIGITS:
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+
+        if i < len_a and a[i] in _DIGITS:
+            return 1
+        if j < len_b and b[j] in _DIGITS:
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def compare_versions(a, b):
+    """
+    Compare two Debian versions.
+
+    Returns:
+        -1, 0 or 1 if a is lower than, equal to or greater than b.
+
+    Raises:
+        ValueError: one of the versions is invalid.
+    """
+    epoch_a, upstream_a, revision_a = parse_version(a)
+    epoch_b, upstream_b, revision_b = parse_version(b)
+
+    result = epoch_a - epoch_b
+    if not result:
+        result = _verrevcmp(upstream_a, upstream_b)
+    if not result:
+        result = _verrevcmp(revision_a, revision_b)
+    return (result > 0) - (result < 0)
+
+
+def check_relation(a, op, b):
+    """
+    Same as "dpkg --compare-versions a op b" without the fork.
+
+    Args:
+        op: lt, le, eq, ne, ge, gt or <<, <=, =, >=, >>.
+    """
+    if op not in _RELATIONS:
+        raise ValueError("Unknown relation: %s" % op)
+    return _RELATIONS[op](compare_versions(a, b))
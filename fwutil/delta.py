@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Binary delta between two firmware images.
+
+A delta starts with MAGIC and is followed by operations which rebuild the
+target image in order:
+
+    "C" offset(8 bytes) length(4 bytes): copy bytes from the source image
+    "D" length(4 bytes) data:            insert the data
+
+Both the delta and the rebuilt image are streamed, only the source image
+needs to be seekable.
+"""
+
+import hashlib
+import struct
+
+from fwutil.stream import CHUNK_SIZE
+from fwutil.stream import _check_chunk_size
+
+MAGIC = b"FWDELTA1"
+COPY = b"C"
+DATA = b"D"
+
+_COPY = struct.Struct(">QI")
+_DATA = struct.Struct(">I")
+# the largest length of one operation
+MAX_LENGTH = 0xffffffff
+
+
+def _read_exactly(src, size):
+    data = src.read(size)
+    if len(data) != size:
+        raise IOError("Delta is truncated.")
+    return data
+
+
+class DeltaReader(object):
+    """
+    Wrap the delta file object to count the bytes read.
+    """
+    def __init__(self, src):
+        self.src = src
+        self.size = 0
+
+    def read(self, size):
+        data = self.src.read(size)
+        self.size += len(data)
+        return data
+
+
+def iter_delta(source, delta, chunk_size=CHUNK_SIZE, digests=None):
+    """
+    Yield the target image rebuilt from the source image (a seekable file
+    object) and the delta, chunk by chunk. Each chunk also updates the
+    given hashlib objects.
+
+    Raises:
+        IOError: the delta is corrupted or does not match the source.
+    """
+    _check_chunk_size(chunk_size)
+    digests = digests or []
+    if MAGIC != delta.read(len(MAGIC)):
+        raise IOError("Not a firmware delta.")
+
+    while True:
+        op = delta.read(1)
+        if not op:
+            return
+        if COPY == op:
+            offset, length = _COPY.unpack(_read_exactly(delta, _COPY.size))
+            source.seek(offset)
+            read = source.read
+        elif DATA == op:
+            length, = _DATA.unpack(_read_exactly(delta, _DATA.size))
+            read = delta.read
+        else:
+            raise IOError("Delta is corrupted.")
+
+        while length > 0:
+            chunk = read(min(length, chunk_size))
+            if not chunk:
+                raise IOError("Delta does not match the source image.")
+            length -= len(chunk)
+            for digest in digests:
+                digest.update(chunk)
+            yield chunk
+
+
+def apply_delta(source, delta, dst, chunk_size=CHUNK_SIZE, digests=None):
+    """
+    Rebuild the target image from source and delta to dst (file objects).
+
+    Returns:
+        (bytes written, bytes of the delta read).
+    """
+    delta = DeltaReader(delta)
+    size = 0
+    for chunk in iter_delta(source, delta, chunk_size, digests):
+        dst.write(chunk)
+        size += len(chunk)
+    return (size, delta.size)
+
+
+def make_delta(source, target, dst, block_size=4096):
+    """
+    Write the delta from source to target (bytes) to dst.
+
+    A simple encoder for tooling and tests: blocks of the target found in
+    the source at block boundaries are copied, the rest is inserted. Both
+    images are held in memory.
+
+    Returns:
+        size of the delta in bytes.
+    """
+    index = {}
+    for offset in range(0, len(source) - block_size + 1, block_size):
+        key = hashlib.md5(source[offset:offset + block_size]).digest()
+        index.setdefault(key, offset)
+
+    ops = []
+    for offset in range(0, len(target), block_size):
+        block = target[offset:offset + block_size]
+        found = index.get(hashlib.md5(block).digest(), None) \
+            if len(block) == block_size else None
+        if found is not None and \
+                source[found:found + block_size] == block:
+            if ops and COPY == ops[-1][0] and \
+                    ops[-1][1] + ops[-1][2] == found and \
+                    ops[-1][2] + block_size <= MAX_LENGTH:
+                ops[-1][2] += block_size
+            else:
+                ops.append([COPY, found, block_size])
+        elif ops and DATA == ops[-1][0] and \
+                len(ops[-1][1]) + len(block) <= MAX_LENGTH:
+            ops[-1][1] += block
+        else:
+            ops.append([DATA, block])
+
+    size = len(MAGIC)
+    dst.write(MAGIC)
+    for op in ops:
+        if COPY == op[0]:
+            data = op[0] + _COPY.pack(op[1], op[2])
+        else:
+            data = op[0] + _DATA.pack(len(op[1])) + op[1]
+        dst.write(data)
+        size += len(data)
+    return size
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import logging
+import os
+
+from fwutil.compress import open_decompressed
+from fwutil.stream import CHUNK_SIZE
+from fwutil.stream import copy_stream
+from fwutil.stream import hash_stream
+
+try:
+    from urllib2 import urlopen
+    from urllib2 import Request
+    from urllib2 import HTTPError
+except ImportError:
+    from urllib.request import urlopen
+    from urllib.request import Request
+    from urllib.error import HTTPError
+
+_logger = logging.getLogger("sanji.firmware.download")
+
+
+def open_url(url, offset=0, timeout=30, headers=None):
+    """
+    Open url for streaming, from offset if given.
+    """
+    request = Request(url, headers=headers or {})
+    if offset:
+        request.add_header("Range", "bytes=%d-" % offset)
+    return urlopen(request, timeout=timeout)
+
+
+def download(url, path, chunk_size=CHUNK_SIZE, timeout=30, digests=None,
+             cancelled=None):
+    """
+    Download url to path in chunks. The data is written to path.part
+    first, an interrupted download is resumed from it.
+
+    Args:
+        digests: hashlib objects updated with the whole file while it is
+            downloaded.
+        cancelled: threading.Event, the download stops once set and is
+            resumed next time.
+
+    Returns:
+        size of the file in bytes.
+
+    Raises:
+        IOError: the download is incomplete.
+    """
+    digests = digests or []
+    part = path + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+
+    try:
+        resp = open_url(url, offset, timeout)
+    except HTTPError as e:
+        if 416 != e.code or not offset:
+            raise
+        # nothing left to download
+        resp = None
+
+    if resp is not None and offset and 206 != resp.getcode():
+        _logger.info("Server does not support resuming, download again.")
+        offset = 0
+
+    # the downloaded part is hashed again to continue the digests
+    if offset and digests:
+        with open(part, "rb") as f:
+            hash_stream(f, chunk_size, digests)
+    if resp is None:
+        os.rename(part, path)
+        return offset
+
+    length = resp.info().get("Content-Length")
+    try:
+        with open(part, "ab" if offset else "wb") as f:
+            size = offset + copy_stream(resp, f, chunk_size, digests,
+                                        cancelled)
+    finally:
+        resp.close()
+
+    if length is not None and size != offset + int(length):
+        raise IOError("Incomplete download: %s" % url)
+    os.rename(part, path)
+    return size
+
+
+def download_decompressed(url, path, chunk_size=CHUNK_SIZE, timeout=30,
+                          digests=None, cancelled=None):
+    """
+    Download url to path as download(), but a gzip, xz or zstd compressed
+    file is decompressed while it is downloaded and the digests are of the
+    decompressed data. A compressed download is written to path.unpack
+    and is not resumed.
+
+    Returns:
+        (size of the file, decompression stats or None if not compressed).
+
+    Raises:
+        IOError: the download is incomplete or cannot be decompressed.
+    """
+    if os.path.exists(path + ".part"):
+        return (download(url, path, chunk_size, timeout, digests,
+                         cancelled), None)
+
+    resp = open_url(url, timeout=timeout)
+    length = resp.info().get("Content-Length")
+    try:
+        stream, method = open_decompressed(resp)
+        target = path + (".unpack" if method else ".part")
+        try:
+            with open(target, "wb") as f:
+                size = copy_stream(stream, f, chunk_size, digests,
+                                   cancelled)
+        except Exception:
+            if method is not None and os.path.exists(target):
+                os.remove(target)
+            raise
+        finally:
+            if method is not None:
+                stream.close()
+    finally:
+        resp.close()
+
+    received = size if method is None else stream.compressed_bytes
+    if length is not None and received != int(length):
+        if method is not None:
+            os.remove(target)
+        raise IOError("Incomplete download: %s" % url)
+    os.rename(target, path)
+    return (size, stream.stats() if method is not None else None)
+
+
+def fetch_text(url, timeout=30):
+    """
+    Return the content of a small text file, None if not found.
+    """
+    try:
+        resp = urlopen(url, timeout=timeout)
+    except HTTPError as e:
+        if 404 == e.code:
+            return None
+        raise
+    try:
+        return resp.read().decode("utf-8")
+    finally:
+        resp.close()
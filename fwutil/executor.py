@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Run the external commands (sh) in background threads with a timeout each,
+at most max_workers of them at a time. The timeout counts the time waiting
+for a worker too. Short commands may have workers of their own, so they
+are not queued behind the long ones. A running command can be cancelled,
+its process is terminated.
+"""
+
+import logging
+import time
+from threading import BoundedSemaphore
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+import sh
+
+_logger = logging.getLogger("sanji.firmware.executor")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+
+
+class CommandTimeout(IOError):
+    pass
+
+
+class CommandCancelled(IOError):
+    pass
+
+
+class Command(object):
+    """
+    A command submitted to the executor.
+
+    Attributes:
+        name: name of the command, e.g. "apt-get".
+        timeout: seconds the command may wait and run, None to wait
+            forever.
+        state: queued, running, done, failed, timeout or cancelled.
+        seconds: seconds the command ran.
+    """
+    def __init__(self, name, func, args, kwargs, timeout):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.state = QUEUED
+        self.seconds = None
+        self.deadline = None if timeout is None else time.time() + timeout
+        self._lock = Lock()
+        self._done = Event()
+        self._process = None
+        self._cancelled = False
+        self._result = None
+        self._error = None
+
+    def cancel(self):
+        """
+        Cancel the command, the process is terminated if it is running.
+        """
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._cancelled = True
+            process = self._process
+        if process is not None:
+            try:
+                process.terminate()
+            except Exception as e:
+                _logger.debug("Cannot terminate %s: %s" % (self.name, e))
+        return True
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the command and return its output (sh.RunningCommand).
+
+        Raises:
+            CommandTimeout: the command timed out, or it is still running
+                after the given timeout.
+            CommandCancelled: the command is cancelled.
+            Exception: the command failed, e.g. sh.ErrorReturnCode.
+        """
+        if not self._done.wait(timeout):
+            raise CommandTimeout("%s is still running." % self.name)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _start(self):
+        with self._lock:
+            if self._cancelled:
+                raise CommandCancelled("%s is cancelled." % self.name)
+            timeout = self.timeout
+            if self.deadline is not None:
+                # the time left after waiting for a worker
+                timeout = self.deadline - time.time()
+                if timeout <= 0:
+                    raise CommandTimeout(
+                        "%s timed out after waiting %s seconds for a "
+                        "worker." % (self.name, self.timeout))
+            self.state = RUNNING
+            self._process = self.func(
+                *self.args, _bg=True, _timeout=timeout, **self.kwargs)
+            return self._process
+
+    def _finish(self, state, result=None, error=None):
+        self.state = state
+        self._result = result
+        self._error = error
+        self._done.set()
+
+
+class Executor(object):
+    """
+    Attributes:
+        max_workers: commands run at the same time, the others wait.
+        timeout: default seconds a command may run.
+        short_workers, short_timeout: commands of timeout up to
+            short_timeout run on short_workers of their own, None to share
+            the workers.
+    """
+    def __init__(self, max_workers=2, timeout=300, short_workers=1,
+                 short_timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.short_timeout = short_timeout
+        self._slots = BoundedSemaphore(max_workers)
+        self._short_slots = BoundedSemaphore(short_workers)
+        self._lock = Lock()
+        self._closed = False
+        self._commands = []
+        self._stats = {"submitted": 0, "done": 0, "failed": 0,
+                       "timeouts": 0, "cancelled": 0}
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func (a sh.Command) with args in background.
+
+        Args:
+            timeout: (keyword) seconds the command may run, the default
+                timeout if not given.
+            other keywords are passed to the command, e.g. _out.
+
+        Returns:
+            Command.
+
+        Raises:
+            CommandCancelled: the executor is shut down.
+        """
+        timeout = kwargs.pop("timeout", self.timeout)
+        name = getattr(func, "_path", None) or \
+            getattr(func, "__name__", None) or str(func)
+        command = Command(name, func, args, kwargs, timeout)
+        with self._lock:
+            if self._closed:
+                raise CommandCancelled("%s is cancelled, shutting down." %
+                                       name)
+            self._commands.append(command)
+            self._stats["submitted"] += 1
+        thread = Thread(target=self._run, args=(command,),
+                        name="thread-firmware-command")
+        thread.daemon = True
+        thread.start()
+        return command
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run func with args and wait for its output, see submit().
+        """
+        return self.submit(func, *args, **kwargs).result()
+
+    def _slots_of(self, command):
+        if self.short_timeout is not None and command.timeout is not None \
+                and command.timeout <= self.short_timeout:
+            return self._short_slots
+        return self._slots
+
+    def _run(self, command):
+        with self._slots_of(command):
+            start = time.time()
+            try:
+                process = command._start()
+                # mocked or already finished commands have nothing to wait
+                if hasattr(process, "wait"):
+                    process.wait()
+            except sh.TimeoutException:
+                state, result = TIMEOUT, None
+                error = CommandTimeout("%s timed out after %s seconds." %
+                                       (command.name, command.timeout))
+            except CommandTimeout as e:
+                state, result, error = TIMEOUT, None, e
+            except Exception as e:
+                state, result, error = FAILED, None, e
+                if command._cancelled:
+                    state = CANCELLED
+                    error = CommandCancelled("%s is cancelled." %
+                                             command.name)
+            else:
+                state, result, error = DONE, process, None
+            command.seconds = round(time.time() - start, 3)
+
+        if error is not None:
+            _logger.warning("Command %s %s: %s" %
+                            (command.name, state, error))
+        with self._lock:
+            self._commands.remove(command)
+            self._stats[{DONE: "done", FAILED: "failed",
+                         TIMEOUT: "timeouts",
+                         CANCELLED: "cancelled"}[state]] += 1
+        command._finish(state, result, error)
+
+    def running(self):
+        """
+        Commands not finished yet, the queued ones included.
+        """
+        with self._lock:
+            return list(self._commands)
+
+    def cancel_all(self):
+        for command in self.running():
+            command.cancel()
+
+    def shutdown(self):
+        """
+        Cancel all the commands and refuse new ones.
+        """
+        with self._lock:
+            self._closed = True
+        self.cancel_all()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["running"] = len(
+                [c for c in self._commands if RUNNING == c.state])
+            stats["queued"] = len(self._commands) - stats["running"]
+        return stats
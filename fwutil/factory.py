@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Reset the configuration tree to factory default file by file. The factory
+defaults ("<bundle>/data/<name>.json.factory" beside the model of each
+bundle, as laid out by ModelInitiator) are hashed into a manifest, and
+only the files differing from it are restored.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+
+from fwutil.verify import hash_file
+
+_logger = logging.getLogger("sanji.firmware.factory")
+
+FACTORY_SUFFIX = ".factory"
+# the factory defaults of the bundle models under the root
+FACTORY_PATTERN = os.path.join("*", "data", "*.json" + FACTORY_SUFFIX)
+CREATE = "create"
+RESTORE = "restore"
+
+
+class Manifest(object):
+    """
+    Attributes:
+        root: the configuration tree.
+        path: where the manifest is kept, a factory default is hashed
+            again only if its size or mtime is changed. None to keep
+            nothing.
+        entries: {path of the file relative to root: {"sha256", "size",
+            "mtime"} of its factory default}.
+    """
+    def __init__(self, root, path=None):
+        self.root = root
+        self.path = path
+        self.entries = {}
+        self.hashed = 0
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except ValueError as e:
+                _logger.warning("Cannot load the manifest: %s" % e)
+
+    def build(self, save=True):
+        """
+        Hash the factory defaults of the bundles under root into the
+        entries, the kept ones are reused if unchanged.
+
+        Args:
+            save: write the manifest if changed, False to keep the file
+                untouched (e.g. a dry run).
+
+        Returns:
+            the entries.
+        """
+        entries = {}
+        self.hashed = 0
+        for factory in glob.glob(os.path.join(self.root, FACTORY_PATTERN)):
+            name = os.path.relpath(factory, self.root)[:-len(FACTORY_SUFFIX)]
+            st = os.stat(factory)
+            entry = self.entries.get(name, None)
+            if entry is None or entry["size"] != st.st_size or \
+                    entry["mtime"] != st.st_mtime:
+                entry = {"sha256": hash_file(factory).hexdigest(),
+                         "size": st.st_size, "mtime": st.st_mtime}
+                self.hashed += 1
+            entries[name] = entry
+
+        changed = entries != self.entries
+        self.entries = entries
+        if changed and save and self.path is not None:
+            self.save()
+        return self.entries
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=4, sort_keys=True)
+        os.rename(tmp, self.path)
+
+
+def diff(manifest):
+    """
+    Compare the configuration tree with the manifest, a file is hashed
+    only if it has the same size as its factory default.
+
+    Returns:
+        {"changes": [{"path", "action", "bytes"}], "unchanged": count},
+        action is "create" if the file is missing or "restore", bytes are
+        the size of the factory default.
+    """
+    changes = []
+    unchanged = 0
+    for name, entry in sorted(manifest.entries.items()):
+        path = os.path.join(manifest.root, name)
+        if not os.path.exists(path):
+            action = CREATE
+        elif os.path.getsize(path) != entry["size"] or \
+                hash_file(path).hexdigest() != entry["sha256"]:
+            action = RESTORE
+        else:
+            unchanged += 1
+            continue
+        changes.append({"path": name, "action": action,
+                        "bytes": entry["size"]})
+    return {"changes": changes, "unchanged": unchanged}
+
+
+def restore(root, changes):
+    """
+    Copy the factory defaults of the changed files over them as a batch:
+    all are written to temporary files first, synced, then renamed
+    together and each directory is synced once. Nothing is replaced if
+    any copy fails.
+
+    Returns:
+        paths of the restored files.
+    """
+    paths = [os.path.join(root, change["path"]) for change in changes]
+    tmps = []
+    try:
+        for path in paths:
+            tmps.append(path + ".tmp")
+            shutil.copy2(path + FACTORY_SUFFIX, path + ".tmp")
+        # synced after all are written, the writes are flushed together
+        for tmp in tmps:
+            fd = os.open(tmp, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+    except (IOError, OSError):
+        for tmp in tmps:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    for path in paths:
+        os.rename(path + ".tmp", path)
+    for directory in set(os.path.dirname(path) for path in paths):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    _logger.info("Restored %d files to factory default." % len(paths))
+    return paths
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Size-bounded history of the upgrade and reset attempts.
+
+Records are kept in fixed-size slots of one file, used as a ring buffer:
+appending a record writes its slot and the header only, the oldest record
+is overwritten when the file is full.
+
+    header: magic(8) capacity(4) count(4)
+    record: id(4) timestamp(4) type(1) outcome(1) from(32) to(32)
+            download(4) install(4) reboot(4)  (milliseconds)
+"""
+
+import logging
+import os
+import struct
+import time
+from threading import Lock
+
+_logger = logging.getLogger("sanji.firmware.history")
+
+MAGIC = b"FWHIST1\0"
+_HEADER = struct.Struct(">8sII")
+_RECORD = struct.Struct(">IIBB32s32sIII")
+
+TYPES = ["upgrade", "reset"]
+OUTCOMES = ["success", "failed", "interrupted"]
+PHASES = ["download", "install", "reboot"]
+
+# the largest duration can be kept (milliseconds)
+_MAX_MS = 0xffffffff
+
+
+def _encode_version(version):
+    return (version or "").encode("utf-8")[:32]
+
+
+def _decode_version(data):
+    return data.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+class Phases(object):
+    """
+    Measure the duration of each phase of an attempt.
+    """
+    def __init__(self):
+        self._current = None
+        self._started = None
+        self.durations = {}
+
+    def enter(self, phase):
+        """
+        End the current phase and start another one, None to end only.
+        """
+        if phase == self._current:
+            return
+        now = time.time()
+        if self._current is not None:
+            self.durations[self._current] = round(
+                self.durations.get(self._current, 0) + now - self._started,
+                3)
+        self._current = phase
+        self._started = now
+
+
+class History(object):
+    """
+    Attributes:
+        path: the history file.
+        capacity: records kept, the file is at most
+            16 + capacity * 86 bytes.
+    """
+    def __init__(self, path, capacity=256):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self._lock = Lock()
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self.path, "rb") as f:
+                magic, capacity, count = _HEADER.unpack(
+                    f.read(_HEADER.size))
+        except (IOError, struct.error):
+            magic = None
+        if MAGIC == magic:
+            # the records are laid out by the capacity of the file
+            self.capacity, self.count = capacity, count
+            return
+
+        if os.path.exists(self.path):
+            _logger.warning("Invalid history file, start a new one.")
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, self.capacity, 0))
+        self.count = 0
+
+    def _offset(self, id):
+        return _HEADER.size + ((id - 1) % self.capacity) * _RECORD.size
+
+    def append(self, type, outcome, timestamp=None, version_from=None,
+               version_to=None, durations=None):
+        """
+        Append a record.
+
+        Args:
+            type: one of TYPES.
+            outcome: one of OUTCOMES.
+            durations: {phase: seconds} of PHASES.
+
+        Returns:
+            id of the record.
+        """
+        durations = durations or {}
+        with self._lock:
+            id = self.count + 1
+            data = _RECORD.pack(
+                id, int(timestamp or time.time()),
+                TYPES.index(type), OUTCOMES.index(outcome),
+                _encode_version(version_from), _encode_version(version_to),
+                *[min(int(durations.get(phase, 0) * 1000), _MAX_MS)
+                  for phase in PHASES])
+            with open(self.path, "r+b") as f:
+                f.seek(self._offset(id))
+                f.write(data)
+                f.seek(0)
+                f.write(_HEADER.pack(MAGIC, self.capacity, id))
+                f.flush()
+                os.fsync(f.fileno())
+            self.count = id
+        return id
+
+    def _unpack(self, data):
+        fields = _RECORD.unpack(data)
+        return {
+            "id": fields[0],
+            "timestamp": fields[1],
+            "type": TYPES[fields[2]],
+            "outcome": OUTCOMES[fields[3]],
+            "from": _decode_version(fields[4]),
+            "to": _decode_version(fields[5]),
+            "durations": dict(
+                (phase, ms / 1000.0) for phase, ms in zip(PHASES, fields[6:]))
+        }
+
+    def records(self):
+        """
+        All records, the latest first.
+        """
+        records = []
+        with self._lock:
+            first = max(1, self.count - self.capacity + 1)
+            with open(self.path, "rb") as f:
+                for id in range(self.count, first - 1, -1):
+                    f.seek(self._offset(id))
+                    record = self._unpack(f.read(_RECORD.size))
+                    if id == record["id"]:
+                        records.append(record)
+        return records
+
+    def query(self, type=None, outcome=None, since=None, until=None,
+              offset=0, limit=20):
+        """
+        Records matching the filters, the latest first.
+
+        Returns:
+            (total of the matched records, records from offset to limit).
+        """
+        matched = [
+            record for record in self.records()
+            if (type is None or type == record["type"]) and
+            (outcome is None or outcome == record["outcome"]) and
+            (since is None or record["timestamp"] >= since) and
+            (until is None or record["timestamp"] < until)]
+        return (len(matched), matched[offset:offset + limit])
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from threading import Thread
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+_logger = logging.getLogger("sanji.firmware.jobs")
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+INSTALLING = "installing"
+REBOOTING = "rebooting"
+FAILED = "failed"
+DONE = "done"
+
+
+class Job(object):
+    """
+    A background operation and its state.
+
+    Attributes:
+        id: job id, unique in this process.
+        type: kind of the operation, e.g. "upgrade".
+        state: queued, downloading, installing, rebooting, failed or done.
+        message: detail of the current state.
+        percent: progress of the job, 0 - 100.
+    """
+    def __init__(self, id, type, func):
+        self.id = id
+        self.type = type
+        self.func = func
+        self.state = QUEUED
+        self.message = ""
+        self.percent = 0
+        self.created = int(time.time())
+        self.updated = self.created
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """
+        listener(job) is called on every state change.
+        """
+        self._listeners.append(listener)
+
+    def set_state(self, state, message=""):
+        self.state = state
+        self.message = message
+        self.updated = int(time.time())
+        _logger.info("Job %s (%s): %s %s" %
+                     (self.id, self.type, state, message))
+        for listener in self._listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                _logger.warning("Job listener failed: %s" % e)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.type,
+            "state": self.state,
+            "message": self.message,
+            "percent": self.percent,
+            "createdAt": self.created,
+            "updatedAt": self.updated
+        }
+
+
+class JobManager(object):
+    """
+    Run jobs one by one in a background thread, the latest max_jobs jobs
+    are kept for querying.
+    """
+    def __init__(self, max_jobs=20):
+        self.max_jobs = max_jobs
+        self._lock = Lock()
+        self._queue = Queue()
+        self._jobs = OrderedDict()
+        self._next_id = 1
+        self._thread = None
+
+    def submit(self, type, func):
+        """
+        Queue func(job) to run in background and return the job.
+        """
+        with self._lock:
+            job = Job(self._next_id, type, func)
+            self._next_id += 1
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._worker,
+                                      name="thread-firmware-jobs")
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, id):
+        with self._lock:
+            return self._jobs.get(id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker after the running job, waiting for it up to
+        timeout seconds (None to wait until it ends).
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                job.func(job)
+            except Exception as e:
+                _logger.error("Job %s (%s) failed: %s" % (job.id, job.type, e))
+                job.set_state(FAILED, str(e))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Counters and latency histograms of the bundle operations. When disabled,
+timing a block costs one attribute check and no clock is read.
+"""
+
+import functools
+import re
+import time
+from threading import Lock
+
+# upper bounds of the histogram buckets (seconds)
+BUCKETS = [0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900]
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.time() - self.start)
+        return False
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        """
+        Cumulative counts of the buckets, as Prometheus.
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            cumulative.append([bound, total])
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "buckets": cumulative}
+
+
+class Metrics(object):
+    """
+    Attributes:
+        enabled: nothing is recorded if disabled.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            self._histograms[name].observe(seconds)
+
+    def timer(self, name):
+        """
+        Context manager observing the seconds spent in the block.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "counters": dict(self._counters),
+                "histograms": dict(
+                    (name, histogram.to_dict())
+                    for name, histogram in self._histograms.items())
+            }
+
+    def to_prometheus(self, prefix="sanji_firmware_"):
+        """
+        Export in the Prometheus text format, names are prefixed and "."
+        is replaced by "_", e.g. "check.policy" as
+        sanji_firmware_check_policy_seconds.
+        """
+        def metric_name(name):
+            return prefix + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        data = self.to_dict()
+        lines = []
+        for name, value in sorted(data["counters"].items()):
+            name = metric_name(name) + "_total"
+            lines.append("# TYPE %s counter" % name)
+            lines.append("%s %s" % (name, value))
+        for name, histogram in sorted(data["histograms"].items()):
+            name = metric_name(name) + "_seconds"
+            lines.append("# TYPE %s histogram" % name)
+            for bound, count in histogram["buckets"]:
+                lines.append('%s_bucket{le="%s"} %d' % (name, bound, count))
+            lines.append("%s_sum %s" % (name, histogram["sum"]))
+            lines.append("%s_count %d" % (name, histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def timed(name):
+    """
+    Decorate a method of an object having "metrics" to observe its
+    latency.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Allow one firmware operation (upgrade, reset or stage) at a time.
+
+The holder is a dict kept in the model by the listener, so a restarted
+bundle still refuses other operations while the one started before is
+running on the same boot. A holder is over once the device rebooted or
+it expired.
+"""
+
+import logging
+import time
+from threading import Lock
+
+_logger = logging.getLogger("sanji.firmware.oplock")
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def boot_id(path=BOOT_ID_PATH):
+    """
+    Id of the current boot, None if unknown.
+    """
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+class Busy(Exception):
+    """
+    Another operation holds the lock.
+
+    Attributes:
+        holder: the operation in progress.
+    """
+    def __init__(self, holder):
+        super(Busy, self).__init__(
+            "Operation %s is in progress." % holder["type"])
+        self.holder = holder
+
+
+class OperationLock(object):
+    """
+    Attributes:
+        holder: {"type", "request", "startedAt", "expiresAt", "boot"} of
+            the operation in progress, None if idle.
+        boot: id of the current boot.
+        listener: listener(holder) is called when the holder is changed.
+    """
+    def __init__(self, holder=None, boot=None, listener=None):
+        self.boot = boot
+        self.listener = listener
+        self.holder = None
+        self._lock = Lock()
+        if holder is None:
+            return
+        if self._alive(holder):
+            _logger.warning("Operation %s is still in progress." %
+                            holder["type"])
+            self.holder = holder
+        else:
+            _logger.info("Operation %s is over." % holder["type"])
+            self._notify()
+
+    def _alive(self, holder):
+        return self.boot == holder.get("boot", None) and \
+            time.time() < holder.get("expiresAt", 0)
+
+    def _notify(self):
+        if self.listener is not None:
+            self.listener(self.holder)
+
+    def acquire(self, type, request=None, ttl=3600):
+        """
+        Hold the lock for an operation.
+
+        Args:
+            type: type of the operation, e.g. "upgrade".
+            request: parameters identifying the operation, the same type
+                and request is the same operation.
+            ttl: seconds the operation may take at most.
+
+        Returns:
+            (holder, acquired), acquired is False if the same operation is
+            in progress already, holder is that one.
+
+        Raises:
+            Busy: another operation is in progress.
+        """
+        with self._lock:
+            if self.holder is not None and not self._alive(self.holder):
+                _logger.warning("Operation %s expired." % self.holder["type"])
+                self.holder = None
+            if self.holder is not None:
+                if type == self.holder["type"] and \
+                        request == self.holder.get("request", None):
+                    return (self.holder, False)
+                raise Busy(self.holder)
+
+            now = int(time.time())
+            self.holder = {"type": type, "request": request,
+                           "startedAt": now, "expiresAt": now + ttl,
+                           "boot": self.boot}
+            self._notify()
+            return (self.holder, True)
+
+    def update(self, **fields):
+        """
+        Keep more fields in the holder, e.g. jobId.
+        """
+        with self._lock:
+            if self.holder is None:
+                return
+            self.holder.update(fields)
+            self._notify()
+
+    def release(self):
+        with self._lock:
+            if self.holder is None:
+                return
+            self.holder = None
+            self._notify()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Share the verified artifacts with the other gateways of a site: one bundle
+keeps them in a cache directory and serves it over HTTP, the others use it
+as their server. An artifact is kept along with its "<name>.sha256" and
+"<name>.sig", so the peers verify it as the one from the repository.
+"""
+
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+
+from fwutil.stream import CHUNK_SIZE
+
+_logger = logging.getLogger("sanji.firmware.peercache")
+
+SIGNATURES = [".sha256", ".sig"]
+
+_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]*$")
+
+
+class ArtifactCache(object):
+    """
+    Attributes:
+        directory: where the artifacts are kept.
+        max_bytes: total size of the artifacts kept at most.
+        max_age: seconds an artifact is kept since it is added.
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024,
+                 max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        if not _NAME.match(name):
+            raise ValueError("Invalid artifact name: %s" % name)
+        return os.path.join(self.directory, name)
+
+    def add(self, name, path, checksum=None, signature=None):
+        """
+        Keep the file of path as the artifact name, it is linked instead
+        of copied if possible.
+        """
+        target = self._path(name)
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self._remove(name)
+            for ext, text in zip(SIGNATURES, [checksum, signature]):
+                if text is not None:
+                    with open(target + ext, "w") as f:
+                        f.write(text)
+            try:
+                os.link(path, target + ".tmp")
+            except OSError:
+                shutil.copy(path, target + ".tmp")
+            # the age counts from now
+            os.utime(target + ".tmp", None)
+            os.rename(target + ".tmp", target)
+        _logger.info("Cached %s (%d bytes)" %
+                     (name, os.path.getsize(target)))
+        self.evict()
+
+    def _remove(self, name):
+        path = self._path(name)
+        for ext in [""] + SIGNATURES:
+            if os.path.exists(path + ext):
+                os.remove(path + ext)
+
+    def _entries(self):
+        """
+        [(mtime, size, name)] of the artifacts, the oldest first.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp") or \
+                    os.path.splitext(name)[1] in SIGNATURES:
+                continue
+            st = os.stat(os.path.join(self.directory, name))
+            entries.append((st.st_mtime, st.st_size, name))
+        return sorted(entries)
+
+    def evict(self, now=None):
+        """
+        Remove the expired artifacts, then the oldest ones until the total
+        size fits in max_bytes.
+
+        Returns:
+            names of the removed artifacts.
+        """
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, name in entries:
+                if now - mtime < self.max_age and total <= self.max_bytes:
+                    continue
+                self._remove(name)
+                total -= size
+                removed.append(name)
+        for name in removed:
+            _logger.info("Evicted %s from the cache." % name)
+        return removed
+
+    def get(self, name):
+        """
+        Path of the artifact or its signature, None if not cached or
+        expired.
+        """
+        try:
+            path = self._path(name)
+            base = self._path(os.path.splitext(name)[0]
+                              if os.path.splitext(name)[1] in SIGNATURES
+                              else name)
+        except ValueError:
+            return None
+        if not os.path.isfile(path) or not os.path.isfile(base):
+            return None
+        if time.time() - os.path.getmtime(base) >= self.max_age:
+            return None
+        return path
+
+    def stats(self):
+        entries = self._entries()
+        return {"artifacts": len(entries),
+                "bytes": sum(size for _, size, _ in entries)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        _logger.debug("%s %s" % (self.client_address[0], format % args))
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve()
+
+    def _serve(self, head=False):
+        server = self.server.peer
+        path = server.cache.get(self.path.lstrip("/").split("?", 1)[0])
+        if path is None:
+            server.count("misses")
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start = 0
+        found = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if found:
+            start = int(found.group(1))
+            if start >= size:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" %
+                             (start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.end_headers()
+        server.count("hits")
+        if head:
+            return
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                # only the bytes sent, the client may be gone
+                server.count("bytesServed", len(chunk))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PeerServer(object):
+    """
+    Serve the artifacts of the cache over HTTP, at
+    "http://<host>:<port>/<name>".
+
+    Attributes:
+        cache: ArtifactCache.
+        port: port listened, a free one is picked if 0.
+    """
+    def __init__(self, cache, host="0.0.0.0", port=0):
+        self.cache = cache
+        self._stats = {"hits": 0, "misses": 0, "bytesServed": 0}
+        self._lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.peer = self
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(self.cache.stats())
+        stats["port"] = self.port
+        return stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        name="thread-firmware-peer")
+        self._thread.daemon = True
+        self._thread.start()
+        _logger.info("Serving the cached artifacts on port %d" % self.port)
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+The product families and how each of them is upgraded. The product is
+detected from kversion once, then its strategy is looked up here, so a new
+model of a known family is one more name in its models.
+"""
+
+
+class Strategy(object):
+    """
+    Attributes:
+        family: name of the upgrade function of the upgrade script, e.g.
+            "uc8100".
+        models: products of the family as reported by kversion without
+            "-LX", e.g. "UC-8112".
+        package: the firmware package upgraded by apt, None if upgraded by
+            an image.
+        image: how the image is brought to the installer by default, "disk"
+            or "pipe", None if upgraded by a package.
+    """
+    def __init__(self, family, models, package=None, image=None):
+        self.family = family
+        self.models = list(models)
+        self.package = package
+        self.image = image
+
+    def env(self):
+        """
+        Environment of the upgrade script, the product is not detected
+        again by the script.
+        """
+        return {"FAMILY": self.family, "PACKAGE": self.package or ""}
+
+    def to_dict(self):
+        return {"family": self.family, "package": self.package,
+                "image": self.image}
+
+
+_strategies = []
+
+
+def register(strategy):
+    """
+    Add the strategy of a family, the one registered last wins if a model
+    is in several families.
+    """
+    _strategies.insert(0, strategy)
+    return strategy
+
+
+def unregister(family):
+    _strategies[:] = [s for s in _strategies if s.family != family]
+
+
+def lookup(family):
+    """
+    Strategy of the family, None if unknown.
+    """
+    for strategy in _strategies:
+        if family == strategy.family:
+            return strategy
+    return None
+
+
+def resolve(model):
+    """
+    Strategy of the product model, None if unknown.
+    """
+    for strategy in _strategies:
+        if model in strategy.models:
+            return strategy
+    return None
+
+
+def parse_model(output):
+    """
+    Product model of the kversion output, e.g. "UC-8112" of
+    "UC-8112-LX version 1.0 Build 15102318".
+    """
+    fields = output.split()
+    if not fields:
+        raise ValueError("Cannot parse the product: %r" % output)
+    return fields[0].replace("-LX", "")
+
+
+register(Strategy("da820", ["DA-820"], package="mxcloud-cs"))
+register(Strategy("uc8100", ["UC-8100", "UC-8112", "UC-8131", "UC-8132",
+                             "UC-8162"], package="mxcloud-cg"))
+register(Strategy("mar2000", ["MAR-2000", "MAR-2001", "MAR-2002"],
+                  image="disk"))
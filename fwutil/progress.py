@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import re
+import time
+from collections import deque
+
+PREPARING = "preparing"
+DOWNLOADING = "downloading"
+INSTALLING = "installing"
+CONFIGURING = "configuring"
+DONE = "done"
+
+# percent range of each phase
+_PHASE_RANGE = {
+    PREPARING: (0, 5),
+    DOWNLOADING: (5, 50),
+    INSTALLING: (50, 85),
+    CONFIGURING: (85, 99),
+    DONE: (100, 100)
+}
+
+_TOTAL_RE = re.compile(r"^(\d+) upgraded, (\d+) newly installed")
+_GET_RE = re.compile(r"^Get:\s*\d+")
+_UNPACK_RE = re.compile(r"^(Preparing to unpack|Unpacking) ")
+_SETUP_RE = re.compile(r"^Setting up ")
+_PERCENT_RE = re.compile(r"(\d{1,3})(?:\.\d+)?\s*%")
+
+
+class ProgressParser(object):
+    """
+    Turn the output of upgrade.sh (apt-get, dpkg and upgradehfm) into a
+    phase and a percent complete. Only the last lines are kept so memory
+    does not grow with the output.
+
+    Attributes:
+        phase: preparing, downloading, installing, configuring or done.
+        percent: 0 - 100.
+        tail: the last lines of output.
+    """
+    def __init__(self, tail=20):
+        self.phase = PREPARING
+        self.percent = 0
+        self.tail = deque(maxlen=tail)
+        self._total = 1
+        self._count = 0
+
+    def _enter(self, phase):
+        if phase != self.phase:
+            self.phase = phase
+            self._count = 0
+
+    def _update(self, fraction):
+        low, high = _PHASE_RANGE[self.phase]
+        percent = low + int((high - low) * min(1.0, fraction))
+        self.percent = max(self.percent, percent)
+
+    def feed(self, line):
+        """
+        Parse one line, returns True if phase or percent is changed.
+        """
+        line = line.strip()
+        if not line:
+            return False
+        self.tail.append(line)
+        phase, percent = self.phase, self.percent
+
+        total = _TOTAL_RE.match(line)
+        if total:
+            self._total = max(1, int(total.group(1)) + int(total.group(2)))
+        elif _GET_RE.match(line):
+            self._enter(DOWNLOADING)
+            self._count += 1
+            self._update(float(self._count) / self._total)
+        elif _UNPACK_RE.match(line):
+            self._enter(INSTALLING)
+            if line.startswith("Unpacking"):
+                self._count += 1
+            self._update(float(self._count) / self._total)
+        elif _SETUP_RE.match(line):
+            self._enter(CONFIGURING)
+            self._count += 1
+            self._update(float(self._count) / self._total)
+        elif line.startswith("(Reading database"):
+            self._enter(INSTALLING)
+        else:
+            # e.g. upgradehfm
+            found = _PERCENT_RE.search(line)
+            if found:
+                if self.phase in [PREPARING, DOWNLOADING]:
+                    self._enter(INSTALLING)
+                self._update(int(found.group(1)) / 100.0)
+
+        return phase != self.phase or percent != self.percent
+
+    def finish(self):
+        self._enter(DONE)
+        self.percent = 100
+
+
+class Throttle(object):
+    """
+    Allow an action at most once per interval (seconds).
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = None
+
+    def ready(self, force=False):
+        now = time.time()
+        if not force and self._last is not None and \
+                now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
+
+
+class ProgressReporter(object):
+    """
+    Feed output lines and report callback(phase, percent) on progress,
+    phase changes are always reported, percent changes at most once per
+    interval.
+    """
+    def __init__(self, callback, interval=2):
+        self.callback = callback
+        self.parser = ProgressParser()
+        self.throttle = Throttle(interval)
+
+    def feed(self, line):
+        phase = self.parser.phase
+        if not self.parser.feed(line):
+            return
+        if self.throttle.ready(force=(phase != self.parser.phase)):
+            self.callback(self.parser.phase, self.parser.percent)
+
+    def finish(self):
+        self.parser.finish()
+        self.throttle.ready(force=True)
+        self.callback(self.parser.phase, self.parser.percent)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from threading import Event
+from threading import Lock
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls: while a call is running, later callers wait
+    for it and share its result (or exception) instead of running again.
+
+    Attributes:
+        calls: number of calls requested.
+        executions: number of calls actually executed.
+        coalesced: number of calls answered by a running one.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._call = None
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, func, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self._call
+            leader = call is None
+            if leader:
+                call = self._call = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                self._call = None
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced
+            }
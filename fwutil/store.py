@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import json
+import logging
+import os
+import shutil
+from threading import Lock
+from threading import Timer
+
+_logger = logging.getLogger("sanji.firmware.store")
+
+
+class ModelStore(object):
+    """
+    Persist the db of a ModelInitiator with fewer writes: changes saved
+    close together are written once after a short delay, and each write
+    goes to a temporary file which is synced and renamed over the db. The
+    previous db is kept as the backup by a hard link instead of a copy.
+
+    Attributes:
+        model: the ModelInitiator.
+        delay: seconds to wait for more changes before writing.
+        critical: keys whose changes are written immediately.
+    """
+    def __init__(self, model, delay=2, critical=None):
+        self.model = model
+        self.delay = delay
+        self.critical = list(critical or [])
+        self.requests = 0
+        self.writes = 0
+        self.immediate = 0
+        self.bytes = 0
+        self._lock = Lock()
+        self._timer = None
+        self._dirty = False
+        self._written = self._critical_values()
+
+    def _critical_values(self):
+        db = self.model.db if isinstance(self.model.db, dict) else {}
+        return dict((key, db.get(key, None)) for key in self.critical)
+
+    def stats(self):
+        """
+        Counters of the save requests and the actual writes.
+        """
+        return {"requests": self.requests, "writes": self.writes,
+                "immediate": self.immediate,
+                "coalesced": self.requests - self.writes,
+                "bytes": self.bytes}
+
+    def save(self, flush=False):
+        """
+        Request to save the db, it is written now if flush is set or any
+        critical key is changed, otherwise later with other changes.
+        """
+        with self._lock:
+            self.requests += 1
+            self._dirty = True
+            if flush or self._critical_values() != self._written:
+                self.immediate += 1
+                self._flush()
+                return
+            if self._timer is None:
+                self._timer = Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write the pending changes now.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        with self.model.db_mutex:
+            # copied at once, the jobs may add or remove keys meanwhile
+            data = json.dumps(dict(self.model.db), indent=4)
+            self._written = self._critical_values()
+        self._dirty = False
+        self._write(data)
+
+    def _write(self, data):
+        path = self.model.json_db_path
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # the current db becomes the backup, no data is copied
+        backup = self.model.backup_json_db_path
+        if os.path.exists(path):
+            try:
+                if os.path.exists(backup):
+                    os.remove(backup)
+                os.link(path, backup)
+            except OSError:
+                shutil.copy2(path, backup)
+        os.rename(tmp, path)
+        self.writes += 1
+        self.bytes += len(data)
+        _logger.debug("Saved %s (%d bytes)" % (path, len(data)))
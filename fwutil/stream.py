@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Move data in fixed-size chunks, so the memory used for an artifact is
+bounded by the chunk size whatever the artifact size is.
+"""
+
+CHUNK_SIZE = 64 * 1024
+# hard ceiling of the memory used by one stream
+MAX_CHUNK_SIZE = 1024 * 1024
+
+
+def _check_chunk_size(chunk_size):
+    if chunk_size <= 0 or chunk_size > MAX_CHUNK_SIZE:
+        raise ValueError("Chunk size should be 1 - %d bytes." %
+                         MAX_CHUNK_SIZE)
+
+
+def iter_chunks(src, chunk_size=CHUNK_SIZE, digests=None):
+    """
+    Yield chunks read from a file object, each chunk also updates the
+    given hashlib objects.
+    """
+    _check_chunk_size(chunk_size)
+    digests = digests or []
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return
+        for digest in digests:
+            digest.update(chunk)
+        yield chunk
+
+
+def copy_stream(src, dst, chunk_size=CHUNK_SIZE, digests=None,
+                cancelled=None):
+    """
+    Copy src to dst (file objects) chunk by chunk.
+
+    Args:
+        cancelled: threading.Event, the copy stops with IOError once set.
+
+    Returns:
+        bytes copied.
+    """
+    size = 0
+    for chunk in iter_chunks(src, chunk_size, digests):
+        if cancelled is not None and cancelled.is_set():
+            raise IOError("Cancelled.")
+        dst.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def hash_stream(src, chunk_size=CHUNK_SIZE, digests=None):
+    """
+    Read src to the end only to update the digests.
+    """
+    size = 0
+    for chunk in iter_chunks(src, chunk_size, digests):
+        size += len(chunk)
+    return size
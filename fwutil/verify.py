@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Verify artifacts from the SHA-256 digest computed while they are streamed,
+so verification does not read the artifact again.
+
+    - checksum: sha256sum format, "<hex digest>  <file name>"
+    - signature: base64 of the RSA (PKCS#1 v1.5) SHA-256 signature, e.g.
+      "openssl dgst -sha256 -sign key.pem <file> | base64"
+"""
+
+import base64
+import binascii
+import hashlib
+import re
+
+from fwutil.stream import CHUNK_SIZE
+from fwutil.stream import hash_stream
+
+# DER of DigestInfo for SHA-256, followed by the digest
+_SHA256_PREFIX = binascii.unhexlify("3031300d060960864801650304020105000420")
+_PEM_RE = re.compile(r"-----BEGIN ([A-Z ]+)-----(.+?)-----END \1-----",
+                     re.DOTALL)
+
+
+def _bytes_to_int(data):
+    return int(binascii.hexlify(data), 16) if data else 0
+
+
+def _der_read(data, offset):
+    """
+    Read a DER TLV, returns (tag, value, next offset).
+    """
+    tag = ord(data[offset:offset + 1])
+    length = ord(data[offset + 1:offset + 2])
+    offset += 2
+    if length & 0x80:
+        num = length & 0x7f
+        length = _bytes_to_int(data[offset:offset + num])
+        offset += num
+    return tag, data[offset:offset + length], offset + length
+
+
+def load_public_key(path):
+    """
+    Load a RSA public key in PEM ("PUBLIC KEY" or "RSA PUBLIC KEY").
+
+    Returns:
+        (modulus, exponent)
+    """
+    with open(path) as f:
+        found = _PEM_RE.search(f.read())
+    if found is None:
+        raise ValueError("Invalid PEM file: %s" % path)
+    der = base64.b64decode("".join(found.group(2).split()))
+
+    tag, body, _ = _der_read(der, 0)
+    if "PUBLIC KEY" == found.group(1):
+        # SubjectPublicKeyInfo: skip the algorithm, unwrap the bit string
+        _, _, offset = _der_read(body, 0)
+        _, bits, _ = _der_read(body, offset)
+        tag, body, _ = _der_read(bits[1:], 0)
+
+    _, modulus, offset = _der_read(body, 0)
+    _, exponent, _ = _der_read(body, offset)
+    return (_bytes_to_int(modulus), _bytes_to_int(exponent))
+
+
+def verify_signature(digest, signature, public_key):
+    """
+    Check the RSA PKCS#1 v1.5 signature of a SHA-256 digest (raw bytes).
+    """
+    modulus, exponent = public_key
+    size = (modulus.bit_length() + 7) // 8
+    if len(signature) != size:
+        return False
+
+    decrypted = pow(_bytes_to_int(signature), exponent, modulus)
+    expected = _SHA256_PREFIX + digest
+    padding = size - len(expected) - 3
+    if padding < 8:
+        return False
+    encoded = binascii.unhexlify(
+        "0001" + "ff" * padding + "00" + binascii.hexlify(expected).decode())
+    return decrypted == _bytes_to_int(encoded)
+
+
+def verify_digest(digest, checksum=None, signature=None, public_key=None):
+    """
+    Verify a finished hashlib.sha256 object.
+
+    Args:
+        checksum: content of the checksum file, None if not published.
+        signature: content of the signature file, None if not published.
+        public_key: (modulus, exponent), None to skip the signature.
+
+    Returns:
+        {"sha256": hex digest, "checksum": True/None,
+         "signature": True/None, "verified": True/False}
+        None means it cannot be checked (not published or no key),
+        verified is True if the checksum or the signature is checked.
+
+    Raises:
+        IOError: checksum or signature mismatched.
+    """
+    result = {"sha256": digest.hexdigest(), "checksum": None,
+              "signature": None, "verified": False}
+
+    if checksum is not None:
+        if checksum.split()[0].lower() != result["sha256"]:
+            raise IOError("Checksum mismatched.")
+        result["checksum"] = True
+
+    if public_key is not None:
+        if signature is None:
+            raise IOError("Signature is missing.")
+        try:
+            raw = base64.b64decode("".join(signature.split()))
+        except (TypeError, ValueError, binascii.Error):
+            raw = b""
+        if not verify_signature(digest.digest(), raw, public_key):
+            raise IOError("Signature mismatched.")
+        result["signature"] = True
+
+    result["verified"] = result["checksum"] is True or \
+        result["signature"] is True
+    return result
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """
+    SHA-256 of a file already on disk (e.g. uploaded), read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        hash_stream(f, chunk_size, [digest])
+    return digest
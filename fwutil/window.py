@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Plan the start time of an upgrade inside a rollout window, so a fleet
+told to upgrade at once spreads over the window instead.
+
+A window is a dict, all fields are optional:
+    start: epoch seconds the window opens, now if not given.
+    end: epoch seconds the window closes.
+    maxDelay: seconds after start the upgrade may be delayed.
+    slot: "random" (default) or "hash", the delay is derived from the
+        device id, the same device always gets the same slot.
+"""
+
+import hashlib
+import random
+import time
+import uuid
+
+SLOTS = ["random", "hash"]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_window(window):
+    """
+    Raises:
+        ValueError: the window is invalid.
+    """
+    if not isinstance(window, dict):
+        raise ValueError("Window should be an object.")
+    unknown = set(window) - set(["start", "end", "maxDelay", "slot"])
+    if unknown:
+        raise ValueError("Unknown fields: %s" % ", ".join(sorted(unknown)))
+    for key in ["start", "end", "maxDelay"]:
+        if key in window and \
+                (not _is_number(window[key]) or window[key] < 0):
+            raise ValueError("%s should be a non-negative number." % key)
+    if "start" in window and "end" in window and \
+            window["end"] <= window["start"]:
+        raise ValueError("end should be later than start.")
+    if window.get("slot", "random") not in SLOTS:
+        raise ValueError("slot should be one of %s." % ", ".join(SLOTS))
+
+
+def device_id():
+    """
+    MAC address of the device, the seed of the "hash" slot.
+    """
+    return "%012x" % uuid.getnode()
+
+
+def plan_window(window, now=None, device=None):
+    """
+    The time to start the upgrade inside the window.
+
+    Args:
+        now: current epoch seconds.
+        device: device id for the "hash" slot, see device_id().
+
+    Returns:
+        epoch seconds.
+    """
+    now = time.time() if now is None else now
+    start = max(window.get("start", now), now)
+    spans = []
+    if "end" in window:
+        spans.append(window["end"] - start)
+    if "maxDelay" in window:
+        spans.append(window["maxDelay"])
+    span = max(0, min(spans)) if spans else 0
+
+    if "hash" == window.get("slot", "random"):
+        seed = hashlib.sha256(device or device_id()).hexdigest()
+        delay = span * (int(seed[:8], 16) / float(0xffffffff))
+    else:
+        delay = random.uniform(0, span)
+    return int(start + delay)
+
+
+def window_expired(window, now=None):
+    """
+    The window is closed.
+    """
+    now = time.time() if now is None else now
+    return "end" in window and now >= window["end"]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+A local HTTP server serving files from a directory with Range and
+conditional requests (ETag/Last-Modified) support, used as the stand-in
+of the firmware repository in tests.
+"""
+
+import os
+import re
+import hashlib
+import threading
+
+from email.utils import formatdate
+from email.utils import parsedate_tz
+from email.utils import mktime_tz
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        path = os.path.join(self.server.root, self.path.lstrip("/"))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        with open(path, "rb") as f:
+            data = f.read()
+        mtime = int(os.path.getmtime(path))
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        since = parsedate_tz(self.headers.get("If-Modified-Since", ""))
+        if self.headers.get("If-None-Match"):
+            # If-Modified-Since is ignored as RFC 7232
+            not_modified = etag == self.headers.get("If-None-Match")
+        else:
+            not_modified = since and mktime_tz(since) >= mtime
+        if not_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        found = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if found and self.server.ranges:
+            start = int(found.group(1))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" %
+                             (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LocalServer(object):
+    """
+    Attributes:
+        root: directory to serve.
+        url: base url of the server.
+        requests: (path, headers) of requests received.
+    """
+    def __init__(self, root, ranges=True):
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.root = root
+        self.httpd.ranges = ranges
+        self.httpd.requests = []
+        self.url = "http://127.0.0.1:%d" % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
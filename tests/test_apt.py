@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import shutil
+import logging
+import unittest
+
+from StringIO import StringIO
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.apt import iter_stanzas
+    from fwutil.apt import PackageIndex
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+status_path = "%s/mockdata/dpkg/status" % dirpath
+lists_dir = "%s/mockdata/apt/lists" % dirpath
+
+
+class TestIterStanzas(unittest.TestCase):
+
+    def test__iter_stanzas(self):
+        """
+        iter_stanzas: keep the given fields only
+        """
+        fp = StringIO("Package: a\nVersion: 1.0\nDescription: A\n"
+                      " Version: 9.9\n\n\n"
+                      "Package: b\nVersion: 2.0\n")
+        self.assertEqual([{"Package": "a", "Version": "1.0"},
+                          {"Package": "b", "Version": "2.0"}],
+                         list(iter_stanzas(fp, ["Package", "Version"])))
+
+    def test__iter_stanzas__empty(self):
+        """
+        iter_stanzas: empty file
+        """
+        self.assertEqual([], list(iter_stanzas(StringIO(""), ["Package"])))
+
+
+class TestPackageIndexClass(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PackageIndex(status_path, lists_dir)
+
+    def tearDown(self):
+        shutil.rmtree("%s/data/apt" % dirpath, ignore_errors=True)
+
+    def test__installed_version(self):
+        """
+        installed_version: installed packages only
+        """
+        self.assertEqual("1.0.0", self.index.installed_version("mxcloud-cg"))
+        self.assertEqual("7.1wheezy8",
+                         self.index.installed_version("base-files"))
+        self.assertIsNone(self.index.installed_version("mxcloud-cs"))
+        self.assertIsNone(self.index.installed_version("unknown"))
+
+    def test__candidate_version(self):
+        """
+        candidate_version: highest version of all lists
+        """
+        self.assertEqual("1.1.0", self.index.candidate_version("mxcloud-cg"))
+        self.assertEqual("1.0.0", self.index.candidate_version("mxcloud-cs"))
+        self.assertIsNone(self.index.candidate_version("unknown"))
+
+    def test__candidate_version__installed_only(self):
+        """
+        candidate_version: installed version if not in the lists
+        """
+        self.assertEqual("7.1wheezy8",
+                         self.index.candidate_version("base-files"))
+
+    def test__policy(self):
+        """
+        policy: (none) for unknown versions
+        """
+        self.assertEqual(("1.0.0", "1.1.0"),
+                         self.index.policy("mxcloud-cg"))
+        self.assertEqual(("(none)", "1.0.0"),
+                         self.index.policy("mxcloud-cs"))
+        self.assertEqual(("(none)", "(none)"), self.index.policy("unknown"))
+
+    def test__packages(self):
+        """
+        packages: only index the given packages
+        """
+        index = PackageIndex(status_path, lists_dir, packages=["mxcloud-cg"])
+        self.assertEqual(("1.0.0", "1.1.0"), index.policy("mxcloud-cg"))
+        self.assertEqual(("(none)", "(none)"), index.policy("mxcloud-cs"))
+
+    def test__no_files(self):
+        """
+        refresh: status file and lists are not found
+        """
+        index = PackageIndex("%s/mock/status" % dirpath,
+                             "%s/mock/lists" % dirpath)
+        self.assertEqual(("(none)", "(none)"), index.policy("mxcloud-cg"))
+
+    def test__lists_dirs(self):
+        """
+        policy: the highest version of the lists in all directories
+        """
+        os.makedirs("%s/data/lists" % dirpath)
+        self.addCleanup(shutil.rmtree, "%s/data/lists" % dirpath)
+        with open("%s/data/lists/repo_Packages" % dirpath, "w") as f:
+            f.write("Package: mxcloud-cg\nVersion: 1.2.0\n")
+        index = PackageIndex(status_path, ["%s/data/lists" % dirpath,
+                                           lists_dir])
+        self.assertEqual(("1.0.0", "1.2.0"), index.policy("mxcloud-cg"))
+
+    def test__refresh__cached(self):
+        """
+        refresh: do not parse again if the files are not changed
+        """
+        self.index.policy("mxcloud-cg")
+        self.index.policy("mxcloud-cg")
+        self.assertEqual(2, self.index.loads)
+
+    def test__refresh__changed(self):
+        """
+        refresh: parse again if the files are changed
+        """
+        shutil.copytree("%s/mockdata/apt" % dirpath, "%s/data/apt" % dirpath)
+        index = PackageIndex(status_path, "%s/data/apt/lists" % dirpath)
+        self.assertEqual("1.1.0", index.candidate_version("mxcloud-cg"))
+        self.assertEqual(2, index.loads)
+
+        with open("%s/data/apt/lists/new_Packages" % dirpath, "w") as f:
+            f.write("Package: mxcloud-cg\nVersion: 1.2.0\n")
+        self.assertEqual("1.2.0", index.candidate_version("mxcloud-cg"))
+        self.assertEqual(3, index.loads)
+
+        os.remove("%s/data/apt/lists/new_Packages" % dirpath)
+        self.assertEqual("1.1.0", index.candidate_version("mxcloud-cg"))
+        self.assertEqual(4, index.loads)
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("PackageIndex Test")
+    unittest.main()
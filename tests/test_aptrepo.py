@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import logging
+import unittest
+
+from StringIO import StringIO
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+    from fwutil.aptrepo import parse_sources
+    from fwutil.aptrepo import list_name
+    from fwutil.aptrepo import parse_release
+    from fwutil.aptrepo import RepoIndex
+    from httpd import LocalServer
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+repo_dir = "%s/data/aptrepo" % dirpath
+lists_dir = "%s/data/lists" % dirpath
+sources_path = "%s/data/mxcloud.list" % dirpath
+
+PACKAGES = "Package: mxcloud-cg\nVersion: 1.1.0\nArchitecture: armhf\n"
+
+
+def publish(packages, suite="stable", gz=False, corrupted=False):
+    """
+    Publish Packages and Release of the suite to the repository.
+    """
+    base = "%s/dists/%s" % (repo_dir, suite)
+    if not os.path.isdir(base + "/main/binary-armhf"):
+        os.makedirs(base + "/main/binary-armhf")
+    path = "main/binary-armhf/Packages"
+    data = packages
+    if gz:
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(packages)
+        data = buf.getvalue()
+        path += ".gz"
+    with open("%s/%s" % (base, path), "wb") as f:
+        f.write(data)
+    digest = hashlib.sha256(b"corrupted" if corrupted else data).hexdigest()
+    with open("%s/Release" % base, "w") as f:
+        f.write("Suite: %s\nSHA256:\n %s %d %s\n" %
+                (suite, digest, len(data), path))
+
+
+class TestParse(unittest.TestCase):
+
+    def test__parse_sources(self):
+        """
+        parse_sources: deb lines with options and comments
+        """
+        fp = StringIO(
+            "# comment\n"
+            "deb [arch=armhf trusted=yes] http://repo/debian stable main\n"
+            "deb-src http://repo/debian stable main\n"
+            "deb http://repo/flat ./ # flat\n"
+            "\n")
+        self.assertEqual([("http://repo/debian", "stable", ["main"]),
+                          ("http://repo/flat", "./", [])],
+                         list(parse_sources(fp)))
+
+    def test__list_name(self):
+        """
+        list_name: same as the apt lists
+        """
+        self.assertEqual(
+            "192.168.31.81_debian_repo_dists_testing_main_binary-armhf_"
+            "Packages",
+            list_name("http://192.168.31.81/debian_repo/dists/testing/main/"
+                      "binary-armhf/Packages"))
+        self.assertEqual("repo_dists_stable_Release",
+                         list_name("https://user:pw@repo/dists/stable/"
+                                   "Release"))
+
+    def test__parse_release(self):
+        """
+        parse_release: SHA256 section only
+        """
+        release = ("Suite: stable\n"
+                   "MD5Sum:\n"
+                   " 0123 10 main/binary-armhf/Packages\n"
+                   "SHA256:\n"
+                   " abcd 10 main/binary-armhf/Packages\n"
+                   " ef01 5 main/binary-armhf/Packages.gz\n")
+        self.assertEqual({"main/binary-armhf/Packages": "abcd",
+                          "main/binary-armhf/Packages.gz": "ef01"},
+                         parse_release(release))
+
+
+class TestRepoIndex(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(repo_dir)
+        self.server = LocalServer(repo_dir).start()
+        with open(sources_path, "w") as f:
+            f.write("deb %s stable main\n" % self.server.url)
+        self.index = RepoIndex(sources_path, lists_dir, "armhf")
+        self.name = list_name("%s/dists/stable/main/binary-armhf/Packages" %
+                              self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(repo_dir, ignore_errors=True)
+        shutil.rmtree(lists_dir, ignore_errors=True)
+        os.remove(sources_path)
+
+    def read_list(self):
+        with open("%s/%s" % (lists_dir, self.name)) as f:
+            return f.read()
+
+    def test__refresh(self):
+        """
+        refresh: fetch Release and Packages
+        """
+        publish(PACKAGES)
+        stats = self.index.refresh()
+        self.assertEqual(2, stats["requests"])
+        self.assertEqual(0, stats["notModified"])
+        self.assertEqual(1, stats["updated"])
+        self.assertTrue(stats["bytes"] > len(PACKAGES))
+        self.assertTrue(stats["seconds"] >= 0)
+        self.assertEqual(stats, self.index.stats)
+        self.assertEqual(PACKAGES, self.read_list())
+
+    def test__refresh__not_modified(self):
+        """
+        refresh: only Release is requested if the repository is not changed
+        """
+        publish(PACKAGES)
+        self.index.refresh()
+        stats = self.index.refresh()
+        self.assertEqual({"requests": 1, "notModified": 1, "bytes": 0,
+                          "updated": 0}, dict((key, stats[key]) for key in
+                                              ["requests", "notModified",
+                                               "bytes", "updated"]))
+        self.assertIn("if-none-match", self.server.requests[-1][1])
+        self.assertEqual(PACKAGES, self.read_list())
+
+    def test__refresh__validators_persisted(self):
+        """
+        refresh: the validators are kept across instances
+        """
+        publish(PACKAGES)
+        self.index.refresh()
+        index = RepoIndex(sources_path, lists_dir, "armhf")
+        self.assertEqual(1, index.refresh()["notModified"])
+
+    def test__refresh__changed(self):
+        """
+        refresh: fetch the changed Packages
+        """
+        publish(PACKAGES)
+        self.index.refresh()
+        packages = PACKAGES.replace("1.1.0", "1.2.0-1")
+        publish(packages)
+        stats = self.index.refresh()
+        self.assertEqual(1, stats["updated"])
+        self.assertEqual(packages, self.read_list())
+
+    def test__refresh__missing_list(self):
+        """
+        refresh: fetch the Packages removed locally
+        """
+        publish(PACKAGES)
+        self.index.refresh()
+        os.remove("%s/%s" % (lists_dir, self.name))
+        stats = self.index.refresh()
+        self.assertEqual(1, stats["notModified"])
+        self.assertEqual(1, stats["updated"])
+        self.assertEqual(PACKAGES, self.read_list())
+
+    def test__refresh__gz(self):
+        """
+        refresh: fetch Packages.gz if Packages is not published
+        """
+        publish(PACKAGES, gz=True)
+        stats = self.index.refresh()
+        self.assertEqual(3, stats["requests"])
+        self.assertEqual(PACKAGES, self.read_list())
+
+    def test__refresh__hash_mismatch(self):
+        """
+        refresh: Packages does not match Release
+        """
+        publish(PACKAGES, corrupted=True)
+        with self.assertRaises(IOError):
+            self.index.refresh()
+        self.assertFalse(os.path.exists("%s/%s" % (lists_dir, self.name)))
+        self.assertEqual(2, self.index.stats["requests"])
+
+    def test__refresh__after_failure(self):
+        """
+        refresh: the files of a failed refresh are fetched again
+        """
+        publish(PACKAGES)
+        self.index.refresh()
+        packages = PACKAGES.replace("1.1.0", "1.2.0-1")
+        publish(packages, corrupted=True)
+        with self.assertRaises(IOError):
+            self.index.refresh()
+        self.assertEqual(PACKAGES, self.read_list())
+
+        # same Packages, only Release is fixed
+        publish(packages)
+        stats = self.index.refresh()
+        self.assertEqual(0, stats["notModified"])
+        self.assertEqual(1, stats["updated"])
+        self.assertEqual(packages, self.read_list())
+        self.assertEqual(1, self.index.refresh()["notModified"])
+
+    def test__refresh__flat(self):
+        """
+        refresh: flat repository
+        """
+        with open("%s/Packages" % repo_dir, "w") as f:
+            f.write(PACKAGES)
+        with open("%s/Release" % repo_dir, "w") as f:
+            f.write("Origin: moxa\n")
+        with open(sources_path, "w") as f:
+            f.write("deb %s ./\n" % self.server.url)
+        self.index.refresh()
+        with open("%s/%s" % (lists_dir, list_name(
+                self.server.url + "/./Packages"))) as f:
+            self.assertEqual(PACKAGES, f.read())
+
+    def test__refresh__not_found(self):
+        """
+        refresh: the repository is not found
+        """
+        with self.assertRaises(Exception):
+            self.index.refresh()
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("AptRepo Test")
+    unittest.main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import time
+import logging
+import unittest
+from threading import Event
+from threading import Thread
+
+from mock import MagicMock
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.cache import CheckCache
+    from fwutil.singleflight import SingleFlight
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestCheckCacheClass(unittest.TestCase):
+
+    def setUp(self):
+        self.loader = MagicMock(return_value={"isLatest": 1})
+        self.cache = CheckCache(self.loader, ttl=60)
+
+    def tearDown(self):
+        self.cache.stop()
+        self.cache = None
+
+    def test__age__empty(self):
+        """
+        age: nothing cached yet
+        """
+        self.assertIsNone(self.cache.age())
+        self.assertFalse(self.cache.is_fresh())
+
+    def test__get(self):
+        """
+        get: load once and answer from memory afterwards
+        """
+        self.assertEqual({"isLatest": 1, "age": 0}, self.cache.get())
+        self.assertEqual({"isLatest": 1, "age": 0}, self.cache.get())
+        self.assertEqual(1, self.loader.call_count)
+
+    def test__get__force(self):
+        """
+        get: force to load again
+        """
+        self.cache.get()
+        self.cache.get(force=True)
+        self.assertEqual(2, self.loader.call_count)
+
+    def test__get__expired(self):
+        """
+        get: answer the expired result and load again in background
+        """
+        self.cache.get()
+        self.cache._timestamp -= 61
+        self.loader.return_value = {"isLatest": 0}
+        self.assertEqual({"isLatest": 1, "age": 61}, self.cache.get())
+        self.cache._background.join(1)
+        self.assertEqual(2, self.loader.call_count)
+        self.assertEqual({"isLatest": 0, "age": 0}, self.cache.get())
+
+    def test__get__expired_once(self):
+        """
+        get: one background refresh at a time
+        """
+        calls = []
+        release = Event()
+
+        def loader():
+            calls.append(1)
+            release.wait(1)
+            return {"isLatest": 1}
+        self.cache.get()
+        self.cache.loader = loader
+        self.cache._timestamp -= 61
+        for _ in range(3):
+            self.assertEqual(1, self.cache.get()["isLatest"])
+        release.set()
+        self.cache._background.join(1)
+        self.assertEqual(1, len(calls))
+        self.assertTrue(self.cache.is_fresh())
+
+    def test__get__age(self):
+        """
+        get: report how old the result is
+        """
+        self.cache.get()
+        self.cache._timestamp -= 10
+        self.assertEqual(10, self.cache.get()["age"])
+
+    def test__get__copy(self):
+        """
+        get: modifying the returned result does not touch the cache
+        """
+        self.cache.get()["isLatest"] = 0
+        self.assertEqual(1, self.cache.get()["isLatest"])
+
+    def test__refresh__failed(self):
+        """
+        refresh: keep the old result if loading failed
+        """
+        self.cache.get()
+        self.loader.side_effect = Exception("error")
+        with self.assertRaises(Exception):
+            self.cache.refresh()
+        self.assertEqual(1, self.cache.get()["isLatest"])
+
+    def test__set_policy(self):
+        """
+        set_policy: update ttl and interval
+        """
+        self.cache.set_policy(ttl=10, interval=20)
+        self.assertEqual(10, self.cache.ttl)
+        self.assertEqual(20, self.cache.interval)
+
+    def test__start__refresh_in_background(self):
+        """
+        start: refresh the result periodically
+        """
+        self.cache.interval = 0.05
+        self.cache.start()
+        time.sleep(0.3)
+        self.cache.stop()
+        self.assertGreaterEqual(self.loader.call_count, 2)
+
+    def test__start__disabled(self):
+        """
+        start: interval 0 disables the background refresh
+        """
+        self.cache.interval = 0
+        self.cache.start()
+        time.sleep(0.1)
+        self.cache.stop()
+        self.assertEqual(0, self.loader.call_count)
+
+    def test__start__loader_failed(self):
+        """
+        start: keep refreshing even if loading failed
+        """
+        self.loader.side_effect = Exception("error")
+        self.cache.interval = 0.05
+        self.cache.backoff_min = 0.05
+        self.cache.start()
+        time.sleep(0.3)
+        self.cache.stop()
+        self.assertGreaterEqual(self.loader.call_count, 2)
+
+    def test__set_policy__schedule(self):
+        """
+        set_policy: update jitter and backoff
+        """
+        self.cache.set_policy(jitter=30, backoff_min=10, backoff_max=40)
+        self.assertEqual(30, self.cache.jitter)
+        self.assertEqual(10, self.cache.backoff_min)
+        self.assertEqual(40, self.cache.backoff_max)
+
+    def test__next_delay(self):
+        """
+        next_delay: interval, None if disabled
+        """
+        self.cache.interval = 100
+        self.assertEqual(100, self.cache.next_delay())
+        self.cache.interval = 0
+        self.assertIsNone(self.cache.next_delay())
+
+    def test__next_delay__jitter(self):
+        """
+        next_delay: random jitter is added
+        """
+        self.cache.set_policy(interval=100, jitter=10)
+        delays = [self.cache.next_delay() for _ in range(100)]
+        self.assertTrue(all([100 <= d <= 110 for d in delays]))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test__next_delay__backoff(self):
+        """
+        next_delay: exponential backoff on failures, reset on success
+        """
+        self.cache.set_policy(interval=100, backoff_min=10, backoff_max=40)
+        self.loader.side_effect = Exception("error")
+        delays = []
+        for _ in range(4):
+            with self.assertRaises(Exception):
+                self.cache.refresh()
+            delays.append(self.cache.next_delay())
+        self.assertEqual([10, 20, 40, 40], delays)
+        self.assertEqual(4, self.cache.failures)
+
+        self.loader.side_effect = None
+        self.cache.refresh()
+        self.assertEqual(0, self.cache.failures)
+        self.assertEqual(100, self.cache.next_delay())
+
+    def test__listener(self):
+        """
+        refresh: the listener receives each new result
+        """
+        listener = MagicMock()
+        self.cache.listener = listener
+        self.cache.get()
+        self.cache.get()
+        self.cache.get(force=True)
+        self.assertEqual(2, listener.call_count)
+        self.assertEqual(1, listener.call_args[0][0]["isLatest"])
+
+    def test__listener__failed(self):
+        """
+        refresh: the result is cached even if the listener failed
+        """
+        self.cache.listener = MagicMock(side_effect=Exception("error"))
+        self.assertEqual(1, self.cache.get()["isLatest"])
+
+    def coalesce(self, loader, listener=None):
+        """
+        Refresh from 3 threads while the first one is loading.
+        """
+        flight = SingleFlight()
+        self.cache = CheckCache(loader, ttl=60, listener=listener,
+                                flight=flight)
+        errors = []
+
+        def refresh():
+            try:
+                self.cache.refresh()
+            except Exception as e:
+                errors.append(e)
+        threads = [Thread(target=refresh) for _ in range(3)]
+        threads[0].start()
+        self.started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while flight.stats()["calls"] < 3:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test__refresh__flight(self):
+        """
+        refresh: the listener runs once for the callers sharing a refresh
+        """
+        self.started, self.release = Event(), Event()
+
+        def loader():
+            self.started.set()
+            self.release.wait()
+            return {"isLatest": 0}
+        listener = MagicMock()
+        errors = self.coalesce(loader, listener)
+        self.assertEqual([], errors)
+        self.assertEqual(1, listener.call_count)
+        self.assertEqual(0, self.cache.get()["isLatest"])
+
+    def test__refresh__flight_failed(self):
+        """
+        refresh: a failed refresh shared by its callers counts once
+        """
+        self.started, self.release = Event(), Event()
+
+        def loader():
+            self.started.set()
+            self.release.wait()
+            raise Exception("error")
+        errors = self.coalesce(loader)
+        self.assertEqual(3, len(errors))
+        self.assertEqual(1, self.cache.failures)
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("CheckCache Test")
+    unittest.main()
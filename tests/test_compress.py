@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import io
+import os
+import sys
+import gzip
+import logging
+import unittest
+import subprocess
+from distutils.spawn import find_executable
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil import compress
+    from fwutil.compress import DecompressStream
+    from fwutil.compress import detect
+    from fwutil.compress import open_decompressed
+    from fwutil.stream import CHUNK_SIZE
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+IMAGE = b"".join([chr(i % 251) for i in range(300000)])
+
+
+def gzip_data(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def command_data(command, data):
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+    return proc.communicate(data)[0]
+
+
+class SlowReader(object):
+    """
+    Return a few bytes on each read, as a slow network.
+    """
+    def __init__(self, data, size=1000):
+        self.src = io.BytesIO(data)
+        self.size = size
+
+    def read(self, size=-1):
+        return self.src.read(min(size, self.size))
+
+
+class TestCompress(unittest.TestCase):
+
+    def read_all(self, stream, size=CHUNK_SIZE):
+        chunks = []
+        while True:
+            chunk = stream.read(size)
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= size)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def test__detect(self):
+        """
+        detect: by the magic bytes
+        """
+        self.assertEqual("gzip", detect(gzip_data(b"firmware")))
+        self.assertEqual("xz", detect(b"\xfd7zXZ\x00\x00"))
+        self.assertEqual("zstd", detect(b"\x28\xb5\x2f\xfd\x00"))
+        self.assertIsNone(detect(b"firmware"))
+        self.assertIsNone(detect(b""))
+
+    def test__gzip(self):
+        """
+        DecompressStream: gzip in small reads
+        """
+        data = gzip_data(IMAGE)
+        stream = DecompressStream(SlowReader(data), "gzip")
+        self.assertEqual(IMAGE, self.read_all(stream, 4096))
+        stats = stream.stats()
+        self.assertEqual(len(data), stats["compressedBytes"])
+        self.assertEqual(len(IMAGE), stats["bytes"])
+        self.assertAlmostEqual(float(len(IMAGE)) / len(data),
+                               stats["ratio"], places=2)
+
+    def test__gzip__members(self):
+        """
+        DecompressStream: concatenated gzip members
+        """
+        data = gzip_data(b"firm") + gzip_data(b"ware")
+        self.assertEqual(b"firmware",
+                         self.read_all(DecompressStream(io.BytesIO(data),
+                                                        "gzip")))
+
+    def test__gzip__bounded(self):
+        """
+        DecompressStream: a chunk of highly compressed data is decompressed
+        in bounded chunks
+        """
+        data = gzip_data(b"\0" * (16 * 1024 * 1024))
+        self.assertLess(len(data), CHUNK_SIZE)
+        stream = DecompressStream(io.BytesIO(data), "gzip")
+        size = 0
+        while True:
+            chunk = stream.read()
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= CHUNK_SIZE)
+            self.assertTrue(len(stream._pending) <= CHUNK_SIZE)
+            size += len(chunk)
+        self.assertEqual(16 * 1024 * 1024, size)
+
+    def test__gzip__corrupted(self):
+        """
+        DecompressStream: corrupted data
+        """
+        data = gzip_data(IMAGE)
+        data = data[:100] + b"\xff" * 100 + data[200:]
+        with self.assertRaises(IOError):
+            self.read_all(DecompressStream(io.BytesIO(data), "gzip"))
+
+    @unittest.skipUnless(compress.lzma or find_executable("xz"),
+                         "xz is not available")
+    def test__xz(self):
+        """
+        DecompressStream: xz
+        """
+        data = command_data(["xz", "-c"], IMAGE) \
+            if find_executable("xz") else compress.lzma.compress(IMAGE)
+        stream, method = open_decompressed(SlowReader(data))
+        self.assertEqual("xz", method)
+        self.assertEqual(IMAGE, self.read_all(stream))
+        self.assertEqual(len(data), stream.stats()["compressedBytes"])
+
+    @unittest.skipUnless(find_executable("xz"), "xz is not available")
+    def test__xz__corrupted(self):
+        """
+        DecompressStream: corrupted xz data
+        """
+        data = command_data(["xz", "-c"], IMAGE)
+        stream = DecompressStream(io.BytesIO(data[:len(data) // 2]), "xz")
+        with self.assertRaises(IOError):
+            self.read_all(stream)
+
+    @unittest.skipUnless(compress.zstandard or find_executable("zstd"),
+                         "zstd is not available")
+    def test__zstd(self):
+        """
+        DecompressStream: zstd
+        """
+        data = command_data(["zstd", "-c", "-q"], IMAGE) \
+            if find_executable("zstd") \
+            else compress.zstandard.ZstdCompressor().compress(IMAGE)
+        stream, method = open_decompressed(io.BytesIO(data))
+        self.assertEqual("zstd", method)
+        self.assertEqual(IMAGE, self.read_all(stream))
+
+    def test__open_decompressed__plain(self):
+        """
+        open_decompressed: the data not compressed is read as it is
+        """
+        stream, method = open_decompressed(SlowReader(b"firmware", 3))
+        self.assertIsNone(method)
+        self.assertEqual(b"firmware", self.read_all(stream))
+
+    def test__unsupported(self):
+        """
+        DecompressStream: unknown method
+        """
+        with self.assertRaises(IOError):
+            DecompressStream(io.BytesIO(b""), "bzip2")
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Compress Test")
+    unittest.main()
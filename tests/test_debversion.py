@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.debversion import parse_version
+    from fwutil.debversion import compare_versions
+    from fwutil.debversion import check_relation
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+# (a, b, expected result), verified with "dpkg --compare-versions"
+VERSION_TABLE = [
+        ("1.0", "1.0", 0),
+        ("1.0", "1.1", -1),
+        ("1.1", "1.0", 1),
+        ("1.0", "1.0-0", 0),
+        ("1.0-1", "1.0-2", -1),
+        ("1.0-10", "1.0-9", 1),
+        ("1.0", "1.00", 0),
+        ("1.0", "1.0.0", -1),
+        ("1.0.0", "1.0", 1),
+        ("1.2.3", "1.2.10", -1),
+        ("1.2.10", "1.2.9", 1),
+        ("1:1.0", "2.0", 1),
+        ("0:1.0", "1.0", 0),
+        ("1:0.1", "0:9.9", 1),
+        ("2:1.0", "10:0.1", -1),
+        ("1.0~rc1", "1.0", -1),
+        ("1.0~rc1", "1.0~rc2", -1),
+        ("1.0~~", "1.0~", -1),
+        ("1.0~", "1.0", -1),
+        ("1.0~~a", "1.0~~", 1),
+        ("1.0~rc1-1", "1.0-1", -1),
+        ("1.0+b1", "1.0", 1),
+        ("1.0+dfsg-1", "1.0-1", 1),
+        ("1.0a", "1.0", 1),
+        ("1.0a", "1.0b", -1),
+        ("1.0A", "1.0a", -1),
+        ("1.0.a", "1.0a", 1),
+        ("1.0-1ubuntu1", "1.0-1", 1),
+        ("1.0-1ubuntu1", "1.0-1.1", -1),
+        ("1.0-1~bpo1", "1.0-1", -1),
+        ("2.30-0ubuntu1", "2.30-0ubuntu1.1", -1),
+        ("1.2.3-4", "1.2.3-4", 0),
+        ("001", "1", 0),
+        ("1.001", "1.1", 0),
+        ("0.9.8", "0.9.8a", -1),
+        ("3.0", "3.0.0~beta", -1),
+        ("1.0.0", "1.1.0", -1),
+        ("1.1.0", "1.0.0", 1),
+        ("1.0.0", "1.0.0", 0),
+        ("1.0.1", "1.0.0+build2", 1),
+        ("0.9.4", "0.10.0", -1),
+        ("10", "9", 1),
+        ("1.0-a", "1.0-b", -1),
+        ("1.0-1+deb8u1", "1.0-1+deb8u2", -1),
+        ("1.0-1+deb8u10", "1.0-1+deb8u9", 1),
+        ("7.4.052-1ubuntu3", "7.4.052-1ubuntu3.1", -1),
+        ("1.18.4", "1.18.4ubuntu1", -1),
+        ("1.0.0~alpha", "1.0.0~beta", -1),
+        ("1.0.0~beta2", "1.0.0~beta10", -1),
+        ("1.0.0~beta", "1.0.0~rc", -1),
+        ("1:1.2.3", "1:1.2.3-0", 0),
+        ("1.2.3-4-5", "1.2.3-4", 1),
+        ("1.2.3-4-5", "1.2.3-4.5", 1),
+        ("1.0+", "1.0.", -1),
+        ("1.0.", "1.0a", 1),
+        ("5.0-1", "5.0-1.", -1),
+        ("2.6.32", "2.6.32-5", -1),
+        ("2.6.32-5-686", "2.6.32-5-amd64", -1),
+        ("0.0", "0", 1),
+        ("a1", "b1", -1),
+        ("1.0~a", "1.0~A", 1),
+        ("0.1", "0.01", 0),
+        ("4.4.0-21", "4.4.0-21.37", -1),
+        ("20150101", "2015.01.01", 1),
+        ("1.0-0.1", "1.0-0", 1),
+        ("1.0.0-rc1", "1.0.0-1", 1),
+        ("9.99", "10.0", -1),
+        ("1.0~alpha+1", "1.0~alpha", 1),
+        ("1.0+~", "1.0+", -1),
+        ("1.2.3+git20150101", "1.2.3+git20150201", -1),
+]
+
+
+class TestDebVersion(unittest.TestCase):
+
+    def test__parse_version(self):
+        """
+        parse_version: epoch, upstream and revision
+        """
+        self.assertEqual((0, "1.0", "0"), parse_version("1.0"))
+        self.assertEqual((1, "1.0", "0"), parse_version("1:1.0"))
+        self.assertEqual((2, "1.0-rc1", "3"), parse_version("2:1.0-rc1-3"))
+        self.assertEqual((0, "1:0", "1"), parse_version("0:1:0-1"))
+
+    def test__parse_version__invalid(self):
+        """
+        parse_version: invalid versions
+        """
+        for version in ["", None, "(none)", "a:1.0", "1.0-", "1.0 beta"]:
+            with self.assertRaises(ValueError):
+                parse_version(version)
+
+    def test__compare_versions(self):
+        """
+        compare_versions: same result as dpkg
+        """
+        for a, b, expected in VERSION_TABLE:
+            self.assertEqual(expected, compare_versions(a, b),
+                             "%s vs %s" % (a, b))
+            self.assertEqual(-expected, compare_versions(b, a),
+                             "%s vs %s" % (b, a))
+
+    def test__compare_versions__invalid(self):
+        """
+        compare_versions: invalid versions
+        """
+        with self.assertRaises(ValueError):
+            compare_versions("(none)", "1.0.0")
+
+    def test__check_relation(self):
+        """
+        check_relation: all relations supported by dpkg
+        """
+        self.assertTrue(check_relation("1.0", "lt", "1.1"))
+        self.assertTrue(check_relation("1.0", "<<", "1.1"))
+        self.assertTrue(check_relation("1.0", "le", "1.0"))
+        self.assertTrue(check_relation("1.0", "<=", "1.1"))
+        self.assertTrue(check_relation("1.0", "eq", "1.0-0"))
+        self.assertTrue(check_relation("1.0", "=", "1.00"))
+        self.assertTrue(check_relation("1.0", "ne", "1.1"))
+        self.assertTrue(check_relation("1.1", "ge", "1.1"))
+        self.assertTrue(check_relation("1.1", ">=", "1.0"))
+        self.assertTrue(check_relation("1.1", "gt", "1.0"))
+        self.assertTrue(check_relation("1.1", ">>", "1.0"))
+        self.assertFalse(check_relation("1.1", "le", "1.0"))
+        self.assertFalse(check_relation("1.0~rc1", "gt", "1.0"))
+
+    def test__check_relation__unknown(self):
+        """
+        check_relation: unknown relation
+        """
+        with self.assertRaises(ValueError):
+            check_relation("1.0", "lt-nl", "1.1")
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("DebVersion Test")
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import random
+import hashlib
+import logging
+import unittest
+
+from StringIO import StringIO
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.delta import MAGIC
+    from fwutil.delta import iter_delta
+    from fwutil.delta import apply_delta
+    from fwutil.delta import make_delta
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+def make_images():
+    """
+    A pair of images: 4 blocks changed in the target, and 1 block appended.
+    """
+    rand = random.Random(0)
+    source = bytearray(rand.getrandbits(8) for _ in range(64 * 1024))
+    target = bytearray(source)
+    for offset in [0, 8192, 8193, 40960]:
+        target[offset] ^= 0xff
+    target += bytearray(rand.getrandbits(8) for _ in range(4096))
+    return (bytes(source), bytes(target))
+
+
+class TestDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.source, self.target = make_images()
+        self.delta = StringIO()
+        make_delta(self.source, self.target, self.delta)
+
+    def test__make_delta(self):
+        """
+        make_delta: only the changed blocks are carried
+        """
+        size = len(self.delta.getvalue())
+        self.assertTrue(size > 4 * 4096)
+        self.assertTrue(size < 5 * 4096)
+
+    def test__apply_delta(self):
+        """
+        apply_delta: rebuild the target image
+        """
+        dst = StringIO()
+        digest = hashlib.sha256()
+        size, delta_size = apply_delta(
+            StringIO(self.source), StringIO(self.delta.getvalue()), dst,
+            digests=[digest])
+        self.assertEqual(self.target, dst.getvalue())
+        self.assertEqual(len(self.target), size)
+        self.assertEqual(len(self.delta.getvalue()), delta_size)
+        self.assertEqual(hashlib.sha256(self.target).hexdigest(),
+                         digest.hexdigest())
+
+    def test__iter_delta__chunk_size(self):
+        """
+        iter_delta: chunks are not larger than chunk_size
+        """
+        chunks = list(iter_delta(StringIO(self.source),
+                                 StringIO(self.delta.getvalue()),
+                                 chunk_size=1000))
+        self.assertEqual(1000, max([len(chunk) for chunk in chunks]))
+        self.assertEqual(self.target, b"".join(chunks))
+
+    def test__iter_delta__not_delta(self):
+        """
+        iter_delta: not a delta
+        """
+        with self.assertRaises(IOError):
+            list(iter_delta(StringIO(self.source), StringIO(self.target)))
+
+    def test__iter_delta__corrupted(self):
+        """
+        iter_delta: unknown operation
+        """
+        with self.assertRaises(IOError):
+            list(iter_delta(StringIO(self.source), StringIO(MAGIC + b"X")))
+
+    def test__iter_delta__truncated(self):
+        """
+        iter_delta: the delta is truncated
+        """
+        delta = self.delta.getvalue()
+        with self.assertRaises(IOError):
+            list(iter_delta(StringIO(self.source), StringIO(delta[:-10])))
+        with self.assertRaises(IOError):
+            list(iter_delta(StringIO(self.source),
+                            StringIO(MAGIC + b"C\x00")))
+
+    def test__iter_delta__source_mismatched(self):
+        """
+        iter_delta: the source image is shorter than expected
+        """
+        with self.assertRaises(IOError):
+            list(iter_delta(StringIO(self.source[:4096]),
+                            StringIO(self.delta.getvalue())))
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Delta Test")
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import io
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import logging
+import unittest
+from threading import Event
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+    from fwutil.download import download
+    from fwutil.download import download_decompressed
+    from fwutil.download import fetch_text
+    from httpd import LocalServer
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+workdir = "%s/data/download" % dirpath
+IMAGE = b"".join([chr(i % 256) for i in range(200000)])
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs("%s/repo" % workdir)
+        with open("%s/repo/LATEST_FIRMWARE" % workdir, "wb") as f:
+            f.write(IMAGE)
+        with open("%s/repo/LATEST_FIRMWARE.sha256" % workdir, "w") as f:
+            f.write("%s  LATEST_FIRMWARE\n" %
+                    hashlib.sha256(IMAGE).hexdigest())
+        self.server = LocalServer("%s/repo" % workdir).start()
+        self.path = "%s/LATEST_FIRMWARE" % workdir
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test__download(self):
+        """
+        download: whole file
+        """
+        size = download(self.server.url + "/LATEST_FIRMWARE", self.path,
+                        chunk_size=4096)
+        self.assertEqual(len(IMAGE), size)
+        self.assertEqual(IMAGE, self.read())
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+    def test__download__resume(self):
+        """
+        download: resume the interrupted download
+        """
+        with open(self.path + ".part", "wb") as f:
+            f.write(IMAGE[:50000])
+        size = download(self.server.url + "/LATEST_FIRMWARE", self.path)
+        self.assertEqual(len(IMAGE), size)
+        self.assertEqual(IMAGE, self.read())
+        self.assertEqual("bytes=50000-",
+                         self.server.requests[0][1].get("range"))
+
+    def test__download__resume_completed(self):
+        """
+        download: the interrupted download is already completed
+        """
+        with open(self.path + ".part", "wb") as f:
+            f.write(IMAGE)
+        size = download(self.server.url + "/LATEST_FIRMWARE", self.path)
+        self.assertEqual(len(IMAGE), size)
+        self.assertEqual(IMAGE, self.read())
+
+    def test__download__resume_not_supported(self):
+        """
+        download: download again if the server cannot resume
+        """
+        self.server.httpd.ranges = False
+        with open(self.path + ".part", "wb") as f:
+            f.write(b"garbage")
+        download(self.server.url + "/LATEST_FIRMWARE", self.path)
+        self.assertEqual(IMAGE, self.read())
+
+    def test__download__cancelled(self):
+        """
+        download: stop once cancelled, the part is resumed next time
+        """
+        cancelled = Event()
+        cancelled.set()
+        with self.assertRaises(IOError):
+            download(self.server.url + "/LATEST_FIRMWARE", self.path,
+                     cancelled=cancelled)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(self.path + ".part"))
+
+    def test__download__not_found(self):
+        """
+        download: file not found
+        """
+        with self.assertRaises(Exception):
+            download(self.server.url + "/NOT_FOUND", self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test__download_decompressed(self):
+        """
+        download_decompressed: decompress the gzip compressed file
+        """
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(IMAGE)
+        with open("%s/repo/LATEST_FIRMWARE.gz" % workdir, "wb") as f:
+            f.write(buf.getvalue())
+        digest = hashlib.sha256()
+        size, stats = download_decompressed(
+            self.server.url + "/LATEST_FIRMWARE.gz", self.path,
+            digests=[digest])
+        self.assertEqual(len(IMAGE), size)
+        self.assertEqual(IMAGE, self.read())
+        self.assertEqual(hashlib.sha256(IMAGE).hexdigest(), digest.hexdigest())
+        self.assertEqual("gzip", stats["method"])
+        self.assertEqual(len(buf.getvalue()), stats["compressedBytes"])
+        self.assertFalse(os.path.exists(self.path + ".unpack"))
+
+    def test__download_decompressed__plain(self):
+        """
+        download_decompressed: the file not compressed is downloaded as it
+        is, and resumed
+        """
+        size, stats = download_decompressed(
+            self.server.url + "/LATEST_FIRMWARE", self.path)
+        self.assertEqual((len(IMAGE), None), (size, stats))
+        self.assertEqual(IMAGE, self.read())
+
+        with open(self.path + ".part", "wb") as f:
+            f.write(IMAGE[:50000])
+        download_decompressed(self.server.url + "/LATEST_FIRMWARE", self.path)
+        self.assertEqual(IMAGE, self.read())
+        self.assertEqual("bytes=50000-",
+                         self.server.requests[-1][1].get("range"))
+
+    def test__download_decompressed__corrupted(self):
+        """
+        download_decompressed: nothing is left if cannot be decompressed
+        """
+        with open("%s/repo/LATEST_FIRMWARE.gz" % workdir, "wb") as f:
+            f.write(b"\x1f\x8b" + b"\xff" * 100)
+        with self.assertRaises(IOError):
+            download_decompressed(self.server.url + "/LATEST_FIRMWARE.gz",
+                                  self.path)
+        self.assertEqual([], [name for name in os.listdir(workdir)
+                              if name.startswith("LATEST_FIRMWARE")])
+
+    def test__fetch_text(self):
+        """
+        fetch_text: small text file
+        """
+        text = fetch_text(self.server.url + "/LATEST_FIRMWARE.sha256")
+        self.assertEqual(hashlib.sha256(IMAGE).hexdigest(), text.split()[0])
+        self.assertIsNone(fetch_text(self.server.url + "/NOT_FOUND"))
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Download Test")
+    unittest.main()
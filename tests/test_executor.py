@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+import sh
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil import executor
+    from fwutil.executor import CommandCancelled
+    from fwutil.executor import CommandTimeout
+    from fwutil.executor import Executor
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+pversion = sh.Command("%s/pversion" % dirpath)
+version_compare = sh.Command("%s/version_compare" % dirpath)
+setdef = sh.Command("%s/setdef" % dirpath)
+reboot = sh.Command("%s/reboot" % dirpath)
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = Executor(max_workers=2, timeout=10)
+
+    def tearDown(self):
+        self.executor.cancel_all()
+
+    def test__run(self):
+        """
+        run: return the output of the command
+        """
+        output = self.executor.run(pversion)
+        self.assertEqual("MXcloud version 1.0.0\n", str(output))
+        output = self.executor.run(version_compare, "1.0.0", "1.1.0")
+        self.assertIn("Candidate: 1.1.0", str(output))
+        self.assertEqual(2, self.executor.stats()["done"])
+
+    def test__run__failed(self):
+        """
+        run: the error of the command is raised
+        """
+        with self.assertRaises(sh.ErrorReturnCode):
+            self.executor.run(setdef, "1")
+        self.executor.run(reboot)
+        stats = self.executor.stats()
+        self.assertEqual(1, stats["failed"])
+        self.assertEqual(1, stats["done"])
+
+    def test__run__timeout(self):
+        """
+        run: the command is killed after its timeout
+        """
+        start = time.time()
+        with self.assertRaises(CommandTimeout):
+            self.executor.run(sh.sleep, "10", timeout=0.2)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(1, self.executor.stats()["timeouts"])
+
+    def test__cancel(self):
+        """
+        cancel: terminate the running command
+        """
+        command = self.executor.submit(sh.sleep, "10")
+        while executor.RUNNING != command.state:
+            time.sleep(0.01)
+        self.assertEqual([command], self.executor.running())
+        self.assertTrue(command.cancel())
+        with self.assertRaises(CommandCancelled):
+            command.result(timeout=5)
+        self.assertEqual(executor.CANCELLED, command.state)
+        self.assertEqual([], self.executor.running())
+        self.assertFalse(command.cancel())
+
+    def test__max_workers(self):
+        """
+        submit: commands over max_workers wait for a free worker
+        """
+        running = [self.executor.submit(sh.sleep, "10") for _ in range(2)]
+        queued = self.executor.submit(pversion)
+        time.sleep(0.3)
+        self.assertEqual(executor.QUEUED, queued.state)
+        self.assertEqual(2, self.executor.stats()["running"])
+        self.assertEqual(1, self.executor.stats()["queued"])
+        with self.assertRaises(CommandTimeout):
+            queued.result(timeout=0.1)
+
+        running[0].cancel()
+        self.assertEqual("MXcloud version 1.0.0\n",
+                         str(queued.result(timeout=5)))
+
+    def test__timeout__queued(self):
+        """
+        run: the time waiting for a worker counts in the timeout
+        """
+        self.executor = Executor(max_workers=1)
+        running = self.executor.submit(sh.sleep, "10")
+        queued = self.executor.submit(pversion, timeout=0.2)
+        time.sleep(0.3)
+        running.cancel()
+        with self.assertRaises(CommandTimeout):
+            queued.result(timeout=5)
+        self.assertEqual(executor.TIMEOUT, queued.state)
+        self.assertIsNone(queued._process)
+
+    def test__short_workers(self):
+        """
+        submit: short commands are not queued behind the long ones
+        """
+        self.executor = Executor(max_workers=1, short_workers=1,
+                                 short_timeout=30)
+        running = self.executor.submit(sh.sleep, "10", timeout=600)
+        self.assertEqual("MXcloud version 1.0.0\n", str(
+            self.executor.submit(pversion, timeout=30).result(timeout=5)))
+        queued = self.executor.submit(pversion, timeout=600)
+        time.sleep(0.3)
+        self.assertEqual(executor.QUEUED, queued.state)
+        running.cancel()
+        queued.result(timeout=5)
+
+    def test__shutdown(self):
+        """
+        shutdown: cancel the commands and refuse new ones
+        """
+        command = self.executor.submit(sh.sleep, "10")
+        self.executor.shutdown()
+        with self.assertRaises(CommandCancelled):
+            command.result(timeout=5)
+        with self.assertRaises(CommandCancelled):
+            self.executor.run(pversion)
+
+    def test__cancel__queued(self):
+        """
+        cancel: the queued command is never started
+        """
+        self.executor = Executor(max_workers=1)
+        running = self.executor.submit(sh.sleep, "10")
+        queued = self.executor.submit(setdef)
+        queued.cancel()
+        running.cancel()
+        with self.assertRaises(CommandCancelled):
+            queued.result(timeout=5)
+        self.assertIsNone(queued._process)
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Executor Test")
+    unittest.main()
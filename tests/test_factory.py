@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import shutil
+import logging
+import unittest
+from mock import patch
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil import factory
+    from fwutil.factory import Manifest
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+config_root = "%s/data/config" % dirpath
+manifest_path = "%s/data/factory.manifest" % dirpath
+
+
+def write(name, data):
+    path = os.path.join(config_root, name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(data)
+    return path
+
+
+def read(name):
+    with open(os.path.join(config_root, name)) as f:
+        return f.read()
+
+
+class TestFactory(unittest.TestCase):
+
+    def setUp(self):
+        write("ethernet/data/ethernet.json.factory", '{"dhcp": 1}')
+        write("ethernet/data/ethernet.json", '{"dhcp": 1}')
+        write("dns/data/dns.json.factory", '{"servers": []}')
+        write("dns/data/dns.json", '{"servers": ["8.8.8.8"]}')
+        write("ntp/data/ntp.json.factory", '{"enable": 0}')
+
+    def tearDown(self):
+        shutil.rmtree(config_root, ignore_errors=True)
+        try:
+            os.remove(manifest_path)
+        except OSError:
+            pass
+
+    def test__build(self):
+        """
+        build: hash the factory defaults, kept ones are reused
+        """
+        manifest = Manifest(config_root, manifest_path)
+        entries = manifest.build()
+        self.assertEqual(["dns/data/dns.json", "ethernet/data/ethernet.json",
+                          "ntp/data/ntp.json"], sorted(entries))
+        self.assertEqual(3, manifest.hashed)
+        self.assertEqual(11, entries["ethernet/data/ethernet.json"]["size"])
+
+        manifest = Manifest(config_root, manifest_path)
+        self.assertEqual(entries, manifest.entries)
+        write("ntp/data/ntp.json.factory", '{"enable": 1, "server": ""}')
+        manifest.build()
+        self.assertEqual(1, manifest.hashed)
+
+    def test__build__bundles_only(self):
+        """
+        build: only the factory defaults of the bundle models
+        """
+        write("ethernet/data/fixtures/ethernet.json.factory", "{}")
+        write("ethernet/tests/data/ethernet.json.factory", "{}")
+        write("ethernet/data/ethernet.conf.factory", "")
+        write("ntp.json.factory", "{}")
+        manifest = Manifest(config_root)
+        self.assertEqual(["dns/data/dns.json", "ethernet/data/ethernet.json",
+                          "ntp/data/ntp.json"], sorted(manifest.build()))
+
+    def test__build__no_save(self):
+        """
+        build: the manifest is not written if not saved
+        """
+        manifest = Manifest(config_root, manifest_path)
+        self.assertEqual(3, len(manifest.build(save=False)))
+        self.assertFalse(os.path.exists(manifest_path))
+
+    def test__diff(self):
+        """
+        diff: the missing and changed files only
+        """
+        manifest = Manifest(config_root)
+        manifest.build()
+        report = factory.diff(manifest)
+        self.assertEqual(1, report["unchanged"])
+        self.assertEqual(
+            [("dns/data/dns.json", "restore"),
+             ("ntp/data/ntp.json", "create")],
+            [(c["path"], c["action"]) for c in report["changes"]])
+
+        # same size, compared by the hash
+        write("ethernet/data/ethernet.json", '{"dhcp": 0}')
+        self.assertEqual(3, len(factory.diff(manifest)["changes"]))
+
+    def test__restore(self):
+        """
+        restore: copy the factory defaults over the changed files
+        """
+        manifest = Manifest(config_root)
+        manifest.build()
+        paths = factory.restore(config_root,
+                                factory.diff(manifest)["changes"])
+        self.assertEqual(2, len(paths))
+        self.assertEqual('{"servers": []}', read("dns/data/dns.json"))
+        self.assertEqual('{"enable": 0}', read("ntp/data/ntp.json"))
+        self.assertEqual([], factory.diff(manifest)["changes"])
+        self.assertFalse(os.path.exists(
+            os.path.join(config_root, "dns/data/dns.json.tmp")))
+
+    def test__restore__failed(self):
+        """
+        restore: nothing is replaced if any copy fails
+        """
+        manifest = Manifest(config_root)
+        manifest.build()
+        changes = factory.diff(manifest)["changes"]
+
+        def copy(src, dst):
+            if "ntp" in src:
+                raise IOError("disk full")
+            shutil.copyfile(src, dst)
+
+        with patch("fwutil.factory.shutil.copy2", side_effect=copy):
+            with self.assertRaises(IOError):
+                factory.restore(config_root, changes)
+        self.assertEqual('{"servers": ["8.8.8.8"]}', read("dns/data/dns.json"))
+        self.assertFalse(os.path.exists(
+            os.path.join(config_root, "dns/data/dns.json.tmp")))
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Factory Test")
+    unittest.main()
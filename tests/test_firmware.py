@@ -2,22 +2,37 @@
 # -*- coding: UTF-8 -*-
 
 
+import io
 import os
 import sys
+import gzip
+import time
+import shutil
+import hashlib
 import logging
+import threading
 import unittest
-import sh
 
+import sh
 from mock import patch
 from mock import MagicMock
 from sanji.connection.mockup import Mockup
 from sanji.message import Message
+from sanji.session import TimeoutError
 
 try:
     sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)))
     os.environ["PATH"] = os.path.dirname(os.path.realpath(__file__)) \
         + ":" + os.environ["PATH"]
+    import firmware
     from firmware import Firmware
+    from fwutil import jobs
+    from fwutil import product
+    from fwutil.jobs import Job
+    from fwutil.delta import make_delta
+    from httpd import LocalServer
+    from test_delta import make_images
 except ImportError as e:
     print os.path.dirname(os.path.realpath(__file__)) + "/../"
     print sys.path
@@ -27,6 +42,7 @@ except ImportError as e:
     exit(1)
 
 dirpath = os.path.dirname(os.path.realpath(__file__))
+upgrade_sh = "%s/../tools/upgrade.sh" % dirpath
 logger = logging.getLogger()
 
 
@@ -50,6 +66,24 @@ class TestFirmwareClass(unittest.TestCase):
         except OSError:
             pass
 
+        shutil.rmtree("%s/data/stage" % dirpath, ignore_errors=True)
+        shutil.rmtree("%s/data/repo" % dirpath, ignore_errors=True)
+        shutil.rmtree("%s/data/lists" % dirpath, ignore_errors=True)
+        shutil.rmtree("%s/data/peer" % dirpath, ignore_errors=True)
+        shutil.rmtree("%s/data/config" % dirpath, ignore_errors=True)
+        try:
+            os.remove("%s/data/INSTALLED_FIRMWARE" % dirpath)
+        except OSError:
+            pass
+        try:
+            os.remove("%s/data/history.bin" % dirpath)
+        except OSError:
+            pass
+        try:
+            os.remove("%s/data/factory.manifest" % dirpath)
+        except OSError:
+            pass
+
     def test__init__no_conf(self):
         """
         init: no configuration file
@@ -65,6 +99,26 @@ class TestFirmwareClass(unittest.TestCase):
         """
         self.bundle.run()
 
+    def test__before_stop__hung_check(self):
+        """
+        before_stop: a hung check does not hold the bundle from stopping
+        """
+        started = threading.Event()
+
+        def check():
+            started.set()
+            self.bundle.executor.run(sh.sleep, "30", timeout=900)
+        self.bundle.check_cache.loader = check
+        self.bundle.check_cache.set_policy(interval=0.01, jitter=0)
+        self.bundle.check_cache.start()
+        started.wait(5)
+        time.sleep(0.2)
+
+        start = time.time()
+        self.bundle.before_stop()
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(self.bundle.stopping.is_set())
+
     def test__run__upgrading_success(self):
         """
         run: upgrading success
@@ -108,6 +162,33 @@ class TestFirmwareClass(unittest.TestCase):
         # Already tested in init()
         pass
 
+    def test__save__coalesced(self):
+        """
+        save: changes are written together, upgrading is written now
+        """
+        writes = self.bundle.store.stats()["writes"]
+        self.bundle.model.db["server"] = "moxa"
+        self.bundle.save()
+        self.bundle.save()
+        self.assertEqual(writes, self.bundle.store.stats()["writes"])
+
+        self.bundle.model.db["upgrading"] = 1
+        self.bundle.save()
+        self.assertEqual(writes + 1, self.bundle.store.stats()["writes"])
+        with open("%s/data/%s.json" % (dirpath, self.name)) as f:
+            self.assertIn('"upgrading": 1', f.read())
+
+    def test__get__store_stats(self):
+        """
+        get (/system/firmware): counters of the saves
+        """
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertIn("writes", data["storeStats"])
+            self.assertNotIn("storeStats", self.bundle.model.db)
+        self.bundle.get(message=message, response=resp, test=True)
+
     @patch("firmware.sh.apt_get")
     def test__check__update_failed(self, mock_apt_get):
         """
@@ -128,66 +209,128 @@ class TestFirmwareClass(unittest.TestCase):
         with self.assertRaises(Exception):
             self.bundle.check()
 
-    @patch("firmware.sh.apt_cache")
     @patch("firmware.sh.apt_get")
-    def test__check__not_installed(self, mock_apt_get, mock_apt_cache):
+    def test__check__not_installed(self, mock_apt_get):
         """
         check: firmware version is not latest
         """
-        def mock_policy(arg1, arg2):
-            return sh.version_compare("(none)", "1.1.0")
-
-        mock_apt_cache.side_effect = mock_policy
+        self.bundle.package_index.policy = \
+            MagicMock(return_value=("(none)", "1.1.0"))
         check = self.bundle.check()
         self.assertEqual(check["isLatest"], 0)
         self.assertEqual(check["current"], "(none)")
         self.assertEqual(check["candidate"], "1.1.0")
 
-    @patch("firmware.sh.apt_cache")
     @patch("firmware.sh.apt_get")
-    def test__check__not_latest(self, mock_apt_get, mock_apt_cache):
+    def test__check__not_latest(self, mock_apt_get):
         """
         check: firmware version is not latest
         """
-        def mock_policy(arg1, arg2):
-            return sh.version_compare("1.0.0", "1.1.0")
-
-        mock_apt_cache.side_effect = mock_policy
+        self.bundle.package_index.policy = \
+            MagicMock(return_value=("1.0.0", "1.1.0"))
         check = self.bundle.check()
         self.assertEqual(check["isLatest"], 0)
         self.assertEqual(check["current"], "1.0.0")
         self.assertEqual(check["candidate"], "1.1.0")
 
-    @patch("firmware.sh.apt_cache")
     @patch("firmware.sh.apt_get")
-    def test__check__latest(self, mock_apt_get, mock_apt_cache):
+    def test__check__latest(self, mock_apt_get):
         """
         check: firmware version is latest
         """
-        def mock_policy(arg1, arg2):
-            return sh.version_compare("1.0.0", "1.0.0")
-
-        mock_apt_cache.side_effect = mock_policy
+        self.bundle.package_index.policy = \
+            MagicMock(return_value=("1.0.0", "1.0.0"))
         check = self.bundle.check()
         self.assertEqual(check["isLatest"], 1)
         self.assertEqual(check["current"], "1.0.0")
         self.assertEqual(check["candidate"], "1.0.0")
 
-    @patch("firmware.sh.apt_cache")
     @patch("firmware.sh.apt_get")
-    def test__check__newer_then_candidate(self, mock_apt_get, mock_apt_cache):
+    def test__check__newer_then_candidate(self, mock_apt_get):
         """
         check: firmware version is newer than candidate
         """
-        def mock_policy(arg1, arg2):
-            return sh.version_compare("1.1.0", "1.0.0")
-
-        mock_apt_cache.side_effect = mock_policy
+        self.bundle.package_index.policy = \
+            MagicMock(return_value=("1.1.0", "1.0.0"))
         check = self.bundle.check()
         self.assertEqual(check["isLatest"], 1)
         self.assertEqual(check["current"], "1.1.0")
         self.assertEqual(check["candidate"], "1.0.0")
 
+    @patch("firmware.sh.apt_get")
+    def test__check__unknown_package(self, mock_apt_get):
+        """
+        check: package is not known by dpkg nor apt
+        """
+        self.bundle.package_index.policy = \
+            MagicMock(return_value=("(none)", "(none)"))
+        with self.assertRaises(Exception):
+            self.bundle.check()
+
+    @patch("firmware.sh.apt_get")
+    def test__check__package_index(self, mock_apt_get):
+        """
+        check: read versions from the dpkg status and apt lists fixtures
+        """
+        check = self.bundle.check()
+        self.assertEqual(check["isLatest"], 0)
+        self.assertEqual(check["current"], "1.0.0")
+        self.assertEqual(check["candidate"], "1.1.0")
+        self.assertNotIn("indexStats", check)
+        self.assertEqual(
+            ("update", "-o",
+             "Dir::Etc::sourcelist=sources.list.d/mxcloud.list",
+             "-o", "Dir::Etc::sourceparts=-",
+             "-o", "APT::Get::List-Cleanup=0"),
+            mock_apt_get.call_args[0])
+
+    def test__check__repo_index(self):
+        """
+        check: refresh the index of the firmware repository only
+        """
+        repo = "%s/data/repo/dists/stable/main/binary-armhf" % dirpath
+        os.makedirs(repo)
+        with open("%s/Packages" % repo, "w") as f:
+            f.write("Package: mxcloud-cg\nVersion: 1.2.0\n")
+        with open("%s/data/repo/dists/stable/Release" % dirpath, "w") as f:
+            f.write("Suite: stable\n")
+        server = LocalServer("%s/data/repo" % dirpath).start()
+        self.addCleanup(server.stop)
+        source_list = "%s/data/mxcloud.list" % dirpath
+        with open(source_list, "w") as f:
+            f.write("deb %s stable main\n" % server.url)
+        self.addCleanup(os.remove, source_list)
+        self.bundle.repo_index.arch = "armhf"
+
+        with patch.dict(self.bundle.profile, {"source_list": source_list}), \
+                patch.object(self.bundle.repo_index, "sources_path",
+                             source_list):
+            check = self.bundle.check()
+            self.assertEqual("1.2.0", check["candidate"])
+            self.assertEqual(1, check["indexStats"]["updated"])
+
+            check = self.bundle.check()
+            self.assertEqual("1.2.0", check["candidate"])
+            self.assertEqual(1, check["indexStats"]["requests"])
+            self.assertEqual(0, check["indexStats"]["bytes"])
+
+    def test__check__repo_index_failed(self):
+        """
+        check: failed to refresh the index of the firmware repository
+        """
+        source_list = "%s/data/mxcloud.list" % dirpath
+        with open(source_list, "w") as f:
+            f.write("deb http://127.0.0.1:1 stable main\n")
+        self.addCleanup(os.remove, source_list)
+        self.bundle.repo_index.arch = "armhf"
+        with patch.dict(self.bundle.profile, {"source_list": source_list}), \
+                patch.object(self.bundle.repo_index, "sources_path",
+                             source_list):
+            with self.assertRaises(Exception) as cm:
+                self.bundle.check()
+        self.assertEqual("Cannot update the package list.",
+                         str(cm.exception))
+
     @patch("firmware.time.sleep")
     @patch("firmware.sh.sh")
     @patch("firmware.sh.reboot")
@@ -195,10 +338,27 @@ class TestFirmwareClass(unittest.TestCase):
         """
         upgrade: success
         """
+        self.bundle.strategy = product.lookup("uc8100")
         mock_upgrade.return_value = 0
 
         self.bundle.upgrade()
         self.assertEqual(0, self.bundle.model.db["upgrading"])
+        self.assertNotIn("version", self.bundle.model.db)
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__job(self, mock_reboot, mock_upgrade, mock_sleep):
+        """
+        upgrade: update the job state
+        """
+        self.bundle.strategy = product.lookup("uc8100")
+        job = Job(1, "upgrade", None)
+        states = []
+        job.add_listener(lambda job: states.append(job.state))
+
+        self.bundle.upgrade(job)
+        self.assertEqual([jobs.DOWNLOADING, jobs.REBOOTING], states)
 
     @patch("firmware.time.sleep")
     @patch("firmware.sh.sh")
@@ -206,6 +366,7 @@ class TestFirmwareClass(unittest.TestCase):
         """
         upgrade: failed
         """
+        self.bundle.strategy = product.lookup("uc8100")
         mock_upgrade.return_value = 1
         mock_upgrade.side_effect = Exception("error")
 
@@ -213,192 +374,1793 @@ class TestFirmwareClass(unittest.TestCase):
         self.assertEqual(-1, self.bundle.model.db["upgrading"])
 
     @patch("firmware.time.sleep")
-    @patch("firmware.sh.setdef")
+    @patch("firmware.sh.sh")
     @patch("firmware.sh.reboot")
-    def test__setdef(self, mock_reboot, mock_setdef, mock_sleep):
+    def test__upgrade__progress(self, mock_reboot, mock_upgrade, mock_sleep):
         """
-        setdef: success
+        upgrade: publish the progress of upgrade script
         """
-        self.bundle.setdef()
-        self.assertEqual(0, self.bundle.model.db["defaulting"])
+        def upgrade(script, *args, **kwargs):
+            with open("%s/mockdata/upgrade/apt.log" % dirpath) as f:
+                for line in f:
+                    kwargs["_out"](line)
+
+        mock_upgrade.side_effect = upgrade
+        self.bundle.strategy = product.lookup("uc8100")
+        job = Job(1, "upgrade", None)
+        states = []
+        job.add_listener(lambda job: states.append(job.state))
+
+        self.bundle.upgrade(job)
+        self.assertEqual([jobs.DOWNLOADING, jobs.INSTALLING,
+                          jobs.REBOOTING], states)
+        self.assertEqual(100, job.percent)
+        events = [c[1]["data"] for c in
+                  self.bundle.publish.event.put.call_args_list]
+        self.assertEqual(["downloading", "installing", "configuring",
+                          "done"], [e["phase"] for e in events])
+        self.assertEqual(["FW_UPGRADE_PROGRESS"] * 4,
+                         [e["code"] for e in events])
 
     @patch("firmware.time.sleep")
-    @patch("firmware.sh.setdef")
-    def test__setdef__failed(self, mock_setdef, mock_sleep):
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__job_failed(self, mock_reboot, mock_upgrade,
+                                  mock_sleep):
         """
-        setdef: failed
+        upgrade: job failed
         """
-        mock_setdef.side_effect = Exception("error")
+        self.bundle.strategy = product.lookup("uc8100")
+        mock_upgrade.side_effect = Exception("error")
+        job = Job(1, "upgrade", None)
 
-        self.bundle.setdef()
-        self.assertEqual(-1, self.bundle.model.db["defaulting"])
+        self.bundle.upgrade(job)
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertEqual(1, mock_reboot.call_count)
+        kwargs = mock_reboot.call_args[1]
+        self.assertTrue(kwargs["_bg"])
+        # the time left of the timeout
+        self.assertTrue(0 < kwargs["_timeout"] <=
+                        firmware.COMMAND_TIMEOUTS["reboot"])
 
-    def test__get(self):
+    def staged_image(self):
+        stage_dir = "%s/data/stage" % dirpath
+        if not os.path.isdir(stage_dir):
+            os.makedirs(stage_dir)
+        path = os.path.join(stage_dir, "LATEST_FIRMWARE")
+        with open(path, "wb") as f:
+            f.write(b"firmware")
+        return path
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__staged(self, mock_reboot, mock_upgrade, mock_sleep):
         """
-        get (/system/firmware)
+        upgrade: install the staged image
         """
-        message = Message({"data": {}, "query": {}, "param": {}})
+        path = self.staged_image()
+        self.bundle.model.db["staged"] = {"type": "image", "path": path,
+                                          "size": 8, "verified": True}
+        self.bundle.upgrade()
+        env = mock_upgrade.call_args[1]["_env"]
+        self.assertEqual("1", env["STAGED"])
+        self.assertEqual(path, env["FIRMWARE_IMAGE"])
+        self.assertNotIn("staged", self.bundle.model.db)
 
-        def resp(code=200, data=None):
-            self.assertEqual(200, code)
-            self.assertEqual("1.0.0", data["version"])
-        self.bundle.get(message=message, response=resp, test=True)
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__staged_missing(self, mock_reboot, mock_upgrade,
+                                      mock_sleep):
+        """
+        upgrade: download again if the staged image is missing
+        """
+        self.bundle.strategy = product.lookup("uc8100")
+        self.bundle.model.db["staged"] = {"type": "image",
+                                          "path": "/tmp/LATEST_FIRMWARE",
+                                          "size": 8, "verified": True}
+        self.bundle.upgrade()
+        env = mock_upgrade.call_args[1]["_env"]
+        self.assertNotIn("STAGED", env)
+        self.assertNotIn("FIRMWARE_IMAGE", env)
+        self.assertNotIn("staged", self.bundle.model.db)
 
-    @patch.object(Firmware, 'check')
-    def test__get_check__update_failed(self, mock_check):
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__staged_failed(self, mock_reboot, mock_upgrade,
+                                     mock_sleep):
         """
-        get (/system/firmware/check): update failed
+        upgrade: drop the staged artifacts if failed
         """
-        mock_check.side_effect = Exception("Cannot update the package list.")
-        message = Message({"data": {}, "query": {}, "param": {}})
+        mock_upgrade.side_effect = Exception("error")
+        self.bundle.model.db["staged"] = {"type": "package",
+                                          "package": "mxcloud-cg",
+                                          "verified": True}
+        self.bundle.upgrade()
+        self.assertEqual("1", mock_upgrade.call_args[1]["_env"]["STAGED"])
+        self.assertNotIn("staged", self.bundle.model.db)
 
-        def resp(code=200, data=None):
-            self.assertEqual(400, code)
-            self.assertEqual(data,
-                             {"message": "Cannot update the package list."})
-        self.bundle.get_check(message=message, response=resp, test=True)
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__image_disk(self, mock_reboot, mock_sleep):
+        """
+        upgrade: stream the image to disk, then install it
+        """
+        self.start_repo(b"firmware")
+        output = "%s/data/stage/output" % dirpath
+        job = Job(1, "upgrade", None)
+        with patch.dict(self.bundle.profile,
+                        {"upgrade_firmware": upgrade_sh}), \
+                patch.dict(os.environ, {"UPGRADEHFM_OUTPUT": output}):
+            self.bundle.upgrade(job)
 
-    @patch.object(Firmware, 'check')
-    def test__get_check__unknown_error(self, mock_check):
+        self.assertEqual(jobs.REBOOTING, job.state)
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        with open(output, "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+        # kept as the base of the next delta
+        with open("%s/data/INSTALLED_FIRMWARE" % dirpath, "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__image_pipe(self, mock_reboot, mock_sleep):
         """
-        get (/system/firmware/check): unknown error
+        upgrade: stream the image to the installer directly
         """
-        mock_check.side_effect = Exception("Unknown error.")
-        message = Message({"data": {}, "query": {}, "param": {}})
+        self.start_repo(b"firmware")
+        self.unpublish()
+        os.makedirs("%s/data/stage" % dirpath)
+        output = "%s/data/stage/output" % dirpath
+        with patch.dict(self.bundle.profile,
+                        {"upgrade_firmware": upgrade_sh,
+                         "image_install": {"mar2000": "pipe"}}), \
+                patch.dict(os.environ, {"UPGRADEHFM_OUTPUT": output}), \
+                patch("firmware.iter_chunks",
+                      wraps=firmware.iter_chunks) as mock_iter_chunks:
+            self.bundle.upgrade()
 
-        def resp(code=200, data=None):
-            self.assertEqual(400, code)
-            self.assertEqual(data, {"message": "Unknown error."})
-        self.bundle.get_check(message=message, response=resp, test=True)
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        self.assertNotIn("staged", self.bundle.model.db)
+        self.assertFalse(os.path.exists(
+            "%s/data/stage/LATEST_FIRMWARE" % dirpath))
+        self.assertEqual(1, mock_iter_chunks.call_count)
+        with open(output, "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+        self.assertFalse(self.bundle.model.db["verification"]["verified"])
 
-    @patch.object(Firmware, 'check')
-    def test__get_check(self, mock_check):
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__image_pipe_compressed(self, mock_reboot, mock_sleep):
         """
-        get (/system/firmware/check)
+        upgrade: decompress the image streamed to the installer
         """
-        def mock_check():
-            check = dict()
-            check["current"] = "1.0.0"
-            check["candidate"] = "1.1.0"
-            check["isLatest"] = 0
-            return check
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(b"firmware")
+        self.start_repo(buf.getvalue())
+        self.unpublish()
+        os.makedirs("%s/data/stage" % dirpath)
+        output = "%s/data/stage/output" % dirpath
+        with patch.dict(self.bundle.profile,
+                        {"upgrade_firmware": upgrade_sh,
+                         "image_install": {"mar2000": "pipe"}}), \
+                patch.dict(os.environ, {"UPGRADEHFM_OUTPUT": output}):
+            self.bundle.upgrade()
 
-        mock_check.side_effect = mock_check
-        message = Message({"data": {}, "query": {}, "param": {}})
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        with open(output, "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+        compression = self.bundle.model.db["compression"]
+        self.assertEqual("gzip", compression["method"])
+        self.assertEqual(8, compression["bytes"])
+        self.assertEqual(len(buf.getvalue()), compression["compressedBytes"])
 
-        def resp(code=200, data=None):
-            self.assertEqual(200, code)
-        self.bundle.get_check(message=message, response=resp, test=True)
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__image_pipe_corrupted(self, mock_reboot, mock_sleep):
+        """
+        upgrade: a corrupted image is never streamed to the installer
+        """
+        self.start_repo(b"corrupted")
+        job = Job(1, "upgrade", None)
+        with patch.dict(self.bundle.profile,
+                        {"upgrade_firmware": upgrade_sh,
+                         "image_install": {"mar2000": "pipe"}}), \
+                patch("firmware.sh.sh") as mock_upgrade:
+            self.bundle.upgrade(job)
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertNotIn("upgrading", self.bundle.model.db)
+        self.assertEqual(0, mock_upgrade.call_count)
+        self.assertEqual(0, mock_reboot.call_count)
 
-    def test__put__no_data(self):
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__image_download_failed(self, mock_reboot, mock_sleep):
         """
-        put (/system/firmware): no data attribute
+        upgrade: nothing is touched if the image cannot be downloaded
         """
-        msg = {
-            "id": 12345,
-            "method": "put",
-            "resource": "/system/firmware"
-        }
+        self.start_repo(b"corrupted")
+        job = Job(1, "upgrade", None)
+        with patch.dict(self.bundle.profile, {"upgrade_firmware": upgrade_sh}):
+            self.bundle.upgrade(job)
 
-        def resp(code=200, data=None):
-            self.assertEqual(400, code)
-            self.assertEqual(data, {"message": "Invalid Input."})
-        message = Message(msg)
-        self.bundle.put(message, response=resp, test=True)
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertNotIn("upgrading", self.bundle.model.db)
+        self.assertEqual(0, mock_reboot.call_count)
+        self.assertEqual(0, self.bundle.publish.put.call_count)
 
-    def test__put__empty_data(self):
+    def test__image_install_mode(self):
         """
-        put (/system/firmware): data dict is empty
+        image_install_mode: per product, None if the image is ready
         """
-        msg = {
-            "id": 12345,
-            "method": "put",
-            "resource": "/system/firmware"
-        }
+        with patch.dict(self.bundle.profile, {"upgrade_firmware": upgrade_sh}):
+            self.assertEqual("disk", self.bundle.image_install_mode())
+            with patch.object(Firmware, "product_family",
+                              return_value="uc8100"):
+                self.assertIsNone(self.bundle.image_install_mode())
 
-        def resp(code=200, data=None):
-            self.assertEqual(400, code)
-            self.assertEqual(data, {"message": "Invalid Input."})
-        msg["data"] = dict()
-        message = Message(msg)
-        self.bundle.put(message, response=resp, test=True)
+            self.bundle.model.db["staged"] = {"type": "image"}
+            self.assertIsNone(self.bundle.image_install_mode())
+            self.bundle.model.db.pop("staged")
 
-    def test__put__no_flag(self):
+            with open("%s/data/LATEST_FIRMWARE" % dirpath, "w") as f:
+                f.write("uploaded")
+            self.addCleanup(os.remove, "%s/data/LATEST_FIRMWARE" % dirpath)
+            self.assertIsNone(self.bundle.image_install_mode())
+
+    def test__init__profile(self):
         """
-        put (/system/firmware): no reset/upgrade/server flag in data dict
+        init: each instance has a profile of its own
         """
-        msg = {
-            "id": 12345,
-            "method": "put",
-            "resource": "/system/firmware",
-            "data": {
-                "test": "test"
-            }
-        }
+        self.bundle.profile["package"] = "other"
+        peer = Firmware(connection=Mockup())
+        self.addCleanup(peer.stop)
+        self.assertNotEqual("other", peer.profile["package"])
+        self.assertNotEqual("other", firmware.profile["package"])
+        # the debug paths are not written to the defaults
+        self.assertEqual("upgrade.sh", os.path.basename(
+            firmware.profile["upgrade_firmware"]))
 
-        def resp(code=200, data=None):
-            self.assertEqual(400, code)
-            self.assertEqual(data, {"message": "Invalid Input."})
-        message = Message(msg)
-        self.bundle.put(message, response=resp, test=True)
+    def test__detect_product(self):
+        """
+        detect_product: detected once by kversion and kept in the model
+        """
+        self.assertEqual("MAR-2000", self.bundle.model.db["product"])
+        self.assertEqual("mar2000", self.bundle.product_family())
+        self.assertEqual("mar2000", self.bundle.script_env()["FAMILY"])
 
-    @patch.object(Firmware, 'setdef')
-    def test__put__setdef(self, mock_sleep):
+        with patch("firmware.sh.kversion") as mock_kversion:
+            self.assertEqual("mar2000", self.bundle.detect_product().family)
+            self.assertEqual(0, mock_kversion.call_count)
+
+        self.bundle.model.db.pop("product")
+        with patch.dict(os.environ, {"KVERSION": "UC-8112-LX"}):
+            self.assertEqual("uc8100", self.bundle.detect_product().family)
+        self.assertEqual("UC-8112", self.bundle.model.db["product"])
+
+    def test__upgrade_script__unknown_product(self):
         """
-        put (/system/firmware): reset to factory default
+        upgrade.sh: fail if the bundle gives no product
         """
-        msg = {
-            "id": 12345,
-            "method": "put",
-            "resource": "/system/firmware",
-            "data": {
-                "reset": 1
-            }
-        }
+        with patch.object(Firmware, "product_family", return_value=None):
+            env = self.bundle.script_env()
+        result = sh.sh(upgrade_sh, _env=env, _ok_code=[1])
+        self.assertIn("FAMILY is not given", result.stderr.decode())
 
-        def resp(code=200, data=None):
-            self.assertEqual(200, code)
-        message = Message(msg)
-        self.bundle.put(message, response=resp, test=True)
+    def test__detect_product__unknown(self):
+        """
+        detect_product: an unknown product has no strategy
+        """
+        self.bundle.model.db.pop("product")
+        with patch.dict(os.environ, {"KVERSION": "XYZ-1000-LX"}):
+            self.assertIsNone(self.bundle.detect_product())
+        self.bundle.strategy = None
+        self.assertIsNone(self.bundle.product_family())
+        self.assertIsNone(self.bundle.image_install_mode())
+        self.assertEqual("", self.bundle.script_env()["FAMILY"])
 
-    def test__put__update_server(self):
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__staged_not_verified(self, mock_reboot, mock_upgrade,
+                                           mock_sleep):
         """
-        put (/system/firmware): update upgrading server
+        upgrade: refuse the staged image which is not verified
         """
-        msg = {
-            "id": 12345,
-            "method": "put",
-            "resource": "/system/firmware",
-            "data": {
-                "server": "firmware.moxa.com"
-            }
-        }
+        self.bundle.model.db["requireVerified"] = True
+        self.bundle.model.db["staged"] = {"type": "image",
+                                          "path": self.staged_image(),
+                                          "size": 8, "verified": False}
+        job = Job(1, "upgrade", None)
+        self.bundle.upgrade(job)
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertEqual("Firmware is not verified.", job.message)
+        self.assertNotIn("upgrading", self.bundle.model.db)
+        self.assertEqual(0, mock_reboot.call_count)
+        self.assertFalse(self.bundle.model.db["verification"]["verified"])
 
-        def resp(code=200, data=None):
-            self.assertEqual(200, code)
-        message = Message(msg)
-        self.bundle.put(message, response=resp, test=True)
-        self.bundle.load(dirpath)
-        self.assertEqual(self.bundle.model.db["server"], "firmware.moxa.com")
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__staged_unverified(self, mock_reboot, mock_upgrade,
+                                         mock_sleep):
+        """
+        upgrade: the staged image follows the same policy as the others
+        """
+        self.bundle.model.db["requireVerified"] = False
+        self.bundle.model.db["staged"] = {"type": "image",
+                                          "path": self.staged_image(),
+                                          "size": 8, "verified": False}
+        job = Job(1, "upgrade", None)
+        self.bundle.upgrade(job)
+        self.assertEqual(jobs.REBOOTING, job.state)
+        self.assertEqual("1", mock_upgrade.call_args[1]["_env"]["STAGED"])
 
-    @patch.object(Firmware, 'upgrade')
-    def test__put__upgrade(self, mock_sleep):
+    def upload_image(self, image, checksum=True, signature=True):
+        path = "%s/data/LATEST_FIRMWARE" % dirpath
+        for ext in ["", ".sha256", ".sig"]:
+            self.addCleanup(
+                lambda ext: os.path.exists(path + ext) and
+                os.remove(path + ext), ext)
+        with open(path, "wb") as f:
+            f.write(image)
+        if checksum:
+            with open(path + ".sha256", "w") as f:
+                f.write(hashlib.sha256(b"firmware").hexdigest())
+        if signature:
+            shutil.copy("%s/mockdata/keys/firmware.sig" % dirpath,
+                        path + ".sig")
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__uploaded(self, mock_reboot, mock_upgrade, mock_sleep):
         """
-        put (/system/firmware): firmware upgrading
+        upgrade: verify the uploaded image
         """
-        msg = {
-            "id": 12345,
-            "method": "put",
-            "resource": "/system/firmware",
-            "data": {
-                "upgrade": 1
-            }
-        }
+        self.upload_image(b"firmware")
+        self.bundle.upgrade()
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        verification = self.bundle.model.db["verification"]
+        self.assertTrue(verification["checksum"])
+        self.assertTrue(verification["signature"])
+        self.assertTrue(verification["verified"])
 
-        def resp(code=200, data=None):
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__uploaded_corrupted(self, mock_reboot, mock_upgrade,
+                                          mock_sleep):
+        """
+        upgrade: refuse the corrupted uploaded image
+        """
+        self.upload_image(b"corrupted")
+        job = Job(1, "upgrade", None)
+        self.bundle.upgrade(job)
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertEqual("Checksum mismatched.", job.message)
+        self.assertEqual(0, mock_upgrade.call_count)
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__uploaded_no_signature(self, mock_reboot, mock_upgrade,
+                                             mock_sleep):
+        """
+        upgrade: refuse the uploaded image without signature if required
+        """
+        self.bundle.model.db["requireVerified"] = True
+        self.upload_image(b"firmware", signature=False)
+        job = Job(1, "upgrade", None)
+        self.bundle.upgrade(job)
+        self.assertEqual("Signature is missing.", job.message)
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__uploaded_no_sidecar(self, mock_reboot, mock_upgrade,
+                                           mock_sleep):
+        """
+        upgrade: the uploaded image without sidecars is allowed by default
+        """
+        self.upload_image(b"firmware", checksum=False, signature=False)
+        self.bundle.upgrade()
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        self.assertFalse(self.bundle.model.db["verification"]["verified"])
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__uploaded_unverified(self, mock_reboot, mock_upgrade,
+                                           mock_sleep):
+        """
+        upgrade: unverified image is allowed if not required
+        """
+        self.upload_image(b"firmware", checksum=False, signature=False)
+        self.bundle.public_key = None
+        self.bundle.model.db["requireVerified"] = False
+        self.bundle.upgrade()
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        self.assertFalse(self.bundle.model.db["verification"]["verified"])
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__image_pipe_published(self, mock_reboot,
+                                            mock_sleep):
+        """
+        upgrade: stage and verify a published image before installing it
+        """
+        self.start_repo(b"firmware")
+        os.makedirs("%s/data/stage" % dirpath)
+        output = "%s/data/stage/output" % dirpath
+        with patch.dict(self.bundle.profile,
+                        {"upgrade_firmware": upgrade_sh,
+                         "image_install": {"mar2000": "pipe"}}), \
+                patch.dict(os.environ, {"UPGRADEHFM_OUTPUT": output}):
+            self.bundle.upgrade()
+        self.assertEqual(0, self.bundle.model.db["upgrading"])
+        self.assertTrue(self.bundle.model.db["verification"]["verified"])
+        with open(output, "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+
+    def unpublish(self):
+        """
+        Nothing to verify the image by, and not required.
+        """
+        for ext in [".sha256", ".sig"]:
+            os.remove("%s/data/repo/LATEST_FIRMWARE%s" % (dirpath, ext))
+        self.bundle.public_key = None
+        self.bundle.model.db["requireVerified"] = False
+
+    def start_repo(self, image):
+        os.makedirs("%s/data/repo" % dirpath)
+        with open("%s/data/repo/LATEST_FIRMWARE" % dirpath, "wb") as f:
+            f.write(image)
+        with open("%s/data/repo/LATEST_FIRMWARE.sha256" % dirpath, "w") as f:
+            f.write(hashlib.sha256(b"firmware").hexdigest())
+        shutil.copy("%s/mockdata/keys/firmware.sig" % dirpath,
+                    "%s/data/repo/LATEST_FIRMWARE.sig" % dirpath)
+        server = LocalServer("%s/data/repo" % dirpath).start()
+        self.addCleanup(server.stop)
+        self.bundle.model.db["server"] = server.url[len("http://"):]
+        return server
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image(self, mock_family):
+        """
+        stage: download and verify the firmware image
+        """
+        mock_family.return_value = "mar2000"
+        self.start_repo(b"firmware")
+        job = Job(1, "stage", None)
+
+        self.bundle.stage(job)
+        staged = self.bundle.model.db["staged"]
+        self.assertEqual("image", staged["type"])
+        self.assertEqual(8, staged["size"])
+        self.assertTrue(staged["verified"])
+        with open(staged["path"], "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+        self.assertEqual(jobs.DONE, job.state)
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_peer(self, mock_family):
+        """
+        stage: one gateway downloads the image for the others of the site
+        """
+        mock_family.return_value = "mar2000"
+        upstream = self.start_repo(b"firmware")
+        upstream_server = self.bundle.model.db["server"]
+        self.bundle.model.db["peerCache"] = {"enabled": True, "port": 0}
+        self.bundle.serve_peers()
+        self.bundle.stage()
+        self.assertEqual(1, self.bundle.peer_server.stats()["artifacts"])
+
+        # another gateway of the site
+        peer = Firmware(connection=Mockup())
+        peer.publish = MagicMock()
+        self.addCleanup(peer.stop)
+        peer.model.db["server"] = "127.0.0.1:%d" % \
+            self.bundle.peer_server.port
+        peer.model.db["upstreamServer"] = upstream_server
+        fetched = len(upstream.requests)
+        with patch.dict(peer.profile,
+                        {"stage_dir": "%s/data/stage/peer" % dirpath}):
+            peer.stage()
+            staged = peer.model.db["staged"]
+            self.assertTrue(staged["verified"])
+            self.assertEqual(peer.model.db["server"], staged["source"])
+            self.assertEqual(fetched, len(upstream.requests))
+            self.assertEqual(3, self.bundle.peer_server.stats()["hits"])
+
+            # the peer is gone, fall back to the upstream server
+            self.bundle.stop()
+            peer.stage()
+            staged = peer.model.db["staged"]
+            self.assertTrue(staged["verified"])
+            self.assertEqual(upstream_server, staged["source"])
+            self.assertIn("/LATEST_FIRMWARE",
+                          [path for path, _ in upstream.requests[fetched:]])
+
+    def test__put__peer_cache(self):
+        """
+        put (/system/firmware): serve the cached images to the peers
+        """
+        msg = {"id": 12345, "method": "put", "resource": "/system/firmware",
+               "data": {"peerCache": {"enabled": True, "port": 0,
+                                      "maxAge": 60},
+                        "upstreamServer": "www.moxa.com"}}
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        self.bundle.put(Message(msg), response=resp, test=True)
+        self.assertEqual(60, self.bundle.peer_cache.max_age)
+        self.assertEqual("www.moxa.com",
+                         self.bundle.model.db["upstreamServer"])
+
+        def resp_get(code=200, data=None):
+            self.assertEqual(0, data["peerCacheStats"]["hits"])
+        self.bundle.get(Message({"id": 1, "method": "get",
+                                 "resource": "/system/firmware"}),
+                        response=resp_get, test=True)
+
+        msg["data"] = {"peerCache": {"enabled": False}}
+        self.bundle.put(Message(msg), response=resp, test=True)
+        self.assertIsNone(self.bundle.peer_server)
+        self.assertEqual(60, self.bundle.model.db["peerCache"]["maxAge"])
+
+        def resp_invalid(code=200, data=None):
+            self.assertEqual(400, code)
+        for config in [{"enabled": 1}, {"port": 70000}, {"maxAge": -1},
+                       {"size": 1}, []]:
+            msg["data"] = {"peerCache": config}
+            self.bundle.put(Message(msg), response=resp_invalid, test=True)
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_compressed(self, mock_family):
+        """
+        stage: decompress the image while it is downloaded
+        """
+        mock_family.return_value = "mar2000"
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(b"firmware")
+        self.start_repo(buf.getvalue())
+
+        self.bundle.stage()
+        staged = self.bundle.model.db["staged"]
+        self.assertTrue(staged["verified"])
+        self.assertEqual(8, staged["size"])
+        self.assertEqual("gzip", staged["compression"]["method"])
+        with open(staged["path"], "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_resume(self, mock_family):
+        """
+        stage: resume the interrupted staging
+        """
+        mock_family.return_value = "mar2000"
+        server = self.start_repo(b"firmware")
+        os.makedirs("%s/data/stage" % dirpath)
+        with open("%s/data/stage/LATEST_FIRMWARE.part" % dirpath, "wb") as f:
+            f.write(b"firm")
+
+        self.bundle.stage()
+        self.assertTrue(self.bundle.model.db["staged"]["verified"])
+        self.assertEqual("bytes=4-", server.requests[0][1].get("range"))
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_checksum_mismatched(self, mock_family):
+        """
+        stage: the downloaded image is corrupted
+        """
+        mock_family.return_value = "mar2000"
+        self.start_repo(b"corrupted")
+
+        with self.assertRaises(IOError):
+            self.bundle.stage()
+        self.assertNotIn("staged", self.bundle.model.db)
+        self.assertFalse(os.path.exists(
+            "%s/data/stage/LATEST_FIRMWARE" % dirpath))
+
+    def start_delta_repo(self, installed=None):
+        """
+        Serve the target image and its delta from the installed image.
+        """
+        source, target = make_images()
+        server = self.start_repo(target)
+        with open("%s/data/INSTALLED_FIRMWARE" % dirpath, "wb") as f:
+            f.write(installed or source)
+        with open("%s/data/repo/LATEST_FIRMWARE.from-1.0.0.delta" % dirpath,
+                  "wb") as f:
+            make_delta(source, target, f)
+        with open("%s/data/repo/LATEST_FIRMWARE.sha256" % dirpath, "w") as f:
+            f.write(hashlib.sha256(target).hexdigest())
+        self.bundle.public_key = None
+        return (server, target)
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_delta(self, mock_family):
+        """
+        stage: rebuild the image from the installed image and delta
+        """
+        mock_family.return_value = "mar2000"
+        server, target = self.start_delta_repo()
+
+        self.bundle.stage()
+        staged = self.bundle.model.db["staged"]
+        self.assertTrue(staged["verified"])
+        self.assertEqual("1.0.0", staged["delta"]["from"])
+        self.assertEqual(len(target) - staged["delta"]["size"],
+                         staged["delta"]["bytesSaved"])
+        self.assertTrue(staged["delta"]["bytesSaved"] > len(target) / 2)
+        with open(staged["path"], "rb") as f:
+            self.assertEqual(target, f.read())
+        self.assertNotIn("/LATEST_FIRMWARE",
+                         [path for path, _ in server.requests])
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_delta_mismatched(self, mock_family):
+        """
+        stage: download the full image if the installed image is modified
+        """
+        mock_family.return_value = "mar2000"
+        server, target = self.start_delta_repo(installed=b"\0" * 64 * 1024)
+
+        self.bundle.stage()
+        staged = self.bundle.model.db["staged"]
+        self.assertNotIn("delta", staged)
+        self.assertTrue(staged["verified"])
+        with open(staged["path"], "rb") as f:
+            self.assertEqual(target, f.read())
+        self.assertIn("/LATEST_FIRMWARE",
+                      [path for path, _ in server.requests])
+        self.assertFalse(os.path.exists(staged["path"] + ".part"))
+
+    @patch.object(Firmware, "product_family")
+    def test__stage__image_no_delta(self, mock_family):
+        """
+        stage: download the full image if no delta is published
+        """
+        mock_family.return_value = "mar2000"
+        server, target = self.start_delta_repo()
+        os.remove("%s/data/repo/LATEST_FIRMWARE.from-1.0.0.delta" % dirpath)
+
+        self.bundle.stage()
+        self.assertNotIn("delta", self.bundle.model.db["staged"])
+        with open(self.bundle.model.db["staged"]["path"], "rb") as f:
+            self.assertEqual(target, f.read())
+
+    @patch("firmware.sh.sh")
+    @patch.object(Firmware, "product_family")
+    def test__stage__package(self, mock_family, mock_sh):
+        """
+        stage: download the packages only
+        """
+        mock_family.return_value = "uc8100"
+        self.bundle.stage()
+        self.assertEqual("stage", mock_sh.call_args[0][1])
+        self.assertEqual("package", self.bundle.model.db["staged"]["type"])
+
+    @patch("firmware.sh.sh")
+    @patch.object(Firmware, "product_family")
+    def test__stage__package_failed(self, mock_family, mock_sh):
+        """
+        stage: failed to download the packages
+        """
+        mock_family.return_value = "uc8100"
+        mock_sh.side_effect = Exception("error")
+        with self.assertRaises(IOError):
+            self.bundle.stage()
+        self.assertNotIn("staged", self.bundle.model.db)
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__reboot_failed(self, mock_reboot, mock_upgrade,
+                                     mock_sleep):
+        """
+        upgrade: release the lock if the device cannot reboot
+        """
+        self.bundle.strategy = product.lookup("uc8100")
+        mock_reboot.side_effect = Exception("error")
+        self.bundle.operation.acquire("upgrade")
+        job = self.bundle.submit_operation("upgrade", self.bundle.upgrade)
+        self.bundle.jobs.stop()
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertEqual("Cannot reboot: error", job.message)
+        self.assertIsNone(self.bundle.operation.holder)
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__rebooting(self, mock_reboot, mock_upgrade,
+                                 mock_sleep):
+        """
+        upgrade: keep the lock while the device is rebooting
+        """
+        self.bundle.strategy = product.lookup("uc8100")
+        self.bundle.operation.acquire("upgrade")
+        job = self.bundle.submit_operation("upgrade", self.bundle.upgrade)
+        self.bundle.jobs.stop()
+        self.assertEqual(jobs.REBOOTING, job.state)
+        self.assertEqual("upgrade", self.bundle.operation.holder["type"])
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.setdef")
+    @patch("firmware.sh.reboot")
+    def test__setdef(self, mock_reboot, mock_setdef, mock_sleep):
+        """
+        setdef: success
+        """
+        self.assertTrue(self.bundle.setdef())
+        self.assertEqual(0, self.bundle.model.db["defaulting"])
+        # the remote bridge is enabled again before rebooting
+        self.assertEqual([0, 1], [h["enable"] for h in
+                                  self.bundle.model.db["remoteHandshakes"]])
+
+    @patch("firmware.sh.setdef")
+    @patch("firmware.sh.reboot")
+    def test__setdef__reboot_failed(self, mock_reboot, mock_setdef):
+        """
+        setdef: the reset is recorded once if the device cannot reboot
+        """
+        mock_reboot.side_effect = Exception("error")
+        self.assertFalse(self.bundle.setdef())
+        self.assertEqual(0, self.bundle.model.db["defaulting"])
+        self.assertEqual(["success"], [r["outcome"] for r in
+                                       self.bundle.history.records()])
+
+    @patch("firmware.sh.setdef")
+    @patch("firmware.sh.reboot")
+    def test__put__reset_reboot_failed(self, mock_reboot, mock_setdef):
+        """
+        put (/system/firmware): release the lock if the reset cannot reboot
+        """
+        mock_reboot.side_effect = Exception("error")
+        self.assertEqual(200, self.put_operation({"reset": 1})["code"])
+        self.assertIsNone(self.bundle.operation.holder)
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.setdef")
+    def test__setdef__failed(self, mock_setdef, mock_sleep):
+        """
+        setdef: failed
+        """
+        mock_setdef.side_effect = Exception("error")
+
+        self.bundle.setdef()
+        self.assertEqual(-1, self.bundle.model.db["defaulting"])
+        # the remote bridge is enabled again
+        self.assertEqual([0, 1], [h["enable"] for h in
+                                  self.bundle.model.db["remoteHandshakes"]])
+
+    @patch("firmware.sh.setdef")
+    @patch("firmware.sh.reboot")
+    def test__setdef__history(self, mock_reboot, mock_setdef):
+        """
+        setdef: the reset is recorded
+        """
+        self.bundle.setdef()
+        mock_setdef.side_effect = Exception("error")
+        self.bundle.setdef()
+        self.assertEqual(
+            [("reset", "failed", "1.0.0"), ("reset", "success", "1.0.0")],
+            [(r["type"], r["outcome"], r["from"])
+             for r in self.bundle.history.records()])
+
+    def make_config(self):
+        config = "%s/data/config/dns/data" % dirpath
+        os.makedirs(config)
+        for name, data in [("dns.json.factory", "{}"),
+                           ("dns.json", '{"servers": ["8.8.8.8"]}')]:
+            with open("%s/%s" % (config, name), "w") as f:
+                f.write(data)
+        return "%s/dns.json" % config
+
+    @patch("firmware.sh.setdef")
+    @patch("firmware.sh.reboot")
+    def test__setdef__selective(self, mock_reboot, mock_setdef):
+        """
+        setdef: restore the changed configuration files only
+        """
+        path = self.make_config()
+        self.bundle.setdef(selective=True)
+        self.assertEqual(0, self.bundle.model.db["defaulting"])
+        self.assertEqual(0, mock_setdef.call_count)
+        self.assertEqual(1, mock_reboot.call_count)
+        with open(path) as f:
+            self.assertEqual("{}", f.read())
+        self.assertEqual(
+            1, self.bundle.metrics.to_dict()["counters"]["setdef.restored"])
+
+    @patch("firmware.sh.reboot")
+    def test__setdef__selective_model(self, mock_reboot):
+        """
+        setdef: the model is read back if restored
+        """
+        self.bundle.model.db["server"] = "changed"
+        self.bundle.save()
+        # the bundle is "tests", its model tests/data/firmware.json
+        with patch.dict(self.bundle.profile,
+                        {"config_root": os.path.dirname(dirpath)}):
+            self.bundle.setdef(selective=True)
+        self.assertEqual("factory", self.bundle.model.db["server"])
+        self.assertEqual(0, self.bundle.model.db["defaulting"])
+
+    @patch("firmware.sh.reboot")
+    def test__setdef__selective_failed(self, mock_reboot):
+        """
+        setdef: the selective reset failed
+        """
+        self.make_config()
+        with patch("firmware.factory.restore",
+                   side_effect=IOError("disk full")):
+            self.bundle.setdef(selective=True)
+        self.assertEqual(-1, self.bundle.model.db["defaulting"])
+        self.assertEqual(0, mock_reboot.call_count)
+
+    def test__get_reset(self):
+        """
+        get (/system/firmware/reset): dry run of the selective reset
+        """
+        path = self.make_config()
+        message = Message({"data": {}, "query": {}, "param": {}})
+        result = {}
+
+        def resp(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        self.bundle.get_reset(message=message, response=resp, test=True)
+        self.assertEqual(200, result["code"])
+        self.assertEqual(
+            {"changes": [{"path": "dns/data/dns.json", "action": "restore",
+                          "bytes": 2}],
+             "unchanged": 0, "bytes": 2}, result["data"])
+        # nothing is changed
+        with open(path) as f:
+            self.assertEqual('{"servers": ["8.8.8.8"]}', f.read())
+        self.assertFalse(os.path.exists(
+            self.bundle.profile["factory_manifest"]))
+
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__history(self, mock_reboot, mock_upgrade):
+        """
+        upgrade: recorded after rebooting with the new version
+        """
+        self.bundle.model.db["staged"] = {"type": "package",
+                                          "package": "mxcloud-cg",
+                                          "verified": True}
+        self.bundle.upgrade()
+        self.assertEqual([], self.bundle.history.records())
+        attempt = self.bundle.model.db["upgradeAttempt"]
+        self.assertEqual("success", attempt["outcome"])
+        self.assertIn("install", attempt["durations"])
+
+        # rebooted
+        self.bundle.model.db["version"] = "1.1.0"
+        self.bundle.run()
+        record = self.bundle.history.records()[0]
+        self.assertEqual(("upgrade", "success", "1.0.0", "1.1.0"),
+                         (record["type"], record["outcome"], record["from"],
+                          record["to"]))
+        self.assertGreaterEqual(record["durations"]["reboot"], 0)
+        self.assertNotIn("upgradeAttempt", self.bundle.model.db)
+
+    def test__run__interrupted_upgrade(self):
+        """
+        run: the upgrade never finished
+        """
+        self.bundle.model.db["upgrading"] = 1
+        self.bundle.model.db["upgradeAttempt"] = {"timestamp": 1500000000,
+                                                  "from": "1.0.0"}
+        self.bundle.run()
+        self.assertEqual("interrupted",
+                         self.bundle.history.records()[0]["outcome"])
+
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__history_refused(self, mock_reboot, mock_upgrade):
+        """
+        upgrade: the refused upgrade is recorded right away
+        """
+        self.bundle.model.db["requireVerified"] = True
+        self.bundle.model.db["staged"] = {"type": "package",
+                                          "package": "mxcloud-cg",
+                                          "verified": False}
+        self.bundle.upgrade()
+        record = self.bundle.history.records()[0]
+        self.assertEqual(("upgrade", "failed", ""),
+                         (record["type"], record["outcome"], record["to"]))
+
+    def get_history(self, query):
+        message = Message({"data": {}, "query": query, "param": {}})
+        result = {}
+
+        def resp(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        self.bundle.get_history(message=message, response=resp, test=True)
+        return result
+
+    def test__get_history(self):
+        """
+        get (/system/firmware/history): pagination and filters
+        """
+        for i in range(5):
+            self.bundle.history.append(
+                "upgrade", ["success", "failed"][i % 2], 1500000000 + i,
+                "1.0.0", "1.1.0")
+        result = self.get_history({})
+        self.assertEqual(200, result["code"])
+        self.assertEqual(5, result["data"]["total"])
+        self.assertEqual([5, 4, 3, 2, 1],
+                         [r["id"] for r in result["data"]["items"]])
+
+        result = self.get_history({"page": "2", "perPage": "2"})
+        self.assertEqual([3, 2], [r["id"] for r in result["data"]["items"]])
+        self.assertEqual(2, result["data"]["page"])
+
+        result = self.get_history({"outcome": "failed", "type": "upgrade",
+                                   "since": "1500000002"})
+        self.assertEqual([4], [r["id"] for r in result["data"]["items"]])
+
+    def test__get_history__invalid(self):
+        """
+        get (/system/firmware/history): invalid query
+        """
+        for query in [{"page": "0"}, {"perPage": "1000"}, {"page": "a"},
+                      {"type": "downgrade"}, {"outcome": "ok"},
+                      {"since": "yesterday"}]:
+            self.assertEqual(400, self.get_history(query)["code"])
+
+    def get_metrics(self, query):
+        message = Message({"data": {}, "query": query, "param": {}})
+        result = {}
+
+        def resp(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        self.bundle.get_metrics(message=message, response=resp, test=True)
+        return result
+
+    def test__get_metrics(self):
+        """
+        get (/system/firmware/metrics): routes and checks are timed
+        """
+        self.bundle.metrics.reset()
+        self.get_history({})
+        self.bundle.metrics.inc("check.success")
+        result = self.get_metrics({})
+        self.assertEqual(200, result["code"])
+        self.assertTrue(result["data"]["enabled"])
+        self.assertEqual({"check.success": 1}, result["data"]["counters"])
+        self.assertEqual(
+            1, result["data"]["histograms"]["route.get_history"]["count"])
+
+        result = self.get_metrics({"format": "prometheus"})
+        self.assertEqual("prometheus", result["data"]["format"])
+        self.assertIn("sanji_firmware_check_success_total 1",
+                      result["data"]["text"])
+
+    def test__put__metrics_enabled(self):
+        """
+        put (/system/firmware): disable the instrumentation
+        """
+        message = Message({"data": {"metricsEnabled": False}, "query": {},
+                           "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        self.bundle.put(message=message, response=resp, test=True)
+        self.assertFalse(self.bundle.model.db["metricsEnabled"])
+        self.bundle.metrics.reset()
+        self.get_history({})
+        self.assertEqual({}, self.get_metrics({})["data"]["histograms"])
+
+        message = Message({"data": {"metricsEnabled": "no"}, "query": {},
+                           "param": {}})
+
+        def resp_invalid(code=200, data=None):
+            self.assertEqual(400, code)
+        self.bundle.put(message=message, response=resp_invalid, test=True)
+
+    def test__put__require_verified(self):
+        """
+        put (/system/firmware): refuse the unverified images
+        """
+        message = Message({"data": {"requireVerified": True}, "query": {},
+                           "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        self.bundle.put(message=message, response=resp, test=True)
+        self.assertTrue(self.bundle.verification_required())
+
+        message = Message({"data": {"requireVerified": 0}, "query": {},
+                           "param": {}})
+
+        def resp_invalid(code=200, data=None):
+            self.assertEqual(400, code)
+        self.bundle.put(message=message, response=resp_invalid, test=True)
+        self.assertTrue(self.bundle.model.db["requireVerified"])
+
+    def test__set_remote(self):
+        """
+        set_remote: acknowledged by the remote bridge
+        """
+        self.bundle.publish.put.return_value = MagicMock(code=200)
+        self.assertTrue(self.bundle.set_remote(0))
+        self.bundle.publish.put.assert_called_once_with(
+            "/system/remote", data={"enable": 0},
+            timeout=firmware.REMOTE_TIMEOUT)
+        handshake = self.bundle.model.db["remoteHandshakes"][-1]
+        self.assertEqual(0, handshake["enable"])
+        self.assertTrue(handshake["acked"])
+        self.assertTrue(0 <= handshake["seconds"] < 1)
+
+    def test__set_remote__refused(self):
+        """
+        set_remote: the remote bridge responded an error
+        """
+        self.bundle.publish.put.return_value = MagicMock(code=400)
+        self.assertFalse(self.bundle.set_remote(1))
+        self.assertFalse(self.bundle.model.db["remoteHandshakes"][-1]["acked"])
+
+    def test__set_remote__timeout(self):
+        """
+        set_remote: the remote bridge did not respond in time
+        """
+        self.bundle.publish.put.side_effect = TimeoutError("timeout")
+        self.assertFalse(self.bundle.set_remote(0))
+        self.assertFalse(self.bundle.model.db["remoteHandshakes"][-1]["acked"])
+
+    def test__set_remote__history(self):
+        """
+        set_remote: only the latest handshakes are kept
+        """
+        self.bundle.publish.put.return_value = MagicMock(code=200)
+        for i in range(firmware.REMOTE_HANDSHAKES + 5):
+            self.bundle.set_remote(i % 2)
+        self.assertEqual(firmware.REMOTE_HANDSHAKES,
+                         len(self.bundle.model.db["remoteHandshakes"]))
+
+    @patch("firmware.time.sleep")
+    @patch("firmware.sh.sh")
+    @patch("firmware.sh.reboot")
+    def test__upgrade__remote_handshake(self, mock_reboot, mock_upgrade,
+                                        mock_sleep):
+        """
+        upgrade: no fixed sleep around the remote bridge handshakes
+        """
+        self.bundle.strategy = product.lookup("uc8100")
+        self.bundle.publish.put.return_value = MagicMock(code=200)
+        self.bundle.upgrade()
+        self.assertEqual(0, mock_sleep.call_count)
+        handshakes = self.bundle.model.db["remoteHandshakes"]
+        self.assertEqual([0, 1], [h["enable"] for h in handshakes])
+        self.assertTrue(all([h["acked"] for h in handshakes]))
+        self.bundle.load(dirpath)
+        self.assertEqual(2, len(self.bundle.model.db["remoteHandshakes"]))
+
+    def test__get(self):
+        """
+        get (/system/firmware)
+        """
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual("1.0.0", data["version"])
+        self.bundle.get(message=message, response=resp, test=True)
+
+    def test__get__cached_version(self):
+        """
+        get (/system/firmware): version is resolved once at init
+        """
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual("1.0.0", data["version"])
+        with patch.object(Firmware, "read_version") as mock_read_version:
+            self.bundle.get(message=message, response=resp, test=True)
+            self.bundle.get(message=message, response=resp, test=True)
+            self.assertEqual(0, mock_read_version.call_count)
+
+    def test__get__version_file_changed(self):
+        """
+        get (/system/firmware): resolve the version if the file is changed
+        """
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual("1.1.0", data["version"])
+        self.bundle.version_sig = (0, 0)
+        with patch.object(Firmware, "read_version") as mock_read_version:
+            mock_read_version.return_value = "1.1.0"
+            self.bundle.get(message=message, response=resp, test=True)
+            self.assertEqual(1, mock_read_version.call_count)
+
+    @patch.object(Firmware, 'check')
+    def test__get_check__update_failed(self, mock_check):
+        """
+        get (/system/firmware/check): update failed
+        """
+        mock_check.side_effect = Exception("Cannot update the package list.")
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+            self.assertEqual(data,
+                             {"message": "Cannot update the package list."})
+        self.bundle.get_check(message=message, response=resp, test=True)
+
+    @patch("firmware.sh.apt_get")
+    def test__get_check__update_timeout(self, mock_apt_get):
+        """
+        get (/system/firmware/check): the hung apt-get update is killed
+        """
+        mock_apt_get.side_effect = lambda *args, **kwargs: \
+            sh.sleep("10", _bg=True, _timeout=kwargs["_timeout"])
+        message = Message({"data": {}, "query": {"force": "1"},
+                           "param": {}})
+        result = {}
+
+        def resp(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        with patch.dict(firmware.COMMAND_TIMEOUTS, {"apt-get": 0.2}):
+            self.bundle.get_check(message=message, response=resp, test=True)
+        self.assertEqual(400, result["code"])
+        self.assertEqual({"message": "Updating the package list timed out."},
+                         result["data"])
+        # not retried after dpkg --configure
+        self.assertEqual(1, mock_apt_get.call_count)
+        self.assertEqual(1, self.bundle.executor.stats()["timeouts"])
+
+    @patch.object(Firmware, 'check')
+    def test__get_check__unknown_error(self, mock_check):
+        """
+        get (/system/firmware/check): unknown error
+        """
+        mock_check.side_effect = Exception("Unknown error.")
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+            self.assertEqual(data, {"message": "Unknown error."})
+        self.bundle.get_check(message=message, response=resp, test=True)
+
+    @patch.object(Firmware, 'check')
+    def test__get_check(self, mock_check):
+        """
+        get (/system/firmware/check)
+        """
+        def mock_check():
+            check = dict()
+            check["current"] = "1.0.0"
+            check["candidate"] = "1.1.0"
+            check["isLatest"] = 0
+            return check
+
+        mock_check.side_effect = mock_check
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        self.bundle.get_check(message=message, response=resp, test=True)
+
+    @patch.object(Firmware, 'check')
+    def test__get_check__cached(self, mock_check):
+        """
+        get (/system/firmware/check): answer from the cached result
+        """
+        mock_check.return_value = {"isLatest": 1}
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual(1, data["isLatest"])
+            self.assertEqual(0, data["age"])
+        self.bundle.get_check(message=message, response=resp, test=True)
+        self.bundle.get_check(message=message, response=resp, test=True)
+        self.assertEqual(1, mock_check.call_count)
+
+    @patch.object(Firmware, 'check')
+    def test__get_check__force(self, mock_check):
+        """
+        get (/system/firmware/check): force to check again
+        """
+        mock_check.return_value = {"isLatest": 1}
+        message = Message({"data": {}, "query": {"force": "1"}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        self.bundle.get_check(message=message, response=resp, test=True)
+        self.bundle.get_check(message=message, response=resp, test=True)
+        self.assertEqual(2, mock_check.call_count)
+
+    @patch.object(Firmware, 'check')
+    def test__get_check__coalesced(self, mock_check):
+        """
+        get (/system/firmware/check): concurrent checks share one run
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_check():
+            started.set()
+            release.wait()
+            return {"isLatest": 1}
+
+        mock_check.side_effect = slow_check
+        message = Message({"data": {}, "query": {"force": "1"}, "param": {}})
+        results = []
+
+        def resp(code=200, data=None):
+            results.append(data)
+
+        def get_check():
+            self.bundle.get_check(message=message, response=resp, test=True)
+
+        threads = [threading.Thread(target=get_check) for _ in range(3)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while self.bundle.check_flight.stats()["calls"] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, mock_check.call_count)
+        self.assertEqual(3, len(results))
+        self.assertEqual({"calls": 3, "executions": 1, "coalesced": 2},
+                         self.bundle.check_flight.stats())
+
+    def test__put__no_data(self):
+        """
+        put (/system/firmware): no data attribute
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware"
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+            self.assertEqual(data, {"message": "Invalid Input."})
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+
+    def test__put__empty_data(self):
+        """
+        put (/system/firmware): data dict is empty
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware"
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+            self.assertEqual(data, {"message": "Invalid Input."})
+        msg["data"] = dict()
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+
+    def test__put__no_flag(self):
+        """
+        put (/system/firmware): no reset/upgrade/server flag in data dict
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "test": "test"
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+            self.assertEqual(data, {"message": "Invalid Input."})
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+
+    @patch.object(Firmware, 'setdef')
+    def test__put__setdef(self, mock_sleep):
+        """
+        put (/system/firmware): reset to factory default
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "reset": 1
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+
+    def test__put__update_server(self):
+        """
+        put (/system/firmware): update upgrading server
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "server": "firmware.moxa.com"
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+        self.bundle.load(dirpath)
+        self.assertEqual(self.bundle.model.db["server"], "firmware.moxa.com")
+
+    def test__notify_available(self):
+        """
+        notify_available: publish FW_AVAILABLE for a new candidate only
+        """
+        check = {"isLatest": 0, "current": "1.0.0", "candidate": "1.1.0"}
+        self.bundle.notify_available(check)
+        self.bundle.notify_available(check)
+        self.assertEqual(1, self.bundle.publish.event.put.call_count)
+        self.bundle.publish.event.put.assert_called_with(
+            "/system/firmware",
+            data={"code": "FW_AVAILABLE", "type": "event",
+                  "current": "1.0.0", "candidate": "1.1.0"})
+        self.bundle.load(dirpath)
+        self.assertEqual("1.1.0", self.bundle.model.db["candidate"])
+
+        check["candidate"] = "1.2.0"
+        self.bundle.notify_available(check)
+        self.assertEqual(2, self.bundle.publish.event.put.call_count)
+
+    def test__notify_available__latest(self):
+        """
+        notify_available: nothing to notify if it is the latest
+        """
+        self.bundle.notify_available(
+            {"isLatest": 1, "current": "1.1.0", "candidate": "1.1.0"})
+        self.bundle.notify_available(
+            {"isLatest": 0, "current": "(none)", "candidate": "(none)"})
+        self.assertEqual(0, self.bundle.publish.event.put.call_count)
+        self.assertEqual("1.1.0", self.bundle.model.db["candidate"])
+
+    @patch("firmware.sh.apt_get")
+    def test__check_cache__notify(self, mock_apt_get):
+        """
+        check_cache: scheduled checks notify the new candidate
+        """
+        self.bundle.check_cache.get(force=True)
+        self.bundle.publish.event.put.assert_called_with(
+            "/system/firmware",
+            data={"code": "FW_AVAILABLE", "type": "event",
+                  "current": "1.0.0", "candidate": "1.1.0"})
+
+    def test__put__check_policy(self):
+        """
+        put (/system/firmware): update the policy of the cached check
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "checkTtl": 60,
+                "checkInterval": 600
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+        self.assertEqual(60, self.bundle.check_cache.ttl)
+        self.assertEqual(600, self.bundle.check_cache.interval)
+        self.bundle.load(dirpath)
+        self.assertEqual(self.bundle.model.db["checkTtl"], 60)
+        self.assertEqual(self.bundle.model.db["checkInterval"], 600)
+
+    def test__put__check_policy_invalid(self):
+        """
+        put (/system/firmware): invalid policy of the cached check
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "checkTtl": -1
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+            self.assertEqual(data, {"message": "Invalid Input."})
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+
+    def put_upgrade_window(self, window):
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "upgrade": 1,
+                "window": window
+            }
+        }
+        result = {}
+
+        def resp(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        self.bundle.put(Message(msg), response=resp, test=True)
+        return result
+
+    @patch.object(Firmware, "upgrade")
+    def test__put__upgrade_window(self, mock_upgrade):
+        """
+        put (/system/firmware): upgrade inside the rollout window
+        """
+        now = int(time.time())
+        result = self.put_upgrade_window(
+            {"start": now + 3600, "end": now + 7200})
+        self.assertEqual(200, result["code"])
+        planned = result["data"]["plannedAt"]
+        self.assertTrue(now + 3600 <= planned <= now + 7200)
+        self.assertTrue(self.bundle.upgrade_timer.is_alive())
+
+        def resp(code=200, data=None):
+            self.assertEqual(planned,
+                             data["pendingUpgrade"]["plannedAt"])
+        self.bundle.get(Message({"id": 1, "method": "get",
+                                 "resource": "/system/firmware"}),
+                        response=resp, test=True)
+        self.bundle.load(dirpath)
+        self.assertEqual(planned,
+                         self.bundle.model.db["pendingUpgrade"]["plannedAt"])
+        self.assertEqual(0, mock_upgrade.call_count)
+
+    @patch.object(Firmware, "upgrade")
+    def test__put__upgrade_window_fired(self, mock_upgrade):
+        """
+        put (/system/firmware): the pending upgrade is started in time
+        """
+        result = self.put_upgrade_window({"maxDelay": 0})
+        self.assertEqual(200, result["code"])
+        for _ in range(50):
+            if mock_upgrade.call_count:
+                break
+            time.sleep(0.05)
+        self.assertEqual(1, mock_upgrade.call_count)
+        self.assertNotIn("pendingUpgrade", self.bundle.model.db)
+        self.assertEqual("upgrade", self.bundle.jobs.list()[0].type)
+
+    def test__put__upgrade_window_invalid(self):
+        """
+        put (/system/firmware): invalid or closed rollout window
+        """
+        result = self.put_upgrade_window({"slot": "first"})
+        self.assertEqual(400, result["code"])
+        result = self.put_upgrade_window({"end": 1})
+        self.assertEqual(400, result["code"])
+        self.assertEqual("The upgrade window is closed.",
+                         result["data"]["message"])
+        self.assertNotIn("pendingUpgrade", self.bundle.model.db)
+
+    @patch.object(Firmware, "upgrade")
+    def test__put__upgrade_cancel(self, mock_upgrade):
+        """
+        put (/system/firmware): cancel the pending upgrade
+        """
+        self.put_upgrade_window({"start": int(time.time()) + 3600})
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {"upgrade": 0}
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        self.bundle.put(Message(msg), response=resp, test=True)
+        self.assertNotIn("pendingUpgrade", self.bundle.model.db)
+        self.assertIsNone(self.bundle.upgrade_timer)
+
+    def test__run__pending_upgrade(self):
+        """
+        run: restore the pending upgrade after restarted
+        """
+        now = int(time.time())
+        self.bundle.model.db["pendingUpgrade"] = {
+            "window": {"start": now + 60}, "plannedAt": now + 60,
+            "requestedAt": now}
+        self.bundle.run()
+        self.assertTrue(self.bundle.upgrade_timer.is_alive())
+
+    def test__run__pending_upgrade_expired(self):
+        """
+        run: drop the pending upgrade if the window is closed
+        """
+        now = int(time.time())
+        self.bundle.model.db["pendingUpgrade"] = {
+            "window": {"end": now - 60}, "plannedAt": now - 120,
+            "requestedAt": now - 180}
+        self.bundle.run()
+        self.assertIsNone(self.bundle.upgrade_timer)
+        self.assertNotIn("pendingUpgrade", self.bundle.model.db)
+
+    def test__put__check_schedule(self):
+        """
+        put (/system/firmware): update the schedule of the checks
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "checkJitter": 30,
+                "checkBackoffMin": 10,
+                "checkBackoffMax": 120
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+        self.assertEqual(30, self.bundle.check_cache.jitter)
+        self.assertEqual(10, self.bundle.check_cache.backoff_min)
+        self.assertEqual(120, self.bundle.check_cache.backoff_max)
+        self.bundle.load(dirpath)
+        self.assertEqual(self.bundle.model.db["checkJitter"], 30)
+        self.assertEqual(self.bundle.model.db["checkBackoffMax"], 120)
+
+    def test__put__check_schedule_invalid(self):
+        """
+        put (/system/firmware): backoff min is greater than max
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "checkBackoffMin": 7200
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(400, code)
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+        self.assertNotIn("checkBackoffMin", self.bundle.model.db)
+
+    @patch.object(Firmware, 'upgrade')
+    def test__put__upgrade(self, mock_upgrade):
+        """
+        put (/system/firmware): firmware upgrading
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "upgrade": 1
+            }
+        }
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual("upgrade", data["type"])
+            self.assertEqual(jobs.QUEUED, data["state"])
+        message = Message(msg)
+        self.bundle.put(message, response=resp, test=True)
+        self.bundle.jobs.stop()
+        job = self.bundle.jobs.list()[0]
+        mock_upgrade.assert_called_once_with(job)
+
+    def put_operation(self, data):
+        message = Message({"id": 12345, "method": "put",
+                           "resource": "/system/firmware", "data": data})
+        result = {}
+
+        def resp(code=200, data=None):
+            result["code"] = code
+            result["data"] = data
+        self.bundle.put(message, response=resp, test=True)
+        return result
+
+    @patch.object(Firmware, "setdef")
+    def test__put__reset_mode(self, mock_setdef):
+        """
+        put (/system/firmware): reset by the selective mode
+        """
+        self.assertEqual(400, self.put_operation(
+            {"reset": 1, "resetMode": "partial"})["code"])
+        self.assertEqual(0, mock_setdef.call_count)
+
+        self.assertEqual(200, self.put_operation(
+            {"reset": 1, "resetMode": "selective"})["code"])
+        mock_setdef.assert_called_once_with(selective=True)
+
+    @patch.object(Firmware, "setdef")
+    @patch.object(Firmware, "upgrade")
+    def test__put__operation_lock(self, mock_upgrade, mock_setdef):
+        """
+        put (/system/firmware): one operation at a time
+        """
+        running = threading.Event()
+        finish = threading.Event()
+        mock_upgrade.side_effect = \
+            lambda job: running.set() or finish.wait(5)
+
+        result = self.put_operation({"upgrade": 1})
+        job_id = result["data"]["id"]
+        self.assertTrue(running.wait(5))
+
+        # the same request replies the upgrade in progress
+        result = self.put_operation({"upgrade": 1})
+        self.assertEqual(200, result["code"])
+        self.assertEqual(job_id, result["data"]["id"])
+
+        for data in [{"reset": 1}, {"stage": 1},
+                     {"upgrade": 1, "server": "other.moxa.com"}]:
+            result = self.put_operation(data)
+            self.assertEqual(409, result["code"])
+            self.assertEqual("Another operation is in progress.",
+                             result["data"]["message"])
+            self.assertEqual(job_id, result["data"]["operation"]["jobId"])
+        self.assertEqual(0, mock_setdef.call_count)
+        self.assertEqual(1, mock_upgrade.call_count)
+        self.assertEqual("upgrade", self.bundle.model.db["operation"]["type"])
+        self.assertNotEqual("other.moxa.com",
+                            self.bundle.model.db.get("server", None))
+
+        finish.set()
+        self.bundle.jobs.stop()
+        self.assertNotIn("operation", self.bundle.model.db)
+        # the reset is done without rebooting
+        mock_setdef.return_value = False
+        self.assertEqual(200, self.put_operation({"reset": 1})["code"])
+        self.assertEqual(1, mock_setdef.call_count)
+        self.assertNotIn("operation", self.bundle.model.db)
+
+    @patch.object(Firmware, "setdef")
+    def test__put__operation_lock_restored(self, mock_setdef):
+        """
+        put (/system/firmware): the lock survives a restart of the bundle
+        """
+        self.bundle.operation.acquire(
+            "upgrade", {"server": self.bundle.model.db.get("server", None)})
+        self.bundle.operation.update(jobId=1)
+        self.bundle.stop()
+        self.bundle = Firmware(connection=Mockup())
+        self.bundle.publish = MagicMock()
+
+        # the job is gone with the previous process
+        result = self.put_operation({"upgrade": 1})
+        self.assertEqual(200, result["code"])
+        self.assertEqual("upgrade", result["data"]["type"])
+        self.assertEqual(1, result["data"]["jobId"])
+        self.assertEqual(409, self.put_operation({"reset": 1})["code"])
+
+        # the device rebooted
+        with patch("firmware.boot_id", return_value="rebooted"):
+            self.bundle.stop()
+            self.bundle = Firmware(connection=Mockup())
+            self.bundle.publish = MagicMock()
+        self.assertNotIn("operation", self.bundle.model.db)
+        self.assertEqual(200, self.put_operation({"reset": 1})["code"])
+
+    @patch.object(Firmware, "upgrade")
+    def test__start_pending_upgrade__expired(self, mock_upgrade):
+        """
+        start_pending_upgrade: drop it if its window is closed
+        """
+        now = int(time.time())
+        self.bundle.model.db["pendingUpgrade"] = {
+            "window": {"start": now - 120, "end": now - 1},
+            "plannedAt": now - 60, "requestedAt": now - 120}
+        self.bundle.start_pending_upgrade()
+        self.assertNotIn("pendingUpgrade", self.bundle.model.db)
+        self.assertIsNone(self.bundle.upgrade_timer)
+        self.assertEqual([], self.bundle.jobs.list())
+        self.assertIsNone(self.bundle.operation.holder)
+
+    @patch.object(Firmware, "upgrade")
+    def test__start_pending_upgrade__busy(self, mock_upgrade):
+        """
+        start_pending_upgrade: try again later if another operation runs
+        """
+        now = int(time.time())
+        self.bundle.model.db["pendingUpgrade"] = {
+            "window": {"maxDelay": 0}, "plannedAt": now, "requestedAt": now}
+        self.bundle.operation.acquire("reset")
+        self.bundle.start_pending_upgrade()
+        pending = self.bundle.model.db["pendingUpgrade"]
+        self.assertTrue(pending["plannedAt"] >= now + firmware.OPERATION_RETRY)
+        self.assertTrue(self.bundle.upgrade_timer.is_alive())
+        self.assertEqual([], self.bundle.jobs.list())
+
+    @patch.object(Firmware, 'stage')
+    def test__put__stage(self, mock_stage):
+        """
+        put (/system/firmware): stage the firmware in background
+        """
+        msg = {
+            "id": 12345,
+            "method": "put",
+            "resource": "/system/firmware",
+            "data": {
+                "stage": 1
+            }
+        }
+
+        def resp(code=200, data=None):
             self.assertEqual(200, code)
+            self.assertEqual("stage", data["type"])
         message = Message(msg)
         self.bundle.put(message, response=resp, test=True)
+        self.bundle.jobs.stop()
+        mock_stage.assert_called_once_with(self.bundle.jobs.list()[0])
+
+    def test__get_jobs(self):
+        """
+        get (/system/firmware/jobs)
+        """
+        job = self.bundle.jobs.submit("upgrade", lambda job: None)
+        message = Message({"data": {}, "query": {}, "param": {}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual([job.id], [_["id"] for _ in data])
+        self.bundle.get_jobs(message=message, response=resp, test=True)
+
+    def test__get_job(self):
+        """
+        get (/system/firmware/jobs/:id)
+        """
+        job = self.bundle.jobs.submit("upgrade", lambda job: None)
+        message = Message({"data": {}, "query": {},
+                           "param": {"id": str(job.id)}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(200, code)
+            self.assertEqual(job.id, data["id"])
+        self.bundle.get_job(message=message, response=resp, test=True)
+
+    def test__get_job__not_found(self):
+        """
+        get (/system/firmware/jobs/:id): job not found
+        """
+        message = Message({"data": {}, "query": {}, "param": {"id": "100"}})
+
+        def resp(code=200, data=None):
+            self.assertEqual(404, code)
+            self.assertEqual(data, {"message": "Job not found."})
+        self.bundle.get_job(message=message, response=resp, test=True)
 
 
 if __name__ == "__main__":
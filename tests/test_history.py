@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import time
+import shutil
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.history import History
+    from fwutil.history import Phases
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+history_dir = "%s/data/history" % dirpath
+history_path = "%s/history.bin" % history_dir
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = History(history_path, capacity=4)
+
+    def tearDown(self):
+        shutil.rmtree(history_dir, ignore_errors=True)
+
+    def test__append(self):
+        """
+        append: one record
+        """
+        self.assertEqual(1, self.history.append(
+            "upgrade", "success", 1500000000, "1.0.0", "1.1.0",
+            {"download": 1.5, "install": 20.25}))
+        self.assertEqual([{
+            "id": 1, "timestamp": 1500000000, "type": "upgrade",
+            "outcome": "success", "from": "1.0.0", "to": "1.1.0",
+            "durations": {"download": 1.5, "install": 20.25, "reboot": 0}
+        }], self.history.records())
+
+    def test__append__ring(self):
+        """
+        append: the oldest records are overwritten, the file is bounded
+        """
+        for i in range(10):
+            self.history.append("upgrade", "success", 1500000000 + i)
+        size = os.path.getsize(history_path)
+        self.assertEqual([10, 9, 8, 7],
+                         [r["id"] for r in self.history.records()])
+        self.history.append("reset", "failed")
+        self.assertEqual(size, os.path.getsize(history_path))
+
+    def test__append__invalid(self):
+        """
+        append: unknown type or outcome
+        """
+        with self.assertRaises(ValueError):
+            self.history.append("downgrade", "success")
+        with self.assertRaises(ValueError):
+            self.history.append("upgrade", "unknown")
+        self.assertEqual([], self.history.records())
+
+    def test__reopen(self):
+        """
+        History: records are kept across instances, by the file capacity
+        """
+        for i in range(6):
+            self.history.append("upgrade", "success")
+        history = History(history_path, capacity=100)
+        self.assertEqual(4, history.capacity)
+        self.assertEqual([6, 5, 4, 3], [r["id"] for r in history.records()])
+
+    def test__reopen__invalid(self):
+        """
+        History: start a new file if it is not a history file
+        """
+        with open(history_path, "wb") as f:
+            f.write(b"garbage")
+        history = History(history_path)
+        self.assertEqual([], history.records())
+        self.assertEqual(1, history.append("upgrade", "failed"))
+
+    def test__query(self):
+        """
+        query: filters and pagination
+        """
+        for i, (type, outcome) in enumerate([
+                ("upgrade", "success"), ("upgrade", "failed"),
+                ("reset", "success"), ("upgrade", "failed")]):
+            self.history.append(type, outcome, 1500000000 + i)
+
+        total, items = self.history.query(outcome="failed")
+        self.assertEqual(2, total)
+        self.assertEqual([4, 2], [r["id"] for r in items])
+        total, items = self.history.query(type="upgrade", offset=1,
+                                          limit=1)
+        self.assertEqual(3, total)
+        self.assertEqual([2], [r["id"] for r in items])
+        total, items = self.history.query(since=1500000001,
+                                          until=1500000003)
+        self.assertEqual([3, 2], [r["id"] for r in items])
+
+
+class TestPhases(unittest.TestCase):
+
+    def test__enter(self):
+        """
+        enter: measure each phase
+        """
+        phases = Phases()
+        phases.enter("download")
+        time.sleep(0.05)
+        phases.enter("download")
+        phases.enter("install")
+        phases.enter(None)
+        self.assertGreaterEqual(phases.durations["download"], 0.04)
+        self.assertIn("install", phases.durations)
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("History Test")
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import logging
+import unittest
+import threading
+
+from mock import MagicMock
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil import jobs
+    from fwutil.jobs import Job
+    from fwutil.jobs import JobManager
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestJobClass(unittest.TestCase):
+
+    def test__set_state(self):
+        """
+        set_state: update the state and notify listeners
+        """
+        job = Job(1, "upgrade", None)
+        listener = MagicMock()
+        job.add_listener(listener)
+        job.set_state(jobs.DOWNLOADING, "mxcloud-cg")
+        listener.assert_called_once_with(job)
+        self.assertEqual(jobs.DOWNLOADING, job.state)
+        self.assertEqual("mxcloud-cg", job.message)
+
+    def test__set_state__listener_failed(self):
+        """
+        set_state: ignore failed listeners
+        """
+        job = Job(1, "upgrade", None)
+        job.add_listener(MagicMock(side_effect=Exception("error")))
+        job.set_state(jobs.INSTALLING)
+        self.assertEqual(jobs.INSTALLING, job.state)
+
+    def test__to_dict(self):
+        """
+        to_dict: job status
+        """
+        data = Job(1, "upgrade", None).to_dict()
+        self.assertEqual(1, data["id"])
+        self.assertEqual("upgrade", data["type"])
+        self.assertEqual(jobs.QUEUED, data["state"])
+        self.assertIn("createdAt", data)
+        self.assertIn("updatedAt", data)
+
+
+class TestJobManagerClass(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = JobManager(max_jobs=3)
+
+    def tearDown(self):
+        self.manager.stop()
+
+    def test__submit(self):
+        """
+        submit: run the job in background
+        """
+        done = threading.Event()
+
+        def func(job):
+            job.set_state(jobs.REBOOTING)
+            done.set()
+
+        job = self.manager.submit("upgrade", func)
+        self.assertEqual(1, job.id)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(jobs.REBOOTING, job.state)
+
+    def test__submit__queued(self):
+        """
+        submit: jobs run one by one
+        """
+        release = threading.Event()
+        first = self.manager.submit("upgrade", lambda job: release.wait())
+        second = self.manager.submit("upgrade", lambda job: None)
+        self.assertEqual(jobs.QUEUED, second.state)
+        self.assertEqual([first, second], self.manager.list())
+        release.set()
+
+    def test__submit__failed(self):
+        """
+        submit: job raised an exception
+        """
+        done = threading.Event()
+
+        def func(job):
+            done.set()
+            raise Exception("error")
+
+        job = self.manager.submit("upgrade", func)
+        self.assertTrue(done.wait(5))
+        self.manager.stop()
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertEqual("error", job.message)
+
+    def test__get(self):
+        """
+        get: by id
+        """
+        job = self.manager.submit("upgrade", lambda job: None)
+        self.assertEqual(job, self.manager.get(job.id))
+        self.assertIsNone(self.manager.get(100))
+
+    def test__list__max_jobs(self):
+        """
+        list: only keep the latest jobs
+        """
+        for _ in range(5):
+            self.manager.submit("upgrade", lambda job: None)
+        self.assertEqual([3, 4, 5],
+                         [job.id for job in self.manager.list()])
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Jobs Test")
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.metrics import Metrics
+    from fwutil.metrics import timed
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test__inc(self):
+        """
+        inc: counters are accumulated
+        """
+        self.metrics.inc("check.success")
+        self.metrics.inc("check.success", 2)
+        self.assertEqual({"check.success": 3},
+                         self.metrics.to_dict()["counters"])
+
+    def test__observe(self):
+        """
+        observe: the buckets are cumulative
+        """
+        for seconds in [0.001, 0.2, 2, 1000]:
+            self.metrics.observe("upgrade.script", seconds)
+        histogram = self.metrics.to_dict()["histograms"]["upgrade.script"]
+        self.assertEqual(4, histogram["count"])
+        self.assertAlmostEqual(1002.201, histogram["sum"])
+        buckets = dict((str(bound), count)
+                       for bound, count in histogram["buckets"])
+        self.assertEqual(1, buckets["0.005"])
+        self.assertEqual(2, buckets["0.5"])
+        self.assertEqual(3, buckets["900"])
+        self.assertEqual(4, buckets["+Inf"])
+
+    def test__timer(self):
+        """
+        timer: the block is observed even if it raises
+        """
+        with self.metrics.timer("check.policy"):
+            pass
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("check.policy"):
+                raise ValueError()
+        self.assertEqual(
+            2, self.metrics.to_dict()["histograms"]["check.policy"]["count"])
+
+    def test__disabled(self):
+        """
+        disabled: nothing is recorded
+        """
+        self.metrics.enabled = False
+        self.metrics.inc("check.success")
+        with self.metrics.timer("check.policy"):
+            pass
+        self.assertEqual({"enabled": False, "counters": {}, "histograms": {}},
+                         self.metrics.to_dict())
+
+    def test__reset(self):
+        """
+        reset: clear all counters and histograms
+        """
+        self.metrics.inc("check.success")
+        self.metrics.observe("check.policy", 0.1)
+        self.metrics.reset()
+        self.assertEqual({"enabled": True, "counters": {}, "histograms": {}},
+                         self.metrics.to_dict())
+
+    def test__to_prometheus(self):
+        """
+        to_prometheus: counters and histograms in the text format
+        """
+        self.metrics.inc("upgrade.failed")
+        self.metrics.observe("check.index_update", 0.02)
+        lines = self.metrics.to_prometheus().splitlines()
+        self.assertIn("# TYPE sanji_firmware_upgrade_failed_total counter",
+                      lines)
+        self.assertIn("sanji_firmware_upgrade_failed_total 1", lines)
+        self.assertIn(
+            'sanji_firmware_check_index_update_seconds_bucket{le="0.01"} 0',
+            lines)
+        self.assertIn(
+            'sanji_firmware_check_index_update_seconds_bucket{le="0.05"} 1',
+            lines)
+        self.assertIn(
+            'sanji_firmware_check_index_update_seconds_bucket{le="+Inf"} 1',
+            lines)
+        self.assertIn("sanji_firmware_check_index_update_seconds_count 1",
+                      lines)
+
+    def test__timed(self):
+        """
+        timed: observe the latency of a method
+        """
+        class Bundle(object):
+            metrics = self.metrics
+
+            @timed("route.get")
+            def get(self, value):
+                return value
+
+        self.assertEqual(1, Bundle().get(1))
+        self.assertEqual(Bundle.get.__name__, "get")
+        self.assertEqual(
+            1, self.metrics.to_dict()["histograms"]["route.get"]["count"])
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Metrics Test")
+    unittest.main()
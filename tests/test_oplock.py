@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.oplock import Busy
+    from fwutil.oplock import OperationLock
+    from fwutil.oplock import boot_id
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestOperationLock(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = []
+        self.lock = OperationLock(boot="boot-1", listener=self.saved.append)
+
+    def test__acquire(self):
+        """
+        acquire: hold the lock and notify the listener
+        """
+        holder, acquired = self.lock.acquire("upgrade", {"server": "a"})
+        self.assertTrue(acquired)
+        self.assertEqual("upgrade", holder["type"])
+        self.assertEqual("boot-1", holder["boot"])
+        self.assertEqual([holder], self.saved)
+
+    def test__acquire__same(self):
+        """
+        acquire: the same operation is replied instead of started again
+        """
+        holder, _ = self.lock.acquire("upgrade", {"server": "a"})
+        self.assertEqual((holder, False),
+                         self.lock.acquire("upgrade", {"server": "a"}))
+        self.assertEqual(1, len(self.saved))
+
+    def test__acquire__busy(self):
+        """
+        acquire: another operation is refused
+        """
+        holder, _ = self.lock.acquire("upgrade", {"server": "a"})
+        for type, request in [("reset", None), ("upgrade", {"server": "b"})]:
+            with self.assertRaises(Busy) as cm:
+                self.lock.acquire(type, request)
+            self.assertEqual(holder, cm.exception.holder)
+
+    def test__acquire__expired(self):
+        """
+        acquire: the expired holder is dropped
+        """
+        self.lock.acquire("upgrade", ttl=-1)
+        holder, acquired = self.lock.acquire("reset")
+        self.assertTrue(acquired)
+        self.assertEqual("reset", holder["type"])
+
+    def test__update(self):
+        """
+        update: keep more fields in the holder
+        """
+        self.lock.update(jobId=1)
+        self.assertEqual([], self.saved)
+        self.lock.acquire("stage")
+        self.lock.update(jobId=1)
+        self.assertEqual(1, self.lock.holder["jobId"])
+        self.assertEqual(1, self.saved[-1]["jobId"])
+
+    def test__release(self):
+        """
+        release: another operation can be started
+        """
+        self.lock.acquire("upgrade")
+        self.lock.release()
+        self.assertEqual(None, self.saved[-1])
+        self.assertTrue(self.lock.acquire("reset")[1])
+
+    def test__restore(self):
+        """
+        init: the holder of the same boot is still in progress
+        """
+        holder, _ = self.lock.acquire("upgrade")
+        restored = OperationLock(dict(holder), boot="boot-1")
+        with self.assertRaises(Busy):
+            restored.acquire("reset")
+
+    def test__restore__rebooted(self):
+        """
+        init: the holder of the previous boot is over
+        """
+        holder, _ = self.lock.acquire("upgrade")
+        saved = []
+        restored = OperationLock(dict(holder), boot="boot-2",
+                                 listener=saved.append)
+        self.assertIsNone(restored.holder)
+        self.assertEqual([None], saved)
+
+        holder["expiresAt"] = int(time.time()) - 1
+        self.assertIsNone(OperationLock(holder, boot="boot-1").holder)
+
+    def test__boot_id(self):
+        """
+        boot_id: None if unknown
+        """
+        self.assertIsNone(boot_id("/nonexistent/boot_id"))
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("OperationLock Test")
+    unittest.main()
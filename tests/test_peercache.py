@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import time
+import shutil
+import logging
+import unittest
+
+try:
+    from urllib2 import urlopen
+    from urllib2 import Request
+    from urllib2 import HTTPError
+except ImportError:
+    from urllib.request import urlopen
+    from urllib.request import Request
+    from urllib.error import HTTPError
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.peercache import ArtifactCache
+    from fwutil.peercache import PeerServer
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+cache_dir = "%s/data/peer" % dirpath
+source_dir = "%s/data/peer-source" % dirpath
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(source_dir)
+        self.cache = ArtifactCache(cache_dir, max_bytes=16, max_age=60)
+
+    def tearDown(self):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        shutil.rmtree(source_dir, ignore_errors=True)
+
+    def source(self, name, data):
+        path = os.path.join(source_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test__add(self):
+        """
+        add: keep the artifact with its signatures
+        """
+        self.cache.add("LATEST_FIRMWARE", self.source("image", b"firmware"),
+                       "sha256sum", "signature")
+        path = self.cache.get("LATEST_FIRMWARE")
+        with open(path, "rb") as f:
+            self.assertEqual(b"firmware", f.read())
+        with open(self.cache.get("LATEST_FIRMWARE.sha256")) as f:
+            self.assertEqual("sha256sum", f.read())
+        self.assertIsNotNone(self.cache.get("LATEST_FIRMWARE.sig"))
+        self.assertEqual({"artifacts": 1, "bytes": 8}, self.cache.stats())
+
+    def test__add__replace(self):
+        """
+        add: the artifact of the same name is replaced
+        """
+        self.cache.add("LATEST_FIRMWARE", self.source("old", b"old"),
+                       "old", "old")
+        self.cache.add("LATEST_FIRMWARE", self.source("new", b"new"), "new")
+        self.assertIsNone(self.cache.get("LATEST_FIRMWARE.sig"))
+        with open(self.cache.get("LATEST_FIRMWARE"), "rb") as f:
+            self.assertEqual(b"new", f.read())
+
+    def test__get__invalid(self):
+        """
+        get: names out of the cache are not found
+        """
+        for name in ["../test_peercache.py", ".hidden", "missing",
+                     "missing.sha256", ""]:
+            self.assertIsNone(self.cache.get(name))
+
+    def test__evict__size(self):
+        """
+        evict: the oldest artifacts are removed if over max_bytes
+        """
+        self.cache.add("first", self.source("first", b"x" * 8))
+        os.utime(os.path.join(cache_dir, "first"),
+                 (time.time() - 10, time.time() - 10))
+        self.cache.add("second", self.source("second", b"x" * 8))
+        self.assertEqual(2, self.cache.stats()["artifacts"])
+        self.cache.add("third", self.source("third", b"x" * 8))
+        self.assertIsNone(self.cache.get("first"))
+        self.assertIsNotNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("third"))
+
+    def test__evict__age(self):
+        """
+        evict: the expired artifacts are removed
+        """
+        self.cache.add("LATEST_FIRMWARE", self.source("image", b"firmware"),
+                       "sha256sum")
+        self.assertEqual([], self.cache.evict())
+        self.assertEqual(["LATEST_FIRMWARE"],
+                         self.cache.evict(now=time.time() + 60))
+        self.assertEqual([], os.listdir(cache_dir))
+
+
+class TestPeerServer(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(source_dir)
+        path = os.path.join(source_dir, "image")
+        with open(path, "wb") as f:
+            f.write(b"firmware")
+        self.cache = ArtifactCache(cache_dir)
+        self.cache.add("LATEST_FIRMWARE", path, "sha256sum")
+        self.server = PeerServer(self.cache, host="127.0.0.1").start()
+        self.url = "http://127.0.0.1:%d" % self.server.port
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        shutil.rmtree(source_dir, ignore_errors=True)
+
+    def test__get(self):
+        """
+        get: serve the cached artifact and its signature
+        """
+        self.assertEqual(b"firmware",
+                         urlopen(self.url + "/LATEST_FIRMWARE").read())
+        self.assertEqual(b"sha256sum",
+                         urlopen(self.url + "/LATEST_FIRMWARE.sha256").read())
+        # counted after written, the client may receive it first
+        deadline = time.time() + 5
+        while self.server.stats()["bytesServed"] < 17 and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        stats = self.server.stats()
+        self.assertEqual(2, stats["hits"])
+        self.assertEqual(17, stats["bytesServed"])
+
+    def test__get__range(self):
+        """
+        get: resume from the requested offset
+        """
+        resp = urlopen(Request(self.url + "/LATEST_FIRMWARE",
+                               headers={"Range": "bytes=4-"}))
+        self.assertEqual(206, resp.getcode())
+        self.assertEqual(b"ware", resp.read())
+
+    def test__get__not_found(self):
+        """
+        get: 404 for the artifacts not cached
+        """
+        for path in ["/LATEST_FIRMWARE.sig", "/../firmware.py", "/"]:
+            with self.assertRaises(HTTPError) as cm:
+                urlopen(self.url + path)
+            self.assertEqual(404, cm.exception.code)
+        self.assertEqual(3, self.server.stats()["misses"])
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("PeerCache Test")
+    unittest.main()
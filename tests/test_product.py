@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil import product
+    from fwutil.product import Strategy
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestProduct(unittest.TestCase):
+
+    def tearDown(self):
+        product.unregister("uc8200")
+
+    def test__parse_model(self):
+        """
+        parse_model: the first field of kversion without "-LX"
+        """
+        self.assertEqual("UC-8112", product.parse_model(
+            "UC-8112-LX version 1.0 Build 15102318\n"))
+        self.assertEqual("DA-820", product.parse_model("DA-820 version 1.0"))
+        with self.assertRaises(ValueError):
+            product.parse_model("\n")
+
+    def test__resolve(self):
+        """
+        resolve: the strategy of the family having the model
+        """
+        self.assertEqual("da820", product.resolve("DA-820").family)
+        self.assertEqual("mxcloud-cs", product.resolve("DA-820").package)
+        self.assertEqual("uc8100", product.resolve("UC-8162").family)
+        self.assertEqual("disk", product.resolve("MAR-2002").image)
+        self.assertIsNone(product.resolve("MAR-2002").package)
+        self.assertIsNone(product.resolve("XYZ-1000"))
+
+    def test__register(self):
+        """
+        register: a new family or model is resolved, the last one wins
+        """
+        product.register(Strategy("uc8200", ["UC-8210", "UC-8112"],
+                                  package="mxcloud-cg"))
+        self.assertEqual("uc8200", product.resolve("UC-8210").family)
+        self.assertEqual("uc8200", product.resolve("UC-8112").family)
+        self.assertEqual("uc8200", product.lookup("uc8200").family)
+
+        product.unregister("uc8200")
+        self.assertEqual("uc8100", product.resolve("UC-8112").family)
+        self.assertIsNone(product.lookup("uc8200"))
+
+    def test__env(self):
+        """
+        env: FAMILY and PACKAGE for the upgrade script
+        """
+        self.assertEqual({"FAMILY": "uc8100", "PACKAGE": "mxcloud-cg"},
+                         product.lookup("uc8100").env())
+        self.assertEqual({"FAMILY": "mar2000", "PACKAGE": ""},
+                         product.lookup("mar2000").env())
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Product Test")
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import logging
+import unittest
+
+from mock import patch
+from mock import MagicMock
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil import progress
+    from fwutil.progress import ProgressParser
+    from fwutil.progress import Throttle
+    from fwutil.progress import ProgressReporter
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestProgressParserClass(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = ProgressParser(tail=5)
+
+    def feed_log(self):
+        steps = []
+        with open("%s/mockdata/upgrade/apt.log" % dirpath) as f:
+            for line in f:
+                if self.parser.feed(line):
+                    steps.append((self.parser.phase, self.parser.percent))
+        return steps
+
+    def test__feed__apt(self):
+        """
+        feed: apt-get dist-upgrade output
+        """
+        steps = self.feed_log()
+        self.assertEqual([
+            (progress.DOWNLOADING, 27),
+            (progress.DOWNLOADING, 50),
+            (progress.INSTALLING, 50),
+            (progress.INSTALLING, 67),
+            (progress.INSTALLING, 85),
+            (progress.CONFIGURING, 92),
+            (progress.CONFIGURING, 99)], steps)
+
+    def test__feed__percent(self):
+        """
+        feed: percent printed by upgradehfm
+        """
+        self.assertTrue(self.parser.feed("Writing firmware ... 10%\n"))
+        self.assertEqual(progress.INSTALLING, self.parser.phase)
+        self.assertEqual(53, self.parser.percent)
+        self.assertFalse(self.parser.feed("Writing firmware ... 10%\n"))
+        self.assertTrue(self.parser.feed("Writing firmware ... 100%\n"))
+        self.assertEqual(85, self.parser.percent)
+
+    def test__feed__percent_never_decrease(self):
+        """
+        feed: percent never goes back
+        """
+        self.parser.feed("50%")
+        self.assertFalse(self.parser.feed("20%"))
+        self.assertEqual(67, self.parser.percent)
+
+    def test__feed__empty(self):
+        """
+        feed: ignore empty lines
+        """
+        self.assertFalse(self.parser.feed("\n"))
+        self.assertEqual(0, len(self.parser.tail))
+
+    def test__tail(self):
+        """
+        tail: only keep the last lines
+        """
+        self.feed_log()
+        self.assertEqual(5, len(self.parser.tail))
+        self.assertTrue(self.parser.tail[-1].startswith("Processing"))
+
+    def test__finish(self):
+        """
+        finish: 100 percent done
+        """
+        self.parser.finish()
+        self.assertEqual(progress.DONE, self.parser.phase)
+        self.assertEqual(100, self.parser.percent)
+
+
+class TestThrottleClass(unittest.TestCase):
+
+    @patch("fwutil.progress.time.time")
+    def test__ready(self, mock_time):
+        """
+        ready: at most once per interval
+        """
+        throttle = Throttle(2)
+        mock_time.return_value = 100
+        self.assertTrue(throttle.ready())
+        mock_time.return_value = 101
+        self.assertFalse(throttle.ready())
+        self.assertTrue(throttle.ready(force=True))
+        mock_time.return_value = 103
+        self.assertTrue(throttle.ready())
+
+
+class TestProgressReporterClass(unittest.TestCase):
+
+    def test__feed(self):
+        """
+        feed: report phase changes, throttle percent changes
+        """
+        callback = MagicMock()
+        reporter = ProgressReporter(callback, interval=60)
+        with open("%s/mockdata/upgrade/apt.log" % dirpath) as f:
+            for line in f:
+                reporter.feed(line)
+        reporter.finish()
+        self.assertEqual([
+            ((progress.DOWNLOADING, 27),),
+            ((progress.INSTALLING, 50),),
+            ((progress.CONFIGURING, 92),),
+            ((progress.DONE, 100),)], callback.call_args_list)
+
+    def test__feed__no_throttle(self):
+        """
+        feed: report every change
+        """
+        callback = MagicMock()
+        reporter = ProgressReporter(callback, interval=0)
+        with open("%s/mockdata/upgrade/apt.log" % dirpath) as f:
+            for line in f:
+                reporter.feed(line)
+        self.assertEqual(7, callback.call_count)
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Progress Test")
+    unittest.main()
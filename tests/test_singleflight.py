@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import time
+import logging
+import unittest
+import threading
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.singleflight import SingleFlight
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestSingleFlightClass(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.count = 0
+
+    def slow(self, value):
+        self.count += 1
+        self.started.set()
+        self.release.wait()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_concurrently(self, value, num=4):
+        results = []
+
+        def call():
+            try:
+                results.append(self.flight.do(self.slow, value))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(num)]
+        threads[0].start()
+        self.started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while self.flight.stats()["calls"] < num:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test__do(self):
+        """
+        do: run the function and return its result
+        """
+        self.release.set()
+        self.assertEqual(1, self.flight.do(self.slow, 1))
+        self.assertEqual(2, self.flight.do(self.slow, 2))
+        self.assertEqual(2, self.count)
+        self.assertEqual({"calls": 2, "executions": 2, "coalesced": 0},
+                         self.flight.stats())
+
+    def test__do__coalesced(self):
+        """
+        do: concurrent calls share one execution
+        """
+        results = self.run_concurrently("result")
+        self.assertEqual(["result"] * 4, results)
+        self.assertEqual(1, self.count)
+        self.assertEqual({"calls": 4, "executions": 1, "coalesced": 3},
+                         self.flight.stats())
+
+    def test__do__coalesced_exception(self):
+        """
+        do: concurrent calls share the exception
+        """
+        error = Exception("error")
+        results = self.run_concurrently(error)
+        self.assertEqual([error] * 4, results)
+        self.assertEqual(1, self.count)
+
+    def test__do__after_exception(self):
+        """
+        do: run again after a failed execution
+        """
+        self.release.set()
+        with self.assertRaises(Exception):
+            self.flight.do(self.slow, Exception("error"))
+        self.assertEqual(1, self.flight.do(self.slow, 1))
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("SingleFlight Test")
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import unittest
+
+from threading import RLock
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.store import ModelStore
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+store_dir = "%s/data/store" % dirpath
+
+
+class Model(object):
+    """
+    The attributes of ModelInitiator used by ModelStore.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.db_mutex = RLock()
+        self.json_db_path = "%s/firmware.json" % store_dir
+        self.backup_json_db_path = "%s/firmware.json.backup" % store_dir
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class TestModelStore(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(store_dir)
+        self.model = Model({"server": "factory"})
+        self.store = ModelStore(self.model, delay=0.1,
+                                critical=["upgrading"])
+
+    def tearDown(self):
+        self.store.flush()
+        shutil.rmtree(store_dir)
+
+    def test__save__coalesced(self):
+        """
+        save: changes close together are written once
+        """
+        for i in range(5):
+            self.model.db["count"] = i
+            self.store.save()
+        self.assertFalse(os.path.exists(self.model.json_db_path))
+        time.sleep(0.3)
+        self.assertEqual(4, read(self.model.json_db_path)["count"])
+        self.assertEqual({"requests": 5, "writes": 1, "immediate": 0,
+                          "coalesced": 4,
+                          "bytes": os.path.getsize(self.model.json_db_path)},
+                         self.store.stats())
+
+    def test__save__flush(self):
+        """
+        save: written now if flush is set
+        """
+        self.store.save(flush=True)
+        self.assertEqual({"server": "factory"},
+                         read(self.model.json_db_path))
+        self.assertEqual(1, self.store.stats()["immediate"])
+
+    def test__save__critical(self):
+        """
+        save: changes of the critical keys are written now
+        """
+        self.model.db["upgrading"] = 1
+        self.store.save()
+        self.assertEqual(1, read(self.model.json_db_path)["upgrading"])
+        self.model.db["server"] = "moxa"
+        self.store.save()
+        self.assertEqual("factory", read(self.model.json_db_path)["server"])
+        self.model.db.pop("upgrading")
+        self.store.save()
+        self.assertEqual({"server": "moxa"}, read(self.model.json_db_path))
+        self.assertEqual(2, self.store.stats()["writes"])
+
+    def test__flush(self):
+        """
+        flush: write the pending changes, nothing if no change
+        """
+        self.store.flush()
+        self.assertEqual(0, self.store.stats()["writes"])
+        self.store.save()
+        self.store.flush()
+        self.store.flush()
+        self.assertEqual(1, self.store.stats()["writes"])
+        time.sleep(0.2)
+        self.assertEqual(1, self.store.stats()["writes"])
+
+    def test__write__atomic(self):
+        """
+        _write: the previous db is kept as the backup
+        """
+        self.store.save(flush=True)
+        self.model.db["server"] = "moxa"
+        self.store.save(flush=True)
+        self.assertEqual("moxa", read(self.model.json_db_path)["server"])
+        self.assertEqual("factory",
+                         read(self.model.backup_json_db_path)["server"])
+        self.assertEqual(["firmware.json", "firmware.json.backup"],
+                         sorted(os.listdir(store_dir)))
+
+    def test__write__failed(self):
+        """
+        _write: the db is not touched if the data cannot be written
+        """
+        self.store.save(flush=True)
+        self.model.db["bad"] = object()
+        with self.assertRaises(TypeError):
+            self.store.save(flush=True)
+        self.assertEqual({"server": "factory"},
+                         read(self.model.json_db_path))
+        self.model.db.pop("bad")
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("ModelStore Test")
+    unittest.main()
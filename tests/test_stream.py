@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import hashlib
+import logging
+import unittest
+
+from StringIO import StringIO
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.stream import MAX_CHUNK_SIZE
+    from fwutil.stream import iter_chunks
+    from fwutil.stream import copy_stream
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+DATA = b"0123456789" * 1000
+
+
+class TestStream(unittest.TestCase):
+
+    def test__iter_chunks(self):
+        """
+        iter_chunks: fixed-size chunks
+        """
+        chunks = list(iter_chunks(StringIO(DATA), chunk_size=3000))
+        self.assertEqual([3000, 3000, 3000, 1000],
+                         [len(chunk) for chunk in chunks])
+        self.assertEqual(DATA, b"".join(chunks))
+
+    def test__iter_chunks__digests(self):
+        """
+        iter_chunks: update digests with every chunk
+        """
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+        list(iter_chunks(StringIO(DATA), chunk_size=7, digests=[sha256, md5]))
+        self.assertEqual(hashlib.sha256(DATA).hexdigest(), sha256.hexdigest())
+        self.assertEqual(hashlib.md5(DATA).hexdigest(), md5.hexdigest())
+
+    def test__iter_chunks__max_chunk_size(self):
+        """
+        iter_chunks: chunk size cannot exceed the memory ceiling
+        """
+        with self.assertRaises(ValueError):
+            list(iter_chunks(StringIO(DATA), chunk_size=MAX_CHUNK_SIZE + 1))
+        with self.assertRaises(ValueError):
+            list(iter_chunks(StringIO(DATA), chunk_size=0))
+
+    def test__iter_chunks__bounded_read(self):
+        """
+        iter_chunks: never read more than a chunk at once
+        """
+        sizes = []
+
+        class Source(object):
+            def __init__(self):
+                self.fp = StringIO(DATA)
+
+            def read(self, size=-1):
+                sizes.append(size)
+                return self.fp.read(size)
+
+        list(iter_chunks(Source(), chunk_size=1024))
+        self.assertEqual(set([1024]), set(sizes))
+
+    def test__copy_stream(self):
+        """
+        copy_stream: copy and hash in one pass
+        """
+        dst = StringIO()
+        sha256 = hashlib.sha256()
+        size = copy_stream(StringIO(DATA), dst, chunk_size=4096,
+                           digests=[sha256])
+        self.assertEqual(len(DATA), size)
+        self.assertEqual(DATA, dst.getvalue())
+        self.assertEqual(hashlib.sha256(DATA).hexdigest(), sha256.hexdigest())
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Stream Test")
+    unittest.main()
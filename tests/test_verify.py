@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import base64
+import hashlib
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.verify import load_public_key
+    from fwutil.verify import verify_signature
+    from fwutil.verify import verify_digest
+    from fwutil.verify import hash_file
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+dirpath = os.path.dirname(os.path.realpath(__file__))
+keydir = "%s/mockdata/keys" % dirpath
+
+
+class TestVerify(unittest.TestCase):
+
+    def setUp(self):
+        self.key = load_public_key("%s/firmware.pem" % keydir)
+        with open("%s/firmware.sig" % keydir) as f:
+            self.signature = f.read()
+        self.digest = hashlib.sha256(b"firmware")
+        self.checksum = "%s  LATEST_FIRMWARE\n" % self.digest.hexdigest()
+
+    def test__load_public_key(self):
+        """
+        load_public_key: 2048 bits RSA public key
+        """
+        modulus, exponent = self.key
+        self.assertEqual(2048, modulus.bit_length())
+        self.assertEqual(65537, exponent)
+
+    def test__load_public_key__invalid(self):
+        """
+        load_public_key: not a PEM file
+        """
+        with self.assertRaises(ValueError):
+            load_public_key("%s/firmware.sig" % keydir)
+
+    def test__verify_signature(self):
+        """
+        verify_signature: signed by "openssl dgst -sha256 -sign"
+        """
+        raw = base64.b64decode(self.signature)
+        self.assertTrue(verify_signature(self.digest.digest(), raw, self.key))
+        self.assertFalse(verify_signature(
+            hashlib.sha256(b"corrupted").digest(), raw, self.key))
+        self.assertFalse(verify_signature(self.digest.digest(), raw[1:],
+                                          self.key))
+
+    def test__verify_digest(self):
+        """
+        verify_digest: checksum and signature
+        """
+        result = verify_digest(self.digest, self.checksum, self.signature,
+                               self.key)
+        self.assertEqual({"sha256": self.digest.hexdigest(),
+                          "checksum": True, "signature": True,
+                          "verified": True}, result)
+
+    def test__verify_digest__checksum_only(self):
+        """
+        verify_digest: no public key
+        """
+        result = verify_digest(self.digest, self.checksum)
+        self.assertTrue(result["checksum"])
+        self.assertIsNone(result["signature"])
+        self.assertTrue(result["verified"])
+
+    def test__verify_digest__signature_only(self):
+        """
+        verify_digest: no checksum published
+        """
+        result = verify_digest(self.digest, None, self.signature, self.key)
+        self.assertIsNone(result["checksum"])
+        self.assertTrue(result["verified"])
+
+    def test__verify_digest__nothing(self):
+        """
+        verify_digest: nothing to verify
+        """
+        self.assertFalse(verify_digest(self.digest)["verified"])
+
+    def test__verify_digest__checksum_mismatched(self):
+        """
+        verify_digest: checksum mismatched
+        """
+        with self.assertRaises(IOError):
+            verify_digest(hashlib.sha256(b"corrupted"), self.checksum)
+
+    def test__verify_digest__signature_mismatched(self):
+        """
+        verify_digest: signature mismatched
+        """
+        with self.assertRaises(IOError):
+            verify_digest(hashlib.sha256(b"corrupted"), None,
+                          self.signature, self.key)
+        with self.assertRaises(IOError):
+            verify_digest(self.digest, None, "not base64!", self.key)
+
+    def test__verify_digest__signature_missing(self):
+        """
+        verify_digest: signature is required if the key exists
+        """
+        with self.assertRaises(IOError):
+            verify_digest(self.digest, self.checksum, None, self.key)
+
+    def test__hash_file(self):
+        """
+        hash_file: hash in chunks
+        """
+        path = "%s/firmware.pem" % keydir
+        with open(path, "rb") as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        self.assertEqual(expected, hash_file(path, chunk_size=16).hexdigest())
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Verify Test")
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import logging
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../")
+    from fwutil.window import validate_window
+    from fwutil.window import plan_window
+    from fwutil.window import window_expired
+    from fwutil.window import device_id
+except ImportError as e:
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+NOW = 1500000000
+
+
+class TestWindow(unittest.TestCase):
+
+    def test__validate_window(self):
+        """
+        validate_window: valid windows
+        """
+        validate_window({})
+        validate_window({"start": NOW, "end": NOW + 60, "maxDelay": 30,
+                         "slot": "hash"})
+
+    def test__validate_window__invalid(self):
+        """
+        validate_window: invalid windows
+        """
+        for window in [1, {"begin": NOW}, {"start": -1}, {"end": "now"},
+                       {"maxDelay": True}, {"start": NOW, "end": NOW},
+                       {"slot": "first"}]:
+            with self.assertRaises(ValueError):
+                validate_window(window)
+
+    def test__plan_window__now(self):
+        """
+        plan_window: start now without delay
+        """
+        self.assertEqual(NOW, plan_window({}, now=NOW))
+
+    def test__plan_window__start(self):
+        """
+        plan_window: start at the window start
+        """
+        self.assertEqual(NOW + 100, plan_window({"start": NOW + 100},
+                                                now=NOW))
+        self.assertEqual(NOW, plan_window({"start": NOW - 100}, now=NOW))
+
+    def test__plan_window__random(self):
+        """
+        plan_window: random delay inside the window
+        """
+        window = {"start": NOW + 100, "end": NOW + 200}
+        planned = [plan_window(window, now=NOW) for _ in range(100)]
+        self.assertTrue(all([NOW + 100 <= t <= NOW + 200 for t in planned]))
+        self.assertGreater(len(set(planned)), 1)
+
+    def test__plan_window__max_delay(self):
+        """
+        plan_window: the delay is limited by maxDelay and end
+        """
+        planned = [plan_window({"maxDelay": 10, "end": NOW + 5}, now=NOW)
+                   for _ in range(100)]
+        self.assertTrue(all([NOW <= t <= NOW + 5 for t in planned]))
+        planned = [plan_window({"maxDelay": 10}, now=NOW)
+                   for _ in range(100)]
+        self.assertTrue(all([NOW <= t <= NOW + 10 for t in planned]))
+
+    def test__plan_window__hash(self):
+        """
+        plan_window: deterministic slot of the device
+        """
+        window = {"maxDelay": 3600, "slot": "hash"}
+        self.assertEqual(plan_window(window, now=NOW, device="a"),
+                         plan_window(window, now=NOW, device="a"))
+        slots = set([plan_window(window, now=NOW, device=str(i))
+                     for i in range(20)])
+        self.assertGreater(len(slots), 10)
+        self.assertTrue(all([NOW <= t <= NOW + 3600 for t in slots]))
+        self.assertEqual(plan_window(window, now=NOW),
+                         plan_window(window, now=NOW, device=device_id()))
+
+    def test__window_expired(self):
+        """
+        window_expired: closed after end
+        """
+        self.assertFalse(window_expired({}, now=NOW))
+        self.assertFalse(window_expired({"end": NOW + 1}, now=NOW))
+        self.assertTrue(window_expired({"end": NOW}, now=NOW))
+
+
+if __name__ == "__main__":
+    FORMAT = "%(asctime)s - %(levelname)s - %(lineno)s - %(message)s"
+    logging.basicConfig(level=20, format=FORMAT)
+    logger = logging.getLogger("Window Test")
+    unittest.main()
@@ -2,11 +2,40 @@
 
 # MAR-2000: upgradehfm -y /run/shm/LATEST_FIRMWARE
 # UC-8100: apt-get update; apt-get upgrade uc8100-system
+#
+# Usage: FAMILY=<family> PACKAGE=<package> upgrade.sh [upgrade|stage]
+#   upgrade: upgrade the firmware (default)
+#            STAGED=1: only install the packages downloaded by "stage"
+#            FIRMWARE_IMAGE: image for upgradehfm
+#   stage:   download the packages only
+#   FAMILY, PACKAGE: the product family and its package (empty if
+#            upgraded by an image), given by the bundle (see
+#            fwutil/product.py)
+
+ACTION=${1:-upgrade}
+FIRMWARE_IMAGE=${FIRMWARE_IMAGE:-/run/shm/LATEST_FIRMWARE}
+if [ "$STAGED" = "1" ]; then
+	NO_DOWNLOAD="--no-download"
+fi
 
 mar2000 ()
 {
-	upgradehfm -y /run/shm/LATEST_FIRMWARE
+	upgradehfm -y $FIRMWARE_IMAGE
+	if [ $? -ne 0 ]; then
+		return 1
+	fi
+	return 0
+}
+
+# refresh the firmware repository only
+apt_update ()
+{
+	apt-get update \
+		-o Dir::Etc::sourcelist=sources.list.d/mxcloud.list \
+		-o Dir::Etc::sourceparts=- \
+		-o APT::Get::List-Cleanup=0
 	if [ $? -ne 0 ]; then
+		echo "Cannot update the database, please check the internet."
 		return 1
 	fi
 	return 0
@@ -14,12 +43,10 @@ mar2000 ()
 
 uc8100 ()
 {
-	#apt-get update
-	#if [ $? -ne 0 ]; then
-	#	echo "Cannot update the database, please check the internet."
-	#	return 1
-	#fi
-	apt-get dist-upgrade --only-upgrade -y mxcloud-cg
+	if [ -z "$NO_DOWNLOAD" ]; then
+		apt_update || return 1
+	fi
+	apt-get dist-upgrade --only-upgrade -y $NO_DOWNLOAD $PACKAGE
 	#apt-get install --only-upgrade uc8100-system
 	if [ $? -ne 0 ]; then
                 dpkg --configure -a
@@ -36,12 +63,10 @@ uc8100 ()
 
 da820 ()
 {
-	#apt-get update
-	#if [ $? -ne 0 ]; then
-	#	echo "Cannot update the database, please check the internet."
-	#	return 1
-	#fi
-	apt-get upgrade --only-upgrade -y mxcloud-cs
+	if [ -z "$NO_DOWNLOAD" ]; then
+		apt_update || return 1
+	fi
+	apt-get upgrade --only-upgrade -y $NO_DOWNLOAD $PACKAGE
 	#apt-get install --only-upgrade da820-system
 	if [ $? -ne 0 ]; then
 		return 1
@@ -49,16 +74,41 @@ da820 ()
 	return 0
 }
 
-PRODUCT=$(kversion | cut -d" " -f1 | sed -e "s/-LX//g")
-case $PRODUCT in
-	"DA-820")
-		da820
-		;;
-	"UC-8100" | "UC-8112" | "UC-8131" | "UC-8132" | "UC-8162")
-		uc8100
+stage ()
+{
+	apt_update || return 1
+	# apt keeps the partial downloads and resumes them
+	apt-get install --only-upgrade --download-only -y $1
+	if [ $? -ne 0 ]; then
+		return 1
+	fi
+	return 0
+}
+
+# the product is detected by the bundle only, it is never guessed here
+if [ -z "$FAMILY" ]; then
+	echo "FAMILY is not given, the product is unknown." >&2
+	exit 1
+fi
+
+case $ACTION in
+	"stage")
+		if [ -z "$PACKAGE" ]; then
+			echo "Nothing to stage for $FAMILY."
+			exit 1
+		fi
+		stage $PACKAGE
 		;;
-	"MAR-2000" | "MAR-2001" | "MAR-2002")
-		mar2000
+	*)
+		case $FAMILY in
+			mar2000 | uc8100 | da820)
+				$FAMILY
+				;;
+			*)
+				echo "Cannot upgrade $FAMILY." >&2
+				exit 1
+				;;
+		esac
 		;;
 esac
 exit $?